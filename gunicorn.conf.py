@@ -0,0 +1,55 @@
+"""
+Gunicorn settings for the web admin panel (webapp.app:app).
+
+Used by run_services.py (WEB_SERVER=gunicorn, the default) and picked up
+automatically when gunicorn is started from the project root:
+
+    gunicorn webapp.app:app
+
+kill -HUP <master pid> (run_services.py forwards SIGHUP to the web process)
+re-reads this file and replaces the workers without dropping requests.
+With WEB_PRELOAD=1 (the default) the workers are forked from the code the
+master already imported, so HUP does NOT pick up code changes; deploy new
+code with a full restart, or run with WEB_PRELOAD=0 to make HUP reload it.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+# gthread: each worker serves WEB_THREADS requests at once; the CSV export streams,
+# so a slow download occupies one thread, not a whole worker
+worker_class = "gthread"
+workers = int(os.getenv('WEB_WORKERS', '2'))
+threads = int(os.getenv('WEB_THREADS', '4'))
+
+# Import the app once in the master: workers fork with it loaded (faster start,
+# shared memory) and all of them see the same generated FLASK secret key.
+# The price: SIGHUP restarts workers from the already loaded code (see above)
+preload_app = os.getenv('WEB_PRELOAD', '1') == '1'
+
+keepalive = int(os.getenv('WEB_KEEPALIVE', '5'))
+timeout = int(os.getenv('WEB_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+
+# Optional worker recycling (0 = off); a recycled worker drops its keep-alive connections
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', '50'))
+
+accesslog = os.getenv('WEB_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('WEB_LOG_LEVEL', 'info')
+proc_name = 'shveiny-hub-web'
+
+
+def post_fork(server, worker):
+    """Do not reuse the master's DB connections and background threads in a worker"""
+    try:
+        from utils.database import engine
+        engine.dispose(close=False)
+    except Exception as e:
+        server.log.warning(f"Could not reset DB pool in worker {worker.pid}: {e}")
+    try:
+        from webapp.notifications import notification_worker
+        notification_worker.ensure_started()
+    except Exception as e:
+        server.log.warning(f"Could not start notification worker in {worker.pid}: {e}")
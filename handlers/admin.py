@@ -27,8 +27,14 @@ from utils.database import (
     get_orders_by_status,
     get_order,
     update_order_status,
-    get_admins,
+    get_admin_user_ids,
+    count_broadcast_recipients,
+    create_broadcast,
+    get_broadcast,
+    get_broadcast_report,
+    update_broadcast,
 )
+from utils.broadcast import broadcaster, format_progress, format_failure_breakdown, stop_button
 from keyboards import (
     get_admin_main_menu,
     get_admin_orders_submenu,
@@ -71,16 +77,11 @@ def get_admin_ids() -> List[int]:
     """Вернуть список admin ids (ENV + БД)"""
     ids = list(ENV_ADMIN_IDS)  # Копируем список из ENV
     try:
-        db_admins = get_admins() if callable(get_admins) else []
-        for a in db_admins:
-            try:
-                uid = int(a.user_id)
-                if uid not in ids:
-                    ids.append(uid)
-            except Exception:
-                pass
+        for uid in get_admin_user_ids():
+            if uid not in ids:
+                ids.append(uid)
     except Exception:
-        logger.debug("get_admins not available or failed")
+        logger.debug("get_admin_user_ids failed")
     return ids
 
 
@@ -179,7 +180,9 @@ async def admin_stats(update: Update,
 
     try:
         from utils.database import get_statistics
+        from utils.answer_pipeline import answer_pipeline
         stats = get_statistics()
+        answers = answer_pipeline.stats()
         text = ("📊 *Статистика бота*\n\n"
                 f"👥 Пользователей: {stats.get('total_users', 0)}\n"
                 f"📦 Всего заказов: {stats.get('total_orders', 0)}\n"
@@ -188,7 +191,9 @@ async def admin_stats(update: Update,
                 f"✅ Выполнено: {stats.get('completed', 0)}\n"
                 f"📤 Выдано: {stats.get('issued', 0)}\n"
                 f"🚫 Заблокировано: {stats.get('blocked_users', 0)}\n"
-                f"🛑 Спам-записей: {stats.get('spam_count', 0)}")
+                f"🛑 Спам-записей: {stats.get('spam_count', 0)}\n"
+                f"🤖 Ответов без GigaChat: {answers['model_calls_avoided']} из {answers['total']} "
+                f"({answers['avoided_rate']}%)")
         
         keyboard = InlineKeyboardMarkup([[
             InlineKeyboardButton("🔄 Обновить", callback_data="admin_stats"),
@@ -365,6 +370,7 @@ async def broadcast_start(update: Update,
     )
     
     keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📊 Отчёт по рассылкам", callback_data="broadcast_report")],
         [InlineKeyboardButton("❌ Отмена", callback_data="broadcast_cancel")]
     ])
     
@@ -388,9 +394,8 @@ async def broadcast_preview(update: Update,
     context.user_data["broadcast_mode"] = False
     
     try:
-        users = get_all_users()
-        user_count = len(users)
-    except:
+        user_count = count_broadcast_recipients()
+    except Exception:
         user_count = "?"
     
     preview_text = (
@@ -457,6 +462,27 @@ async def broadcast_edit(update: Update,
     await query.edit_message_text(text, reply_markup=keyboard, parse_mode="Markdown")
 
 
+async def _start_broadcast(context: ContextTypes.DEFAULT_TYPE,
+                           admin_id: int,
+                           message_text: str,
+                           progress_message) -> None:
+    """Создать задание рассылки и запустить его в фоне"""
+    total = await asyncio.to_thread(count_broadcast_recipients)
+    broadcast_id = await asyncio.to_thread(create_broadcast, admin_id, message_text, total)
+
+    await progress_message.edit_text(
+        format_progress(broadcast_id, 0, 0, total),
+        reply_markup=stop_button(broadcast_id),
+        parse_mode="Markdown"
+    )
+    await asyncio.to_thread(update_broadcast, broadcast_id,
+                            progress_chat_id=progress_message.chat_id,
+                            progress_message_id=progress_message.message_id)
+
+    broadcaster.start(context.application, broadcast_id)
+    logger.info(f"Broadcast #{broadcast_id} started by {admin_id} for {total} users")
+
+
 async def broadcast_confirm(update: Update,
                             context: ContextTypes.DEFAULT_TYPE) -> None:
     """Подтвердить и отправить рассылку"""
@@ -475,36 +501,10 @@ async def broadcast_confirm(update: Update,
     context.user_data["broadcast_text"] = None
     
     try:
-        users = get_all_users()
+        await _start_broadcast(context, user_id, message_text, query.message)
     except Exception:
-        logger.exception("Ошибка при получении списка пользователей")
-        await query.edit_message_text("❌ Не удалось получить список пользователей.")
-        return
-    
-    await query.edit_message_text(f"📤 Запускаю рассылку {len(users)} пользователям...")
-    
-    sent = 0
-    failed = 0
-    delay = float(os.getenv("BROADCAST_DELAY", "0.05"))
-    
-    for u in users:
-        try:
-            await context.bot.send_message(
-                chat_id=int(u.user_id),
-                text=message_text,
-                parse_mode="Markdown"
-            )
-            sent += 1
-            if delay:
-                await asyncio.sleep(delay)
-        except Exception:
-            failed += 1
-    
-    await context.bot.send_message(
-        chat_id=user_id,
-        text=f"✅ *Рассылка завершена*\n\n📨 Отправлено: {sent}\n❌ Ошибок: {failed}",
-        parse_mode="Markdown"
-    )
+        logger.exception("Ошибка при запуске рассылки")
+        await query.edit_message_text("❌ Не удалось запустить рассылку.")
 
 
 async def broadcast_send(update: Update,
@@ -532,39 +532,78 @@ async def broadcast_send(update: Update,
     # Выключаем режим рассылки после получения сообщения
     context.user_data["broadcast_mode"] = False
 
+    status_msg = await update.message.reply_text("📤 Запускаю рассылку...")
     try:
-        users = get_all_users()
+        await _start_broadcast(context, user_id, message_text, status_msg)
     except Exception:
-        logger.exception("Ошибка при получении списка пользователей")
-        await update.message.reply_text(
-            "❌ Не удалось получить список пользователей.")
-        return
+        logger.exception("Ошибка при запуске рассылки")
+        await status_msg.edit_text("❌ Не удалось запустить рассылку.")
 
-    sent = 0
-    failed = 0
-    delay = float(os.getenv("BROADCAST_DELAY", "0.05"))
 
-    status_msg = await update.message.reply_text(
-        f"📤 Запускаю рассылку {len(users)} пользователям...")
+async def broadcast_stop(update: Update,
+                         context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Остановить идущую рассылку (кнопка в сообщении с прогрессом)"""
+    query = update.callback_query
+    
+    user_id = update.effective_user.id
+    if not is_user_admin(user_id):
+        await query.answer("⛔ Нет доступа")
+        return
+    
+    broadcast_id = int(query.data.rsplit("_", 1)[1])
     
-    for u in users:
+    if broadcaster.is_running(broadcast_id):
+        broadcaster.stop(broadcast_id)
+        await query.answer("Останавливаю рассылку...")
+    else:
+        # Задача уже не выполняется (например, бот перезапускался) — просто закрываем задание
+        broadcast = await asyncio.to_thread(get_broadcast, broadcast_id)
+        if broadcast and broadcast.status == "running":
+            await asyncio.to_thread(update_broadcast, broadcast_id, status="cancelled")
+        await query.answer("Рассылка остановлена")
         try:
-            await context.bot.send_message(chat_id=int(u.user_id),
-                                           text=message_text,
-                                           parse_mode="Markdown")
-            sent += 1
-            if delay:
-                await asyncio.sleep(delay)
-            
-            if sent % 10 == 0:
-                try:
-                    await status_msg.edit_text(f"📤 Отправлено: {sent} / {len(users)}...")
-                except: pass
+            await query.edit_message_reply_markup(reply_markup=None)
         except Exception:
-            failed += 1
-            
-    await update.message.reply_text(
-        f"✅ Рассылка завершена.\nОтправлено: {sent}\nОшибок: {failed}.")
+            pass
+
+
+async def broadcast_report(update: Update,
+                           context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/broadcasts — доставляемость и скорость последних рассылок"""
+    user_id = update.effective_user.id
+    if not is_user_admin(user_id):
+        if update.effective_message:
+            await update.effective_message.reply_text("⛔ У вас нет доступа.")
+        return
+
+    if update.callback_query:
+        await update.callback_query.answer()
+
+    try:
+        report = await asyncio.to_thread(get_broadcast_report, 10)
+        if not report:
+            await update.effective_message.reply_text("📣 Рассылок ещё не было.")
+            return
+
+        status_labels = {'running': '📤 идёт', 'completed': '✅ завершена', 'cancelled': '⏹ остановлена'}
+        text = "📣 *Последние рассылки:*\n\n"
+        for r in report:
+            date_str = r['created_at'].strftime('%d.%m %H:%M') if r['created_at'] else '—'
+            text += (
+                f"*#{r['id']}* {date_str} • {status_labels.get(r['status'], r['status'])}\n"
+                f"   👥 {r['processed']} / {r['total']} • доставлено {r['by_status'].get('sent', 0)} "
+                f"({r['delivery_rate']}%)\n"
+                f"   ⚡ {r['throughput']} сообщ./с за {int(r['duration'] // 60)} мин {int(r['duration'] % 60)} с\n"
+            )
+            breakdown = format_failure_breakdown(r['by_status'])
+            if breakdown:
+                text += breakdown + "\n"
+            text += "\n"
+        await update.effective_message.reply_text(text, parse_mode="Markdown")
+    except Exception:
+        logger.exception("Ошибка при получении отчёта по рассылкам")
+        if update.effective_message:
+            await update.effective_message.reply_text("❌ Ошибка при получении отчёта по рассылкам.")
 
 
 # ---------------- Управление правами ----------------
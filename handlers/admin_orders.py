@@ -17,6 +17,8 @@ from utils.database import (
     search_orders_by_name,
     search_orders_by_id,
     get_orders_count_by_status,
+    get_order_status_counts,
+    get_orders_page,
 )
 from handlers.orders import format_order_id, SERVICE_NAMES
 from handlers.admin import is_user_admin
@@ -206,10 +208,9 @@ async def show_orders_list(
     # Пытаемся получить статус из callback_data, если он там есть
     if query and query.data and query.data.startswith("olist_"):
         try:
-            parts = query.data.split("_")
-            if len(parts) >= 3:
-                status = parts[1]
-                page = int(parts[2])
+            # Статус может содержать "_" (in_progress), номер страницы — всегда последний
+            status, page_str = query.data[len("olist_"):].rsplit("_", 1)
+            page = int(page_str)
         except Exception:
             pass
     
@@ -225,45 +226,30 @@ async def show_orders_list(
             await query.answer("⛔ Нет доступа", show_alert=True)
         return
     
-    # Загружаем заказы в зависимости от фильтра
-    from utils.database import get_session, Order
-    session = get_session()
+    # Нормализуем статус: убираем эмодзи и пробелы
+    current_status = str(status).lower()
+    for emoji in ["📊", "📦", "📋", "⏳", "✅", "📤"]:
+        current_status = current_status.replace(emoji, "")
+    current_status = current_status.strip()
     
-    # ПРИНУДИТЕЛЬНО СБРАСЫВАЕМ КЭШ СЕССИИ И ЗАКРЫВАЕМ ПРЕДЫДУЩИЕ СОЕДИНЕНИЯ
-    session.expire_all()
+    logger.info(f"show_orders_list called with status: '{status}', normalized: '{current_status}'")
     
+    # Проверка на "Все заказы" - максимально широкая
+    is_all = (not current_status or 
+              current_status == "all" or 
+              "все" in current_status or 
+              "all" in current_status or
+              status == "all")
+    if is_all:
+        status = "all"  # Нормализуем для дальнейшего использования
+    
+    # Количество берём из кэшированного GROUP BY, в память грузим только текущую страницу
     try:
-        # Нормализуем статус: убираем эмодзи и пробелы
-        current_status = str(status).lower()
-        for emoji in ["📊", "📦", "📋", "⏳", "✅", "📤"]:
-            current_status = current_status.replace(emoji, "")
-        current_status = current_status.strip()
-        
-        # ЛОГИРУЕМ ЧТО ПРИШЛО
-        logger.info(f"show_orders_list called with status: '{status}', normalized: '{current_status}'")
-        
-        # Проверка на "Все заказы" - максимально широкая
-        is_all = (not current_status or 
-                  current_status == "all" or 
-                  "все" in current_status or 
-                  "all" in current_status or
-                  status == "all")
-        
-        if is_all:
-            # Прямой запрос ВСЕХ заказов
-            orders = session.query(Order).order_by(Order.created_at.desc()).all()
-            logger.info(f"Loaded ALL orders: {len(orders)} items")
-            status = "all" # Нормализуем для дальнейшего использования
-        else:
-            orders = session.query(Order).filter(Order.status == current_status).order_by(Order.created_at.desc()).all()
-            logger.info(f"Loaded orders for status '{current_status}': {len(orders)} items")
+        counts = get_order_status_counts([], cache_key="")
+        total_orders = counts['all'] if is_all else counts.get(current_status, 0)
     except Exception as e:
-        logger.error(f"Error loading orders: {e}")
-        orders = []
-    finally:
-        session.close()
-    
-    total_orders = len(orders)
+        logger.error(f"Error counting orders: {e}")
+        total_orders = 0
     
     if total_orders == 0:
         text = f"📋 *{STATUS_EMOJI.get(status, '📦')} {STATUS_NAMES.get(status, status)}*\n\n📭 Заказов нет"
@@ -292,9 +278,12 @@ async def show_orders_list(
     total_pages = (total_orders + ORDERS_PER_PAGE - 1) // ORDERS_PER_PAGE
     page = max(0, min(page, total_pages - 1))
     
-    start_idx = page * ORDERS_PER_PAGE
-    end_idx = start_idx + ORDERS_PER_PAGE
-    current_orders = orders[start_idx:end_idx]
+    try:
+        current_orders, _ = get_orders_page([], status=None if is_all else current_status,
+                                            limit=ORDERS_PER_PAGE, offset=page * ORDERS_PER_PAGE)
+    except Exception as e:
+        logger.error(f"Error loading orders: {e}")
+        current_orders = []
     
     text = f"📋 *{STATUS_EMOJI.get(status, '📦')} {STATUS_NAMES.get(status, status)}* — {total_orders} шт.\n\n"
     
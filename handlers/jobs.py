@@ -0,0 +1,108 @@
+"""
+Отложенные задачи по заказам (выполняются utils.scheduler):
+- review_request — запрос отзыва через REVIEW_REQUEST_DELAY после выдачи заказа;
+- client_reminder — напоминание клиенту принести вещь по новому заказу;
+- stuck_alert — сводка админам о заказах, которые приняты, но не взяты в работу.
+
+Перед отправкой каждая задача перечитывает заказ: если статус уже сменился,
+задача просто закрывается.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
+
+from utils.broadcast import telegram_limiter
+from utils.database import (get_order, get_orders_by_ids, mark_feedback_requested, mark_client_reminded,
+                            CLIENT_REMINDER_DELAY)
+from handlers.orders import format_order_id
+from handlers.reviews import request_review
+
+logger = logging.getLogger(__name__)
+
+# Пока заказ висит в «Принят», сводка повторяется с этим интервалом
+STUCK_ALERT_REPEAT = timedelta(hours=int(os.getenv('STUCK_ALERT_REPEAT_HOURS', '24')))
+
+
+async def send_review_request(application, job):
+    """Запросить отзыв по выданному заказу"""
+    order = await asyncio.to_thread(get_order, job.order_id)
+    if not order or order.status != 'completed' or order.feedback_requested:
+        return None
+
+    await telegram_limiter.acquire()
+    await request_review(application, int(order.user_id), int(order.id))
+    await asyncio.to_thread(mark_feedback_requested, int(order.id))
+    return None
+
+
+def _days_ago(days: int) -> str:
+    """«1 день назад», «3 дня назад», «5 дней назад»"""
+    if days <= 0:
+        return "сегодня"
+    if days % 10 == 1 and days % 100 != 11:
+        word = "день"
+    elif 2 <= days % 10 <= 4 and not 12 <= days % 100 <= 14:
+        word = "дня"
+    else:
+        word = "дней"
+    return f"{days} {word} назад"
+
+
+async def send_client_reminder(application, job):
+    """Напомнить клиенту, что мы ждём вещь по новому заказу"""
+    order = await asyncio.to_thread(get_order, job.order_id)
+    if not order or order.status != 'new' or order.client_reminded:
+        return None
+
+    fid = format_order_id(int(order.id), order.created_at)
+    client_msg = (f"🧵 *Швейный HUB*\n\nЗдравствуйте, {order.client_name or 'дорогой клиент'}! 😊\n"
+                  f"Вы оформили заказ *{fid}* {_days_ago(CLIENT_REMINDER_DELAY.days)}, но мы его еще не получили.\n\n"
+                  f"📍 Мы очень ждем вас и вашу вещь в нашей мастерской!\n\nПожалуйста, выберите действие:")
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Я уже сдал вещь", callback_data=f"client_already_brought_{order.id}")],
+        [InlineKeyboardButton("🕒 Принесу позже", callback_data=f"client_bring_later_{order.id}")],
+        [InlineKeyboardButton("❌ Отменить заказ", callback_data=f"client_cancel_order_{order.id}")]
+    ])
+
+    await telegram_limiter.acquire()
+    await application.bot.send_message(chat_id=order.user_id, text=client_msg,
+                                       reply_markup=keyboard, parse_mode="Markdown")
+    await asyncio.to_thread(mark_client_reminded, int(order.id))
+    return None
+
+
+async def send_stuck_alerts(application, jobs):
+    """Одна сводка админам по всем заказам, которые слишком долго «Приняты»"""
+    from handlers.admin import get_admin_ids
+
+    orders = await asyncio.to_thread(get_orders_by_ids, [job.order_id for job in jobs])
+    stuck = sorted((o for o in orders if o.status == 'accepted'),
+                   key=lambda o: o.accepted_at or o.created_at or datetime.utcnow())
+    stuck_ids = {o.id for o in stuck}
+
+    if stuck:
+        text = f"⚠️ *{len(stuck)} заказа «Приняты» но не в работе:*\n\n"
+        for o in stuck:
+            fid = format_order_id(o.id, o.created_at)
+            text += f"• {fid} {o.client_name or '—'} — принят {o.accepted_at.strftime('%d.%m') if o.accepted_at else 'Н/Д'}, срок {o.ready_date or 'Н/Д'}\n"
+
+        admin_ids = await asyncio.to_thread(get_admin_ids)
+        for admin_id in admin_ids:
+            await telegram_limiter.acquire()
+            try:
+                await application.bot.send_message(chat_id=admin_id, text=text, parse_mode="Markdown")
+            except TelegramError as e:
+                logger.warning(f"Не удалось отправить сводку админу {admin_id}: {e}")
+
+    next_due = datetime.utcnow() + STUCK_ALERT_REPEAT
+    return {job.id: next_due if job.order_id in stuck_ids else None for job in jobs}
+
+
+def register_jobs(scheduler) -> None:
+    scheduler.register('review_request', send_review_request)
+    scheduler.register('client_reminder', send_client_reminder)
+    scheduler.register('stuck_alert', send_stuck_alerts, batch=True)
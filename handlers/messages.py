@@ -4,9 +4,9 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.constants import ChatAction
 from telegram.error import BadRequest
-from utils.gigachat_api import get_ai_response
+from utils.answer_pipeline import get_ai_response
 from utils.anti_spam import anti_spam
-from utils.database import add_user, is_user_blocked, get_user_info, get_order, get_session, delete_order
+from utils.database import get_user_state, get_order, get_session, delete_order
 from keyboards import get_main_menu, get_ai_response_keyboard, get_admin_main_menu
 from handlers.admin import is_user_admin, get_admin_ids
 from handlers.orders import format_order_id
@@ -81,14 +81,14 @@ async def handle_message(update: Update,
             # Если это не кнопка, просто игнорируем (не шлем в AI)
             return
 
-        # Добавляем/обновляем пользователя в базе
-        add_user(user_id=user_id,
-                 username=user.username,
-                 first_name=user.first_name,
-                 last_name=user.last_name)
+        # Добавляем/обновляем пользователя в базе (состояние кэшируется в памяти)
+        user_state = get_user_state(user_id,
+                                    username=user.username,
+                                    first_name=user.first_name,
+                                    last_name=user.last_name)
 
         # Проверяем, не заблокирован ли пользователь
-        if is_user_blocked(user_id):
+        if user_state['is_blocked']:
             logger.warning(
                 f"Заблокированный пользователь {user_id} пытался отправить сообщение"
             )
@@ -114,8 +114,7 @@ async def handle_message(update: Update,
             return
 
         # Логируем полученное сообщение
-        user_info = get_user_info(user_id)
-        username_display = f"@{user_info.username}" if user_info and user_info.username else user_info.first_name if user_info else f"Пользователь {user_id}"
+        username_display = f"@{user_state['username']}" if user_state['username'] else user_state['first_name'] or f"Пользователь {user_id}"
         logger.info(
             f"Сообщение от {username_display} (ID: {user_id}): {text[:100]}..."
         )
@@ -182,9 +181,11 @@ async def handle_admin_mode(update: Update, context: ContextTypes.DEFAULT_TYPE,
             # Пропускаем команды для обработки в других хендлерах
             return False
 
-        # Проверяем режим рассылки — обрабатывается в main.py через broadcast_preview
+        # Режим рассылки: текст админа — это текст рассылки, показываем предпросмотр
         if context.user_data.get('broadcast_mode'):
-            return True  # Уже обработано в main.py, не вызываем GigaChat
+            from handlers.admin import broadcast_preview
+            await broadcast_preview(update, context, text)
+            return True
 
         # Проверяем режим ответа пользователю
         if context.user_data.get('reply_mode'):
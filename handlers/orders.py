@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 import random
 from datetime import datetime, timezone, timedelta
@@ -8,9 +9,10 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 
 from keyboards import get_services_menu, get_main_menu, get_admin_main_menu
-from utils.database import create_order, get_admins, add_user, get_order, update_order_status, track_event
+from utils.database import create_order, add_user, get_order, update_order_status, track_event
+from utils.broadcast import deliver
 from utils.knowledge_loader import knowledge
-from handlers.admin import is_user_admin
+from handlers.admin import is_user_admin, get_admin_ids
 
 logger = logging.getLogger(__name__)
 
@@ -772,21 +774,13 @@ async def notify_admins(context: ContextTypes.DEFAULT_TYPE,
                         order_id: int,
                         order_data: Dict[str, Any],
                         user_id: int = None):
-    """Уведомить админов о новом заказе"""
+    """
+    Уведомить админов о новом заказе.
+    Сообщение собирается сразу (order_data очищается после подтверждения),
+    а рассылка админам идёт фоновой задачей — клиент не ждёт отправки.
+    """
     try:
-        admins = get_admins() or []
-        admin_ids = [admin.user_id for admin in admins if admin.user_id]
-
-        # Добавляем основного администратора из переменных окружения
-        env_admin_id = os.getenv('ADMIN_ID')
-        if env_admin_id:
-            try:
-                admin_ids.append(int(env_admin_id))
-            except ValueError:
-                logger.warning(f"Неверный формат ADMIN_ID: {env_admin_id}")
-
-        # Удаляем дубликаты
-        admin_ids = list(set(admin_ids))
+        admin_ids = get_admin_ids()
 
         if not admin_ids:
             logger.warning("Нет администраторов для уведомления")
@@ -815,30 +809,41 @@ async def notify_admins(context: ContextTypes.DEFAULT_TYPE,
             f"_Заказ появится в работе после приёма вещи от клиента._\n"
             f"_Управление заказами: Админ → Все заказы_")
 
-        # Отправляем уведомления всем администраторам (без кнопок)
-        for admin_id in admin_ids:
-            try:
-                if order_data.get('photo_file_id'):
-                    await context.bot.send_photo(
-                        chat_id=admin_id,
-                        photo=order_data['photo_file_id'],
-                        caption=message,
-                        parse_mode="Markdown")
-                else:
-                    await context.bot.send_message(chat_id=admin_id,
-                                                   text=message,
-                                                   parse_mode="Markdown")
-                logger.info(
-                    f"Уведомление отправлено администратору {admin_id}")
-            except Exception as e:
-                logger.error(
-                    f"Не удалось отправить уведомление администратору {admin_id}: {e}"
-                )
+        context.application.create_task(
+            _send_admin_notifications(context.bot, admin_ids, message,
+                                      order_data.get('photo_file_id'), order_id))
 
     except Exception as e:
         logger.error(f"Ошибка при уведомлении администраторов: {e}")
 
 
+async def _send_admin_notifications(bot, admin_ids: list, message: str,
+                                    photo_file_id: Optional[str], order_id: int):
+    """Параллельная отправка уведомления всем админам (без кнопок) с повторами"""
+
+    async def notify(admin_id: int):
+        # file_id фото клиента уже лежит на серверах Telegram — повторной загрузки нет
+        if photo_file_id:
+            status, error = await deliver(lambda: bot.send_photo(
+                chat_id=admin_id, photo=photo_file_id, caption=message, parse_mode="Markdown"))
+            if status == 'sent':
+                return status, error
+            if status == 'failed':
+                # Фото недоступно (или подпись не прошла) — шлём хотя бы текст
+                logger.warning(f"Фото заказа {order_id} не отправлено админу {admin_id}: {error}")
+            else:
+                return status, error
+        return await deliver(lambda: bot.send_message(
+            chat_id=admin_id, text=message, parse_mode="Markdown"))
+
+    results = await asyncio.gather(*(notify(admin_id) for admin_id in admin_ids))
+    for admin_id, (status, error) in zip(admin_ids, results):
+        if status == 'sent':
+            logger.info(f"Уведомление о заказе {order_id} отправлено администратору {admin_id}")
+        else:
+            logger.error(f"Не удалось отправить уведомление администратору {admin_id}: {error}")
+
+
 async def handle_order_status_change(update: Update,
                                      context: ContextTypes.DEFAULT_TYPE):
     """Изменение статуса заказа админом"""
@@ -60,7 +60,7 @@ except ImportError:
     @app.route('/')
     def index(): return "Ошибка импорта webapp.app."
 
-from telegram import Update, MenuButtonCommands, BotCommand, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Update, MenuButtonCommands, BotCommand
 from telegram.ext import (ApplicationBuilder, CommandHandler, CallbackQueryHandler, 
                           MessageHandler, ConversationHandler, filters, TypeHandler, ContextTypes)
 
@@ -71,11 +71,14 @@ from handlers.orders import (order_start, select_service, receive_photo, skip_ph
                              confirm_order, cancel_order, use_tg_name, skip_phone as skip_phone_handler, 
                              handle_order_status_change, SELECT_SERVICE, SEND_PHOTO, 
                              ENTER_DESCRIPTION, ENTER_NAME, ENTER_PHONE, CONFIRM_ORDER)
-from handlers.reviews import get_review_conversation_handler, request_review
+from handlers.reviews import get_review_conversation_handler
 from keyboards import (get_main_menu, get_prices_menu, get_faq_menu,
                        get_back_button, get_admin_main_menu)
-from utils.database import (init_db, get_user_orders, get_orders_pending_feedback, mark_feedback_requested)
+from utils.database import (init_db, get_user_orders, flush_last_active, event_writer)
 from utils.prices import format_prices_text, import_prices_data
+from utils.broadcast import broadcaster
+from utils.scheduler import scheduler
+from handlers.jobs import register_jobs
 
 _lock = None
 
@@ -310,59 +313,33 @@ def main() -> None:
             BotCommand("services", "📋 Услуги и цены"), BotCommand("contact", "📞 Контакты"), BotCommand("help", "❓ Справка")
         ])
         await application.bot.set_chat_menu_button(menu_button=MenuButtonCommands())
-        async def periodic_review_check():
-            await asyncio.sleep(60)
+        # Запросы отзывов, напоминания клиентам и сводки о «зависших» заказах — по сроку из scheduled_jobs
+        try:
+            register_jobs(scheduler)
+            scheduler.start(application)
+        except Exception as e: logger.error(f"Не удалось запустить планировщик задач: {e}")
+
+        # last_active копится в памяти и пишется в БД пачкой раз в LAST_ACTIVE_FLUSH_INTERVAL секунд
+        async def periodic_last_active_flush():
+            interval = int(os.getenv("LAST_ACTIVE_FLUSH_INTERVAL", "60"))
             while True:
-                try:
-                    orders = get_orders_pending_feedback()
-                    for order in orders:
-                        try:
-                            user_id = int(order.user_id) if order.user_id else 0
-                            order_id = int(order.id) if order.id else 0
-                            await request_review(application, user_id, order_id)
-                            mark_feedback_requested(order_id)
-                        except Exception as e: logger.error(f"Failed review request: {e}")
-                    from handlers.admin import get_admin_ids
-                    from utils.database import get_session, Order
-                    from datetime import datetime, timedelta
-                    session = get_session()
-                    five_days_ago = datetime.utcnow() - timedelta(days=5)
-                    stuck_orders = session.query(Order).filter(Order.status == 'accepted', Order.accepted_at <= five_days_ago).all()
-                    if stuck_orders:
-                        admin_ids = get_admin_ids()
-                        text = f"⚠️ *{len(stuck_orders)} заказа «Приняты» но не в работе:*\n\n"
-                        for o in stuck_orders:
-                            from handlers.orders import format_order_id
-                            fid = format_order_id(o.id, o.created_at)
-                            text += f"• {fid} {o.client_name or '—'} — принят {o.accepted_at.strftime('%d.%m') if o.accepted_at else 'Н/Д'}, срок {o.ready_date or 'Н/Д'}\n"
-                        for admin_id in admin_ids:
-                            try: await application.bot.send_message(chat_id=admin_id, text=text, parse_mode="Markdown")
-                            except: pass
-                    three_days_ago = datetime.utcnow() - timedelta(days=3)
-                    pending_clients = session.query(Order).filter(Order.status == 'new', Order.client_reminded == False, Order.created_at <= three_days_ago).all()
-                    for o in pending_clients:
-                        try:
-                            from handlers.orders import format_order_id
-                            fid = format_order_id(int(o.id), o.created_at)
-                            client_msg = (f"🧵 *Швейный HUB*\n\nЗдравствуйте, {o.client_name or 'дорогой клиент'}! 😊\n"
-                                          f"Вы оформили заказ *{fid}* 3 дня назад, но мы его еще не получили.\n\n"
-                                          f"📍 Мы очень ждем вас и вашу вещь в нашей мастерской!\n\nПожалуйста, выберите действие:")
-                            keyboard = InlineKeyboardMarkup([
-                                [InlineKeyboardButton("✅ Я уже сдал вещь", callback_data=f"client_already_brought_{o.id}")],
-                                [InlineKeyboardButton("🕒 Принесу позже", callback_data=f"client_bring_later_{o.id}")],
-                                [InlineKeyboardButton("❌ Отменить заказ", callback_data=f"client_cancel_order_{o.id}")]
-                            ])
-                            await application.bot.send_message(chat_id=o.user_id, text=client_msg, reply_markup=keyboard, parse_mode="Markdown")
-                            o.client_reminded = True
-                            session.commit()
-                        except Exception as e: logger.error(f"Failed to remind client {o.user_id}: {e}")
-                    session.close()
-                except Exception as e: logger.error(f"Error in periodic check: {e}")
-                await asyncio.sleep(3600)
-        try: application.create_task(periodic_review_check())
+                await asyncio.sleep(interval)
+                try: await asyncio.to_thread(flush_last_active)
+                except Exception as e: logger.error(f"Error flushing last_active: {e}")
+        try: application.create_task(periodic_last_active_flush())
         except Exception as e: logger.error(f"Не удалось запустить фоновую задачу: {e}")
 
-    app_bot = ApplicationBuilder().token(token).post_init(post_init).build()
+        # Рассылки, прерванные перезапуском, продолжаются с сохранённого места
+        try: await broadcaster.resume_all(application)
+        except Exception as e: logger.error(f"Не удалось возобновить рассылки: {e}")
+
+    async def post_shutdown(application):
+        try: flush_last_active()
+        except Exception as e: logger.error(f"Error flushing last_active: {e}")
+        try: event_writer.close()
+        except Exception as e: logger.error(f"Error flushing events: {e}")
+
+    app_bot = ApplicationBuilder().token(token).post_init(post_init).post_shutdown(post_shutdown).build()
     app_bot.add_handler(TypeHandler(Update, log_all_updates), group=-1)
 
     order_conversation = ConversationHandler(
@@ -396,6 +373,7 @@ def main() -> None:
     app_bot.add_handler(CommandHandler("users", admin_users_list))
     app_bot.add_handler(CommandHandler("spam", admin_spam_logs))
     app_bot.add_handler(CommandHandler("broadcast", admin_broadcast_start))
+    app_bot.add_handler(CommandHandler("broadcasts", admin.broadcast_report))
 
     app_bot.add_handler(MessageHandler(filters.TEXT & filters.Regex("^📈 Статистика$"), admin_stats_info))
     app_bot.add_handler(MessageHandler(filters.TEXT & filters.Regex("^📊 Все заказы$"), admin_orders_list))
@@ -424,6 +402,11 @@ def main() -> None:
     app_bot.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE, admin_search_handler), group=2)
 
     app_bot.add_handler(CallbackQueryHandler(admin.admin_menu_callback, pattern="^admin_"))
+    app_bot.add_handler(CallbackQueryHandler(admin.broadcast_confirm, pattern="^broadcast_confirm$"))
+    app_bot.add_handler(CallbackQueryHandler(admin.broadcast_edit, pattern="^broadcast_edit$"))
+    app_bot.add_handler(CallbackQueryHandler(admin.broadcast_cancel, pattern="^broadcast_cancel$"))
+    app_bot.add_handler(CallbackQueryHandler(admin.broadcast_stop, pattern=r"^broadcast_stop_\d+$"))
+    app_bot.add_handler(CallbackQueryHandler(admin.broadcast_report, pattern="^broadcast_report$"))
     app_bot.add_handler(CallbackQueryHandler(admin.open_web_admin, pattern="^open_web_admin$"))
     app_bot.add_handler(CallbackQueryHandler(admin.admin_view_order, pattern="^admin_view_"))
     app_bot.add_handler(CallbackQueryHandler(admin.change_order_status, pattern="^status_"))
@@ -444,7 +427,8 @@ def main() -> None:
     # ВАЖНОЕ ИСПРАВЛЕНИЕ: Добавляем обработчик для callback-кнопок
     app_bot.add_handler(CallbackQueryHandler(messages.handle_callback_query))
 
-    app_bot.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, messages.handle_message))
+    # block=False: ответы GigaChat не должны задерживать обработку остальных апдейтов
+    app_bot.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, messages.handle_message, block=False))
 
     async def error_handler(update, context):
         from telegram.error import BadRequest
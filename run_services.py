@@ -2,6 +2,7 @@
 import os
 import sys
 import time
+import signal
 import logging
 import subprocess
 
@@ -13,6 +14,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+WEB_SERVER = os.getenv('WEB_SERVER', 'gunicorn')  # gunicorn или flask (dev-сервер Werkzeug)
+
+
+def start_webapp(base_dir: str, port: str, env: dict) -> subprocess.Popen:
+    """Запуск веб-панели: gunicorn (gunicorn.conf.py) или встроенный сервер Flask"""
+    server = WEB_SERVER
+    if server == 'gunicorn':
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            logger.warning("gunicorn не установлен — веб-панель запускается на dev-сервере Flask")
+            server = 'flask'
+
+    if server == 'gunicorn':
+        cmd = [sys.executable, "-m", "gunicorn", "-c", os.path.join(base_dir, "gunicorn.conf.py"),
+               "webapp.app:app"]
+    else:
+        cmd = [
+            sys.executable, "-u", "-c",
+            f"import os; from webapp.app import app, notification_worker; notification_worker.ensure_started(); port = int(os.environ.get('PORT', {port})); print(f'Starting web admin panel on port {{port}}...'); app.run(host='0.0.0.0', port=port, debug=False, threaded=True)"
+        ]
+
+    logger.info(f"Запуск веб-админки ({server}) на порту {port}...")
+    return subprocess.Popen(
+        cmd,
+        cwd=base_dir,
+        env={**env, "PORT": port, "SKIP_BOT": "1", "FLASK_ENV": "production", "FLASK_PORT": port}
+    )
+
+
 def run_services():
     """Запуск бота и веб-панели параллельно"""
     
@@ -22,52 +53,58 @@ def run_services():
     # Принудительно выключаем буферизацию для всех дочерних процессов
     env = {**os.environ, "PYTHONUNBUFFERED": "1"}
 
-    # 1. Запуск веб-панели через Flask
-    logger.info(f"Запуск веб-админки на порту {port}...")
-    webapp_process = subprocess.Popen(
-        [
-            sys.executable, "-u", "-c",
-            f"import os; from webapp.app import app; port = int(os.environ.get('PORT', {port})); print(f'Starting web admin panel on port {{port}}...'); app.run(host='0.0.0.0', port=port, debug=False, threaded=True)"
-        ],
-        cwd=base_dir,
-        env={**env, "SKIP_BOT": "1", "FLASK_ENV": "production", "FLASK_PORT": port}
-    )
+    webapp_process = bot_process = None
     
-    # Даём Flask время на запуск
-    time.sleep(5)
+    # SIGHUP — плавный перезапуск воркеров веб-панели без потери запросов (gunicorn перечитывает
+    # gunicorn.conf.py). Новый код при этом подхватывается только с WEB_PRELOAD=0, иначе нужен
+    # полный перезапуск. SIGTERM — штатная остановка обоих процессов
+    def reload_webapp(signum, frame):
+        if webapp_process is not None:
+            logger.info("SIGHUP: перезапуск воркеров веб-панели (код обновится только при WEB_PRELOAD=0)...")
+            webapp_process.send_signal(signal.SIGHUP)
 
-    # 2. Запуск Telegram бота
-    logger.info("Запуск Telegram бота...")
-    
-    # Принудительно передаем все переменные окружения, включая те, что считали из .env
-    # Это решает проблему "BOT_TOKEN не установлен" при запуске через subprocess
-    bot_env = {
-        **os.environ, 
-        "SKIP_FLASK": "1", 
-        "SKIP_BOT": "0", 
-        "PYTHONUNBUFFERED": "1", 
-        "FLASK_ENV": "production"
-    }
-    
-    bot_process = subprocess.Popen(
-        [sys.executable, "-u", "main.py"],
-        cwd=base_dir,
-        env=bot_env
-    )
-    
-    # Даем боту время на запуск и логирование
-    time.sleep(5)
+    def stop_services(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGHUP, reload_webapp)
+    signal.signal(signal.SIGTERM, stop_services)
 
+    # Весь запуск внутри try: SIGTERM во время стартовых пауз тоже останавливает
+    # уже запущенные дочерние процессы
     try:
+        # 1. Запуск веб-панели
+        webapp_process = start_webapp(base_dir, port, env)
+
+        # Даём Flask время на запуск
+        time.sleep(5)
+
+        # 2. Запуск Telegram бота
+        logger.info("Запуск Telegram бота...")
+        
+        # Принудительно передаем все переменные окружения, включая те, что считали из .env
+        # Это решает проблему "BOT_TOKEN не установлен" при запуске через subprocess
+        bot_env = {
+            **os.environ, 
+            "SKIP_FLASK": "1", 
+            "SKIP_BOT": "0", 
+            "PYTHONUNBUFFERED": "1", 
+            "FLASK_ENV": "production"
+        }
+        
+        bot_process = subprocess.Popen(
+            [sys.executable, "-u", "main.py"],
+            cwd=base_dir,
+            env=bot_env
+        )
+        
+        # Даем боту время на запуск и логирование
+        time.sleep(5)
+
         while True:
             # Проверка состояния процессов
             if webapp_process.poll() is not None:
                 logger.error("Процесс веб-панели завершился! Перезапуск...")
-                webapp_process = subprocess.Popen(
-                    [sys.executable, "-u", "-c", f"from webapp.app import app; app.run(host='0.0.0.0', port={port})"],
-                    cwd=base_dir,
-                    env={**env, "SKIP_BOT": "1"}
-                )
+                webapp_process = start_webapp(base_dir, port, env)
             
             if bot_process.poll() is not None:
                 logger.error("Процесс бота завершился! Перезапуск...")
@@ -80,8 +117,14 @@ def run_services():
             time.sleep(10)
     except KeyboardInterrupt:
         logger.info("Остановка сервисов...")
-        webapp_process.terminate()
-        bot_process.terminate()
+        processes = [p for p in (webapp_process, bot_process) if p is not None]
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=35)
+            except subprocess.TimeoutExpired:
+                process.kill()
 
 if __name__ == "__main__":
     run_services()
@@ -13,9 +13,11 @@ from utils.database import init_db
 init_db()
 
 from webapp.app import app
+from webapp.notifications import notification_worker
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     print(f"Starting web admin panel on port {port}...")
     print("Bot is NOT started - use this when bot runs on external server")
+    notification_worker.ensure_started()
     app.run(host="0.0.0.0", port=port, debug=False)
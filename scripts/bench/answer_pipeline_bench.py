@@ -0,0 +1,85 @@
+"""
+Answer pipeline check (utils/answer_pipeline.py).
+
+1. Router precision: schedule/address/price questions must get a canned
+   answer, repair and price questions that share words with them must not.
+2. A burst of questions through all tiers with GigaChat replaced by a fake
+   0.8 s model: how many model calls the cheaper tiers avoid.
+
+Run from the project root: python scripts/bench/answer_pipeline_bench.py
+Uses an in-memory state store and a temporary SQLite database.
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+os.environ['STATE_BACKEND'] = 'memory'
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utils import answer_pipeline as ap
+from utils.cache import cache
+from utils.database import init_db
+from utils.adaptive_prompts import get_context_summary
+
+MUST_ROUTE = [
+    "Где вы находитесь?", "какой у вас адрес", "ваш телефон?", "до скольки вы работаете?",
+    "а вы работаете в воскресенье?", "график работы", "пришлите прайс", "какие у вас расценки?",
+    "как до вас добраться от метро?", "работаете по выходным?",
+]
+MUST_NOT_ROUTE = [
+    "сколько стоит подшить брюки", "работаете с кожей?",
+    "у меня порвался рукав на свадебном платье, можно что-то сделать до субботы?",
+    "сломалась молния на куртке", "можно перешить мамино пальто", "сколько стоит замена молнии в пуховике",
+    "хочу записаться на консультацию по адресу", "а где вы берёте ткани для пошива и сколько стоит метр?",
+    "сделаете к понедельнику?", "чехол для телефона сошьёте? срочно",
+    "Во сколько обойдется подшить брюки?", "Молния на куртке не закрывается, почините?",
+    "Сумка плохо открывается, что делать?", "Телефон разбил экран, зашиваете чехлы?",
+    "до скольки дней делаете ремонт?", "сделаете к выходным?", "доставите по адресу?",
+]
+FAQ_LIKE = ["какая гарантия на работу", "Шьёте ли вы шторы?", "как оформить заказ",
+            "ремонтируете кожаные сумки?", "срочный ремонт за день возможен?"]
+
+model_calls = []
+
+
+async def fake_model(text, user_id=None, user_context=None):
+    model_calls.append(text)
+    await asyncio.sleep(0.8)  # typical GigaChat latency
+    answer = f"model answer to {text}"
+    cache.set(text, answer, *ap.answer_cache_variant(get_context_summary(user_context, text)))
+    return answer, False
+
+
+def check_router() -> bool:
+    pipeline = ap.AnswerPipeline()
+    missed = [q for q in MUST_ROUTE if not pipeline._route(q)]
+    wrong = [(q, pipeline._route(q)[:25]) for q in MUST_NOT_ROUTE if pipeline._route(q)]
+    print(f"router: {len(MUST_ROUTE)} must route, {len(MUST_NOT_ROUTE)} must not")
+    print(f"  not routed: {missed}")
+    print(f"  wrongly routed: {wrong}")
+    return not missed and not wrong
+
+
+async def burst(rounds: int = 3):
+    ap.gigachat.get_response = fake_model
+    questions = MUST_ROUTE + FAQ_LIKE + MUST_NOT_ROUTE
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for question in questions:
+            await ap.get_ai_response(question, None)
+    wall = time.perf_counter() - started
+    stats = ap.answer_pipeline.stats()
+    print(f"{stats['total']} answers in {wall:.1f}s, model calls {len(model_calls)} "
+          f"(one per question without the pipeline), avoided {stats['avoided_rate']}%")
+    for tier, values in stats['tiers'].items():
+        print(f"  {tier:9} {values}")
+
+
+if __name__ == '__main__':
+    init_db()
+    ok = check_router()
+    asyncio.run(burst())
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,82 @@
+"""
+GigaChat concurrency load test (utils/gigachat_api.py, handlers/messages.py).
+
+N users ask different questions at the same moment. The GigaChat client is
+replaced by a fake one whose achat() sleeps 0.5 s, so the wall time shows
+whether calls overlap: about one delay per GIGACHAT_MAX_CONCURRENCY users
+when they do, N delays when they are serialized.
+
+Run from the project root: python scripts/bench/gigachat_load_test.py [N ...]
+Uses an in-memory state store and a temporary SQLite database.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+os.environ['STATE_BACKEND'] = 'memory'
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utils.database import init_db
+from utils import gigachat_api
+from utils.answer_pipeline import answer_pipeline
+from handlers import messages
+
+DELAY = 0.5
+
+
+class FakeClient:
+    """achat() with a fixed latency instead of the GigaChat API"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def achat(self, payload):
+        self.calls += 1
+        await asyncio.sleep(DELAY)
+        message = SimpleNamespace(content="ответ: " + payload.messages[-1].content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def make_update(user_id: int, text: str):
+    user = SimpleNamespace(id=user_id, username=f"u{user_id}", first_name="Имя", last_name="", is_bot=False)
+    message = MagicMock()
+    message.text = text
+    message.reply_text = AsyncMock()
+    return SimpleNamespace(message=message, effective_user=user, effective_chat=SimpleNamespace(id=user_id))
+
+
+async def burst(n: int, client: FakeClient, offset: int):
+    context = SimpleNamespace(user_data={}, bot=SimpleNamespace(send_chat_action=AsyncMock()))
+    updates = [make_update(1000 + offset + i, f"вопрос номер {offset + i} про подкладку пальто")
+               for i in range(n)]
+    calls = client.calls
+    started = time.perf_counter()
+    await asyncio.gather(*(messages.handle_message(update, context) for update in updates))
+    elapsed = time.perf_counter() - started
+    replies = sum(1 for update in updates if update.message.reply_text.await_count)
+    print(f"N={n:3d}: {elapsed:.2f} s total, one call {DELAY} s, "
+          f"model calls {client.calls - calls}, replies {replies}")
+
+
+def main():
+    logging.disable(logging.INFO)
+    init_db()
+    client = FakeClient()
+    gigachat_api.gigachat.client = client
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1, 8, 32]
+    print(f"GIGACHAT_MAX_CONCURRENCY={gigachat_api.GIGACHAT_MAX_CONCURRENCY}")
+    offset = 0
+    for n in sizes:
+        asyncio.run(burst(n, client, offset))
+        offset += n
+    print(f"pipeline: {answer_pipeline.summary()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Keyword matcher microbenchmark (utils/keyword_matcher.py).
+
+The baseline is the way the classifiers worked before the shared matcher:
+for every registered set and category, `any(word in text.lower() ...)`
+over the same word lists.
+
+1. Correctness: 20k random messages built from the registered keywords,
+   matched categories and words must equal the baseline's.
+2. Time per message for all registered sets, baseline vs one scan of a
+   matcher with the result cache disabled, on mixed, short and long texts.
+3. Scaling with the number of keywords when nothing matches.
+
+Run from the project root: python scripts/bench/keyword_matcher_bench.py
+"""
+import os
+import sys
+import time
+import random
+import logging
+
+os.environ['STATE_BACKEND'] = 'memory'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+logging.disable(logging.CRITICAL)
+
+# Importing the classifiers registers their sets with the shared matcher
+from utils import anti_spam, adaptive_prompts, knowledge_loader, gigachat_api, answer_pipeline  # noqa: F401
+from utils.keyword_matcher import KeywordMatcher, keywords
+
+NEUTRAL = ['а', 'мы', 'привет', 'вещь', 'очень', 'хочу', 'можно', 'здравствуйте', 'добрый', 'день',
+           'как', 'почему', 'порвал', 'дырка', 'ткань', 'мне', 'нужно', 'куртку', 'завтра', 'ГДЕ', 'Цена']
+ALPHABET = 'абвгдежзийклмнопрстуфхцчшщыэюя'
+
+
+def baseline_categories(groups: dict, text: str) -> dict:
+    text = text.lower()
+    return {category for category, words in groups.items() if any(word in text for word in words)}
+
+
+def baseline_scan(sets: dict, text: str):
+    return {name: baseline_categories(groups, text) for name, groups in sets.items()}
+
+
+def messages(vocab: list, count: int, words: int, keyword_share: float):
+    return [' '.join(random.choice(vocab) if random.random() < keyword_share else random.choice(NEUTRAL)
+                     for _ in range(words)) for _ in range(count)]
+
+
+def best_of(runs: int, func, texts: list) -> float:
+    """Best time per text in microseconds"""
+    best = float('inf')
+    for _ in range(runs):
+        started = time.perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, time.perf_counter() - started)
+    return best / len(texts) * 1e6
+
+
+def main():
+    random.seed(1)
+    sets = {name: keyword_set.groups for name, keyword_set in keywords._sets.items()}
+    vocab = sorted({word for groups in sets.values() for words in groups.values() for word in words})
+    print(f"{len(sets)} keyword sets, {len(vocab)} distinct keywords")
+
+    uncached = KeywordMatcher(cache_size=0)
+    for name, groups in sets.items():
+        uncached.register(name, groups)
+
+    texts = [' '.join(random.choice(vocab) if random.random() < .3 else random.choice(NEUTRAL)
+                      for _ in range(random.randint(1, 30))) for _ in range(20000)]
+    texts += ['', 'ремонт', 'сколько стоит', 'заработок', 'Купить КРЕДИТ', 'срочно сегодня']
+    all_words = set(vocab)
+    mismatches = 0
+    for text in texts:
+        expected = baseline_scan(sets, text)
+        found_words, found = uncached.scan(text)
+        expected_words = {word for word in all_words if word in text.lower()}
+        got = {name: set(found.get(name, ())) for name in sets}
+        if got != expected or found_words != expected_words:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"MISMATCH {text!r}")
+    print(f"{len(texts)} messages, mismatches: {mismatches}")
+
+    cases = [
+        ('mixed', texts[:5000]),
+        ('short, no keywords', messages(NEUTRAL, 3000, 8, 0)),
+        ('long, no keywords', messages(NEUTRAL, 3000, 80, 0)),
+        ('long, keywords', messages(vocab, 3000, 80, .3)),
+    ]
+    for label, sample in cases:
+        chars = sum(map(len, sample)) // len(sample)
+        before = best_of(3, lambda text: baseline_scan(sets, text), sample)
+        after = best_of(3, uncached.scan, sample)
+        print(f"{label:20s} ({chars:3d} chars): baseline {before:7.1f} us, matcher {after:6.1f} us")
+
+    sample = messages(NEUTRAL, 500, 15, 0)
+    for size in (100, 1000, 5000):
+        words = [''.join(random.choice(ALPHABET) for _ in range(random.randint(4, 9))) for _ in range(size)]
+        matcher = KeywordMatcher(cache_size=0)
+        keyword_set = matcher.register('bench', {'x': words})
+        keyword_set.matches('прогрев')
+        before = best_of(1, lambda text: any(word in text.lower() for word in words), sample)
+        after = best_of(1, keyword_set.matches, sample)
+        print(f"{size:5d} keywords, no match: baseline {before:7.1f} us, matcher {after:6.1f} us")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Query plans of the hot order and chat-history queries (utils/migrations.py, migration 1).
+
+Fills a temporary SQLite database with N orders and 2/3 N chat rows, then
+for each query prints the average time and SQLite's EXPLAIN QUERY PLAN,
+first with the composite indexes from the models' __table_args__ and then
+with those indexes dropped (the schema before migration 1).
+
+Run from the project root: python scripts/bench/query_plans_bench.py [N]
+N defaults to 300000. Uses an in-memory state store.
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['STATE_BACKEND'] = 'memory'
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_PATH
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from sqlalchemy import insert
+
+from utils.database import init_db, engine, Order, ChatHistory
+
+QUERIES = {
+    'get_user_orders': "SELECT * FROM orders WHERE user_id = 77 ORDER BY created_at DESC",
+    'orders page (all)': "SELECT * FROM orders ORDER BY created_at DESC, id DESC LIMIT 9 OFFSET 40",
+    'orders page status': "SELECT * FROM orders WHERE status = 'completed' "
+                          "ORDER BY created_at DESC, id DESC LIMIT 9",
+    'pending_feedback': "SELECT * FROM orders WHERE status = 'completed' AND feedback_requested = 0 "
+                        "AND completed_at <= datetime('now', '-3 days')",
+    'stuck accepted': "SELECT * FROM orders WHERE status = 'accepted' "
+                      "AND accepted_at <= datetime('now', '-3 days')",
+    'user order counts': "SELECT user_id, count(id) FROM orders WHERE user_id IN (1, 2, 3, 4, 5) "
+                         "GROUP BY user_id",
+    'chat history ctx': "SELECT topic FROM chat_history WHERE user_id = 77 ORDER BY created_at DESC LIMIT 5",
+}
+# Most orders are long issued; open ones are recent, as in a working shop
+STATUSES = ['new', 'accepted', 'in_progress', 'completed', 'issued', 'cancelled']
+STATUS_WEIGHTS = [3, 3, 4, 5, 80, 5]
+BATCH = 50000
+
+
+def fill(n: int):
+    random.seed(3)
+    now = datetime.utcnow()
+    users = n // 5 + 1
+
+    def ago(max_days: int) -> datetime:
+        return now - timedelta(minutes=random.randint(0, max_days * 24 * 60))
+
+    orders = []
+    for _ in range(n):
+        status, = random.choices(STATUSES, STATUS_WEIGHTS)
+        created = ago(900 if status in ('issued', 'cancelled') else 7)
+        orders.append({
+            'user_id': random.randint(1, users), 'service_type': 'repair', 'client_name': 'Имя',
+            'status': status, 'created_at': created, 'updated_at': created,
+            'completed_at': created + timedelta(days=2) if status in ('completed', 'issued') else None,
+            'accepted_at': created + timedelta(hours=3) if status != 'new' else None,
+            'feedback_requested': status == 'issued' or random.random() < 0.95,
+            'client_reminded': status != 'new',
+        })
+    history = [{'user_id': random.randint(1, users), 'message': 'вопрос', 'response': 'ответ',
+                'topic': 'repair', 'complexity': 'simple', 'created_at': ago(900)}
+               for _ in range(n * 2 // 3)]
+    with engine.begin() as connection:
+        for rows, table in ((orders, Order.__table__), (history, ChatHistory.__table__)):
+            for i in range(0, len(rows), BATCH):
+                connection.execute(insert(table), rows[i:i + BATCH])
+
+
+def report(connection: sqlite3.Connection, label: str):
+    print(f"-- {label}")
+    for name, sql in QUERIES.items():
+        plan = ' / '.join(row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql))
+        started = time.perf_counter()
+        for _ in range(5):
+            connection.execute(sql).fetchall()
+        elapsed = (time.perf_counter() - started) / 5 * 1000
+        print(f"{name:20s} {elapsed:8.2f} ms  {plan}")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    init_db()
+    fill(n)
+    print(f"{n} orders, {n * 2 // 3} chat rows")
+    connection = sqlite3.connect(DB_PATH)
+    connection.execute('ANALYZE')
+    report(connection, 'with migration 1 indexes')
+    for model in (Order, ChatHistory):
+        for index in model.__table__.indexes:
+            connection.execute(f'DROP INDEX {index.name}')
+    connection.execute('ANALYZE')
+    report(connection, 'without them')
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Requests per second of the admin panel: Flask dev server vs gunicorn (gunicorn.conf.py).
+
+Starts each server on a temporary SQLite database with 2000 users and
+20000 orders. For each page, 16 client threads with a logged-in session
+cookie issue requests for 8 seconds, after a 1 second warm-up. The script
+prints req/s, p50/p95 latency and errors.
+
+Run from the project root: python scripts/bench/web_rps_bench.py [flask,gunicorn]
+Needs the requests package. Uses an in-memory state store.
+"""
+import os
+import sys
+import time
+import random
+import signal
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['STATE_BACKEND'] = 'memory'
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['FLASK_SECRET_KEY'] = 'bench-secret'
+sys.path.insert(0, ROOT)
+
+from utils.database import init_db, get_session, Order, User
+
+PATHS = ('/orders', '/api/stats')
+SECONDS = 8
+CLIENTS = 16
+ENV = {**os.environ, 'PYTHONUNBUFFERED': '1', 'WEB_LOG_LEVEL': 'warning'}
+
+
+def fill():
+    init_db()
+    random.seed(1)
+    now = datetime.utcnow()
+    session = get_session()
+    session.bulk_save_objects([User(user_id=1000 + i) for i in range(2000)])
+    session.bulk_save_objects([
+        Order(user_id=1000 + i % 2000, service_type='repair', client_name=f'C{i}',
+              status=random.choice(['new', 'accepted', 'in_progress', 'completed', 'issued']),
+              created_at=now - timedelta(minutes=i))
+        for i in range(20000)])
+    session.commit()
+    session.close()
+
+
+def serve(kind: str, port: int) -> subprocess.Popen:
+    if kind == 'flask':
+        cmd = [sys.executable, '-c',
+               "import logging; logging.disable(logging.INFO); from webapp.app import app; "
+               f"app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    else:
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+               '-b', f'127.0.0.1:{port}', 'webapp.app:app']
+    process = subprocess.Popen(cmd, cwd=ROOT, env=ENV, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/health', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{kind} did not start')
+
+
+def load(url: str, cookie: str, seconds: float = SECONDS, clients: int = CLIENTS):
+    """(req/s, p50 ms, p95 ms, errors) for `clients` threads hitting url for `seconds`"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop = time.time() + seconds
+
+    def worker():
+        session = requests.Session()
+        session.cookies.set('session', cookie)
+        while time.time() < stop:
+            started = time.perf_counter()
+            try:
+                ok = session.get(url).status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    if not latencies:
+        return 0.0, 0.0, 0.0, errors[0]
+    return (len(latencies) / seconds, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.95)] * 1000, errors[0])
+
+
+def main():
+    kinds = (sys.argv[1] if len(sys.argv) > 1 else 'flask,gunicorn').split(',')
+    fill()
+    from webapp.app import app
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'logged_in': True})
+    for i, kind in enumerate(kinds):
+        port = 18100 + i
+        process = serve(kind, port)
+        try:
+            for path in PATHS:
+                url = f'http://127.0.0.1:{port}{path}'
+                load(url, cookie, seconds=1)
+                rps, p50, p95, errors = load(url, cookie)
+                print(f"{kind:8s} {path:11s} {rps:7.1f} req/s  p50 {p50:6.1f} ms  "
+                      f"p95 {p95:6.1f} ms  errors {errors}")
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
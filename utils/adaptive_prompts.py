@@ -4,7 +4,11 @@
 """
 
 import re
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+
+from .keyword_matcher import keywords
 
 MOSCOW_TZ = timezone(timedelta(hours=3))
 
@@ -33,18 +37,28 @@ def get_time_greeting() -> str:
     return time_greetings.get(get_time_of_day(), "Привет!")
 
 
+COMPLEXITY_KEYWORDS = keywords.register('complexity', {
+    'simple': ['цена', 'сколько', 'адрес', 'где', 'когда', 'время', 'график', 'телефон'],
+    'complex': ['как', 'почему', 'можно ли', 'посоветуйте', 'что лучше', 'разница', 'сложно'],
+})
+
+# Порядок важен: при совпадении нескольких тем выбирается первая
+TOPIC_KEYWORDS = keywords.register('topic', {
+    'repair': ['порвал', 'дырка', 'зашить', 'починить', 'сломал', 'оторвал', 'укоротить', 'ушить', 'расширить'],
+    'price': ['цена', 'сколько', 'стоимость', 'прайс', 'дорого', 'дёшево'],
+    'info': ['адрес', 'где', 'когда', 'время', 'график', 'телефон', 'как доехать', 'метро'],
+    'fabric': ['ткань', 'материал', 'хлопок', 'шёлк', 'лён', 'синтетика', 'шерсть'],
+})
+
+
 def analyze_question_complexity(message: str) -> str:
     """Определить сложность вопроса"""
-    message_lower = message.lower()
-    
-    simple_keywords = ['цена', 'сколько', 'адрес', 'где', 'когда', 'время', 'график', 'телефон']
-    complex_keywords = ['как', 'почему', 'можно ли', 'посоветуйте', 'что лучше', 'разница', 'сложно']
-    
+    found = COMPLEXITY_KEYWORDS.categories(message)
     word_count = len(message.split())
     
-    if any(kw in message_lower for kw in simple_keywords) and word_count < 10:
+    if 'simple' in found and word_count < 10:
         return 'simple'
-    elif any(kw in message_lower for kw in complex_keywords) or word_count > 20:
+    elif 'complex' in found or word_count > 20:
         return 'complex'
     else:
         return 'medium'
@@ -52,23 +66,7 @@ def analyze_question_complexity(message: str) -> str:
 
 def detect_topic(message: str) -> str:
     """Определить тему вопроса"""
-    message_lower = message.lower()
-    
-    repair_keywords = ['порвал', 'дырка', 'зашить', 'починить', 'сломал', 'оторвал', 'укоротить', 'ушить', 'расширить']
-    price_keywords = ['цена', 'сколько', 'стоимость', 'прайс', 'дорого', 'дёшево']
-    info_keywords = ['адрес', 'где', 'когда', 'время', 'график', 'телефон', 'как доехать', 'метро']
-    fabric_keywords = ['ткань', 'материал', 'хлопок', 'шёлк', 'лён', 'синтетика', 'шерсть']
-    
-    if any(kw in message_lower for kw in repair_keywords):
-        return 'repair'
-    elif any(kw in message_lower for kw in price_keywords):
-        return 'price'
-    elif any(kw in message_lower for kw in info_keywords):
-        return 'info'
-    elif any(kw in message_lower for kw in fabric_keywords):
-        return 'fabric'
-    else:
-        return 'general'
+    return TOPIC_KEYWORDS.first_category(message, default='general')
 
 
 TONE_STYLES = {
@@ -93,57 +91,34 @@ TONE_STYLES = {
 }
 
 
-def generate_adaptive_prompt(user_context: dict, message: str) -> str:
-    """
-    Генерирует адаптивный системный промпт
-    
-    Args:
-        user_context: словарь с контекстом пользователя из get_user_context()
-        message: текущее сообщение пользователя
-    """
-    
-    time_of_day = get_time_of_day()
-    complexity = analyze_question_complexity(message)
-    topic = detect_topic(message)
-    tone = user_context.get('tone', 'friendly')
-    tone_style = TONE_STYLES.get(tone, TONE_STYLES['friendly'])
-    questions_count = user_context.get('questions_count', 0)
-    recent_topics = user_context.get('recent_topics', [])
-    user_name = user_context.get('name', '')
-    
-    time_context = {
-        'morning': "Сейчас утро — отвечай бодро и энергично.",
-        'afternoon': "Сейчас день — отвечай деловито, но приветливо.",
-        'evening': "Сейчас вечер — отвечай спокойно и уютно.",
-        'night': "Сейчас ночь — отвечай кратко, человек устал."
-    }
-    
-    complexity_context = {
-        'simple': "Это простой вопрос — ответь кратко, 1-2 предложения.",
-        'medium': "Это обычный вопрос — ответь развёрнуто, но без лишнего.",
-        'complex': "Это сложный вопрос — дай подробный ответ с объяснениями."
-    }
-    
-    familiarity_context = ""
-    if questions_count == 0:
-        familiarity_context = "Это новый пользователь — будь особенно приветлива и представься."
-    elif questions_count < 5:
-        familiarity_context = "Пользователь ещё новичок — будь терпелива и объясняй подробнее."
-    elif questions_count < 20:
-        familiarity_context = "Знакомый пользователь — можешь общаться более свободно."
-    else:
-        familiarity_context = f"Постоянный клиент ({questions_count} вопросов) — общайся как со старым другом!"
-    
-    topic_context = ""
-    if recent_topics:
-        if recent_topics.count('repair') > 2:
-            topic_context = "Пользователь часто спрашивает о ремонте — он явно заинтересован в услугах."
-        elif recent_topics.count('price') > 2:
-            topic_context = "Пользователь интересуется ценами — можешь ненавязчиво предложить записаться."
-    
-    name_context = f"Имя пользователя: {user_name}. Можешь обратиться по имени." if user_name else ""
-    
-    adaptive_prompt = f"""Ты — Иголочка, профессиональный консультант мастерской по ремонту одежды «Швейный HUB».
+TIME_CONTEXT = {
+    'morning': "Сейчас утро — отвечай бодро и энергично.",
+    'afternoon': "Сейчас день — отвечай деловито, но приветливо.",
+    'evening': "Сейчас вечер — отвечай спокойно и уютно.",
+    'night': "Сейчас ночь — отвечай кратко, человек устал."
+}
+
+COMPLEXITY_CONTEXT = {
+    'simple': "Это простой вопрос — ответь кратко, 1-2 предложения.",
+    'medium': "Это обычный вопрос — ответь развёрнуто, но без лишнего.",
+    'complex': "Это сложный вопрос — дай подробный ответ с объяснениями."
+}
+
+FAMILIARITY_CONTEXT = {
+    'new': "Это новый пользователь — будь особенно приветлива и представься.",
+    'novice': "Пользователь ещё новичок — будь терпелива и объясняй подробнее.",
+    'familiar': "Знакомый пользователь — можешь общаться более свободно.",
+    'regular': "Постоянный клиент (20+ вопросов) — общайся как со старым другом!"
+}
+
+TOPIC_CONTEXT = {
+    'repair': "Пользователь часто спрашивает о ремонте — он явно заинтересован в услугах.",
+    'price': "Пользователь интересуется ценами — можешь ненавязчиво предложить записаться."
+}
+
+# Статическая часть промпта компилируется один раз при импорте модуля,
+# на каждое сообщение подставляются только переменные блоки
+PROMPT_TEMPLATE = """Ты — Иголочка, профессиональный консультант мастерской по ремонту одежды «Швейный HUB».
 
 ТВОЯ РОЛЬ:
 - Консультировать клиентов об услугах мастерской
@@ -152,16 +127,16 @@ def generate_adaptive_prompt(user_context: dict, message: str) -> str:
 - Направлять клиентов в мастерскую
 
 СТИЛЬ ОБЩЕНИЯ:
-- Тон: {tone_style['style']}
-- {'Используй эмодзи умеренно (1-2 в сообщении): 🧵 ✂️ 👔 🪡' if tone_style['emojis'] else 'Минимум эмодзи'}
-- Обращение: {tone_style['formality']}
-{f'- {name_context}' if name_context else ''}
+- Тон: {style}
+- {emojis}
+- Обращение: {formality}
+{name_line}
 
 КОНТЕКСТ:
-- {time_context.get(time_of_day, '')}
-- {complexity_context.get(complexity, '')}
+- {time_context}
+- {complexity_context}
 - {familiarity_context}
-{f'- {topic_context}' if topic_context else ''}
+{topic_line}
 
 СТРУКТУРА ОТВЕТА НА ЗАПРОС ОБ УСЛУГЕ:
 1. Название услуги (точно как в прайсе)
@@ -199,7 +174,7 @@ def generate_adaptive_prompt(user_context: dict, message: str) -> str:
 Обязательно дай ссылку на карту: https://yandex.ru/maps/org/shveyny_hub/1233246900/?ll=37.488843%2C55.881723&z=16.44
 
 НА ВОПРОСЫ НЕ ПО ТЕМЕ:
-{'Мягко отшути и верни к теме ремонта одежды.' if tone_style['humor'] else 'Вежливо скажи, что консультируешь только по ремонту одежды.'}
+{offtopic}
 
 ЗАВЕРШАЙ ОТВЕТ призывом к действию:
 - Записаться по телефону
@@ -213,8 +188,102 @@ def generate_adaptive_prompt(user_context: dict, message: str) -> str:
 
 БАЗА ЗНАНИЙ (ПРАЙС-ЛИСТ И УСЛУГИ):
 """
+
+PROMPT_CACHE_SIZE = 512
+
+_prompt_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_prompt_cache_version = None
+
+
+def get_familiarity_bucket(questions_count: int) -> str:
+    """Группа знакомства с пользователем по количеству вопросов"""
+    if questions_count == 0:
+        return 'new'
+    elif questions_count < 5:
+        return 'novice'
+    elif questions_count < 20:
+        return 'familiar'
+    return 'regular'
+
+
+def get_topic_hint(recent_topics: list) -> str:
+    """Преобладающая тема последних вопросов (или пустая строка)"""
+    if recent_topics:
+        if recent_topics.count('repair') > 2:
+            return 'repair'
+        elif recent_topics.count('price') > 2:
+            return 'price'
+    return ''
+
+
+def get_prompt_key(user_context: dict, message: str) -> tuple:
+    """Набор переменных, от которых зависит текст промпта"""
+    return (
+        user_context.get('tone', 'friendly'),
+        get_time_of_day(),
+        analyze_question_complexity(message),
+        get_familiarity_bucket(user_context.get('questions_count', 0) or 0),
+        get_topic_hint(user_context.get('recent_topics', [])),
+        user_context.get('name') or ''
+    )
+
+
+@lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def _render_prompt(tone: str, time_of_day: str, complexity: str,
+                   familiarity: str, topic_hint: str, user_name: str) -> str:
+    """Подставить переменные блоки в шаблон промпта"""
+    tone_style = TONE_STYLES.get(tone, TONE_STYLES['friendly'])
+    name_context = f"Имя пользователя: {user_name}. Можешь обратиться по имени." if user_name else ""
+    topic_context = TOPIC_CONTEXT.get(topic_hint, "")
+    
+    return PROMPT_TEMPLATE.format(
+        style=tone_style['style'],
+        emojis='Используй эмодзи умеренно (1-2 в сообщении): 🧵 ✂️ 👔 🪡' if tone_style['emojis'] else 'Минимум эмодзи',
+        formality=tone_style['formality'],
+        name_line=f'- {name_context}' if name_context else '',
+        time_context=TIME_CONTEXT.get(time_of_day, ''),
+        complexity_context=COMPLEXITY_CONTEXT.get(complexity, ''),
+        familiarity_context=FAMILIARITY_CONTEXT[familiarity],
+        topic_line=f'- {topic_context}' if topic_context else '',
+        offtopic='Мягко отшути и верни к теме ремонта одежды.' if tone_style['humor'] else 'Вежливо скажи, что консультируешь только по ремонту одежды.'
+    )
+
+
+def generate_adaptive_prompt(user_context: dict, message: str) -> str:
+    """
+    Генерирует адаптивный системный промпт
+    
+    Args:
+        user_context: словарь с контекстом пользователя из get_user_context()
+        message: текущее сообщение пользователя
+    """
+    return _render_prompt(*get_prompt_key(user_context, message))
+
+
+def build_system_prompt(user_context: dict, message: str,
+                        knowledge_text: str, knowledge_version: int) -> str:
+    """
+    Готовый системный промпт (адаптивная часть + база знаний).
+    Кэшируется по набору переменных промпта и подобранному к вопросу
+    тексту базы знаний; кэш сбрасывается, когда меняется версия базы.
+    """
+    global _prompt_cache_version
+    
+    if knowledge_version != _prompt_cache_version:
+        _prompt_cache.clear()
+        _prompt_cache_version = knowledge_version
+    
+    key = (*get_prompt_key(user_context, message), knowledge_text)
+    prompt = _prompt_cache.get(key)
+    if prompt is not None:
+        _prompt_cache.move_to_end(key)
+        return prompt
     
-    return adaptive_prompt
+    prompt = _render_prompt(*key[:-1]) + knowledge_text
+    _prompt_cache[key] = prompt
+    if len(_prompt_cache) > PROMPT_CACHE_SIZE:
+        _prompt_cache.popitem(last=False)
+    return prompt
 
 
 def get_context_summary(user_context: dict, message: str) -> dict:
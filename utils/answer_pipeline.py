@@ -0,0 +1,174 @@
+"""
+Многоуровневый ответ на вопрос пользователя.
+
+Раньше каждый вопрос уходил в GigaChat, а база знаний использовалась только
+при ошибке модели. Теперь вопрос проходит уровни от дешёвых к дорогим и
+останавливается на первом, который дал ответ:
+
+1. router    — короткие вопросы про график, адрес/телефон и прайс-лист:
+               готовый ответ KnowledgeLoader по ключевым словам;
+2. cache     — кэш ответов GigaChat (тот же вопрос с теми же переменными промпта);
+3. knowledge — уверенное совпадение с вопросом FAQ (KnowledgeLoader.find_answer);
+4. gigachat  — модель, с подобранным к вопросу контекстом базы знаний.
+
+По каждому уровню считаются обращения, ответы и время (stats()), итог
+периодически пишется в лог и показывается в /stats у администратора.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+from .cache import cache
+from .keyword_matcher import keywords
+from .knowledge_loader import knowledge
+from .adaptive_prompts import analyze_question_complexity, detect_topic, get_context_summary
+from .gigachat_api import (gigachat, load_user_context, answer_cache_variant, check_needs_human,
+                           DEFAULT_USER_CONTEXT, NEEDS_HUMAN_QUESTION)
+from .database import save_chat_history
+
+logger = logging.getLogger(__name__)
+
+# Вопросы длиннее этого числа слов роутер не трогает: там обычно больше, чем «где вы?»
+ROUTER_MAX_WORDS = int(os.getenv('ROUTER_MAX_WORDS', '8'))
+# Как часто (в ответах) писать статистику уровней в лог; 0 — не писать
+PIPELINE_STATS_LOG_EVERY = int(os.getenv('PIPELINE_STATS_LOG_EVERY', '100'))
+
+TIERS = ('router', 'cache', 'knowledge', 'gigachat')
+
+# Роутер отвечает без модели, поэтому здесь только целые фразы о графике и контактах.
+# Отдельные слова («во сколько», «закрывается», «телефон», «адрес») встречаются
+# и в вопросах о ремонте: «во сколько обойдётся...», «молния не закрывается»
+ROUTER_KEYWORDS = keywords.register('answer_router', {
+    'schedule': ['график работы', 'режим работы', 'часы работы', 'во сколько открываетесь',
+                 'во сколько вы открываетесь', 'во сколько закрываетесь', 'во сколько вы закрываетесь',
+                 'во сколько вы работаете', 'до скольки работаете', 'до скольки вы работаете',
+                 'до скольки открыты', 'со скольки работаете', 'со скольки вы работаете',
+                 'когда открываетесь', 'когда вы открываетесь', 'у вас выходн', 'какой выходной',
+                 'работаете в', 'работаете по'],
+    'contacts': ['ваш адрес', 'у вас адрес', 'какой адрес', 'адрес мастерской', 'подскажите адрес',
+                 'где вы', 'где находит', 'как добраться', 'как доехать', 'как вас найти',
+                 'ваш телефон', 'ваш номер', 'номер телефона мастерской', 'телефон для связи',
+                 'как позвонить', 'как с вами связаться', 'какое метро', 'от метро', 'whatsapp', 'ватсап'],
+    'prices': ['прайс', 'расценк', 'все цены', 'ваши цены', 'цены на услуги', 'список цен'],
+})
+
+
+class AnswerPipeline:
+    """Уровни ответа по порядку TIERS со статистикой по каждому"""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {
+            tier: {'calls': 0, 'hits': 0, 'seconds': 0.0} for tier in TIERS
+        }
+        self.total = 0
+
+    async def answer(self, text: str, user_id: int = None) -> tuple[str, bool]:
+        """Ответ на вопрос: (текст, нужна ли помощь мастера)"""
+        self.total += 1
+        try:
+            response = await self._timed('router', self._route, text)
+            if response:
+                return await self._finish('router', text, user_id, response)
+
+            try:
+                user_context = await load_user_context(user_id)
+            except Exception as e:
+                logger.error(f"Failed to load user context for {user_id}: {e}")
+                user_context = dict(DEFAULT_USER_CONTEXT)
+            context_info = get_context_summary(user_context, text)
+            response = await self._timed('cache', cache.get, text, *answer_cache_variant(context_info))
+            if response:
+                return await self._finish('cache', text, user_id, response, context_info)
+
+            response = await self._timed('knowledge', knowledge.find_answer, text)
+            if response:
+                return await self._finish('knowledge', text, user_id, response, context_info)
+
+            started = time.perf_counter()
+            result = await gigachat.get_response(text, user_id, user_context)
+            self._record('gigachat', True, time.perf_counter() - started)
+            return result
+        finally:
+            if PIPELINE_STATS_LOG_EVERY and self.total % PIPELINE_STATS_LOG_EVERY == 0:
+                logger.info(f"Answer pipeline: {self.summary()}")
+
+    def _route(self, text: str) -> Optional[str]:
+        """Готовый ответ на короткий вопрос ровно об одном: графике, адресе или ценах"""
+        if len(text.split()) > ROUTER_MAX_WORDS or NEEDS_HUMAN_QUESTION.matches(text):
+            return None
+        topics = ROUTER_KEYWORDS.categories(text)
+        if len(topics) != 1:
+            return None
+        topic, = topics
+        if topic == 'prices' and knowledge.get_price_raw():
+            return knowledge.get_prices()
+        return knowledge.get_quick_answer(topic)
+
+    async def _timed(self, tier: str, func: Callable, *args) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            response = func(*args)
+        except Exception as e:
+            # Сбой дешёвого уровня не мешает ответить: вопрос уходит на следующий
+            logger.error(f"Answer tier {tier} failed: {e}")
+            response = None
+        self._record(tier, bool(response), time.perf_counter() - started)
+        return response
+
+    def _record(self, tier: str, hit: bool, seconds: float):
+        stats = self._stats[tier]
+        stats['calls'] += 1
+        stats['hits'] += hit
+        stats['seconds'] += seconds
+
+    async def _finish(self, tier: str, text: str, user_id: Optional[int], response: str,
+                      context_info: dict = None) -> tuple[str, bool]:
+        logger.info(f"Answered by {tier} tier: {text[:30]}")
+        if user_id:
+            topic = context_info['topic'] if context_info else detect_topic(text)
+            complexity = context_info['complexity'] if context_info else analyze_question_complexity(text)
+            try:
+                await asyncio.to_thread(save_chat_history, user_id, text, response, topic, complexity)
+            except Exception as e:
+                logger.error(f"Failed to save chat history: {e}")
+        return response, check_needs_human(text, response)
+
+    def stats(self) -> dict:
+        """Обращения, ответы, доля ответов и среднее время (мс) по уровням"""
+        tiers = {}
+        for tier, stats in self._stats.items():
+            calls = stats['calls']
+            tiers[tier] = {
+                'calls': calls,
+                'hits': stats['hits'],
+                'hit_rate': round(stats['hits'] / calls * 100, 1) if calls else 0.0,
+                'avg_ms': round(stats['seconds'] / calls * 1000, 3) if calls else 0.0,
+            }
+        avoided = self.total - tiers['gigachat']['calls']
+        return {
+            'total': self.total,
+            'model_calls_avoided': avoided,
+            'avoided_rate': round(avoided / self.total * 100, 1) if self.total else 0.0,
+            'tiers': tiers,
+        }
+
+    def summary(self) -> str:
+        """Статистика уровней одной строкой"""
+        stats = self.stats()
+        parts = [f"{tier} {s['hits']}/{s['calls']} ({s['hit_rate']}%, {s['avg_ms']} ms)"
+                 for tier, s in stats['tiers'].items()]
+        return (f"{stats['total']} questions, {stats['avoided_rate']}% without GigaChat; "
+                + ", ".join(parts))
+
+
+answer_pipeline = AnswerPipeline()
+
+
+async def get_ai_response(text: str, user_id: int = None) -> tuple[str, bool]:
+    """
+    Ответ на вопрос пользователя через уровни пайплайна.
+    Returns (response_text, needs_human_help) tuple.
+    """
+    return await answer_pipeline.answer(text, user_id)
@@ -1,7 +1,11 @@
+import os
 import time
 import logging
-from collections import defaultdict
-from typing import Dict, Tuple
+from array import array
+from typing import Optional, Tuple
+
+from .keyword_matcher import keywords
+from .state_store import StateBackend, state_store
 
 logger = logging.getLogger(__name__)
 
@@ -25,90 +29,151 @@ WHITELIST_WORDS = [
 RATE_LIMIT = 5
 RATE_WINDOW = 60
 MUTE_DURATION = 300
+# How often expired rate windows and mutes are purged from the state store
+EVICT_INTERVAL = int(os.getenv('ANTISPAM_EVICT_INTERVAL', '300'))
+
+# Whitelist and blacklist are checked in a single pass over the text
+_spam_matcher = keywords.register('spam', {'whitelist': WHITELIST_WORDS, 'blacklist': BLACKLIST_WORDS})
+_blacklist_order = {word: i for i, word in enumerate(BLACKLIST_WORDS)}
+
+
+class RateWindow:
+    """Timestamps of a user's last `size` counted messages in a fixed ring buffer"""
+    __slots__ = ('times', 'pos', 'count')
+
+    def __init__(self, size: int):
+        self.times = array('d', bytes(8 * size))
+        self.pos = 0
+        self.count = 0
+
+    def is_full(self, since: float) -> bool:
+        """True if all `size` slots hold messages newer than `since`"""
+        # times[pos] is the oldest slot once the ring has wrapped around
+        return self.count == len(self.times) and self.times[self.pos] > since
+
+    def add(self, timestamp: float):
+        self.times[self.pos] = timestamp
+        self.pos = (self.pos + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    def oldest(self, since: float) -> Optional[float]:
+        """Oldest timestamp newer than `since`, if any"""
+        recent = [t for t in self.times[:self.count] if t > since]
+        return min(recent) if recent else None
+
+    def dump(self) -> list:
+        """Compact JSON form for the state store: [pos, count, *times]"""
+        return [self.pos, self.count, *self.times[:self.count]]
+
+    @classmethod
+    def load(cls, size: int, data: list) -> 'RateWindow':
+        window = cls(size)
+        pos, count, times = data[0], data[1], data[2:]
+        if count == len(times) and count <= size and pos < size:
+            window.times[:count] = array('d', times)
+            window.pos, window.count = pos, count
+        return window
 
 
 class AntiSpamSystem:
-    def __init__(self, max_messages_per_minute: int = RATE_LIMIT):
+    """Mutes and rate windows live in the shared state store, so they survive
+    restarts and are the same for every process"""
+
+    MUTE_NAMESPACE = 'spam_mute'
+    RATE_NAMESPACE = 'spam_rate'
+
+    def __init__(self, max_messages_per_minute: int = RATE_LIMIT, store: StateBackend = None):
         self.max_messages = max_messages_per_minute
-        self.user_messages: Dict[int, list] = defaultdict(list)
-        self.muted_users: Dict[int, float] = {}
+        self.store = store or state_store
+        self._next_eviction = time.time() + EVICT_INTERVAL
     
+    def _classify(self, text: str) -> Tuple[bool, Optional[str]]:
+        """Return (whitelisted, first blacklisted word) in a single pass over the text"""
+        found = _spam_matcher.find(text)
+        whitelisted = any(word not in _blacklist_order for word in found)
+        blacklisted = [word for word in found if word in _blacklist_order]
+        return whitelisted, min(blacklisted, key=_blacklist_order.__getitem__) if blacklisted else None
+
     def check_blacklist(self, text: str) -> Tuple[bool, str]:
         """Check if message contains blacklisted words"""
-        text_lower = text.lower()
-        
-        for word in BLACKLIST_WORDS:
-            if word in text_lower:
-                return True, f"Черный список: '{word}'"
-        
+        _, word = self._classify(text)
+        if word:
+            return True, f"Черный список: '{word}'"
         return False, ""
     
     def check_whitelist(self, text: str) -> bool:
         """Check if message contains whitelisted words"""
-        text_lower = text.lower()
-        
-        for word in WHITELIST_WORDS:
-            if word in text_lower:
-                return True
-        
-        return False
+        whitelisted, _ = self._classify(text)
+        return whitelisted
     
     def is_muted(self, user_id: int) -> Tuple[bool, int]:
         """Check if user is muted"""
-        if user_id in self.muted_users:
-            mute_end = self.muted_users[user_id]
-            current_time = time.time()
-            
-            if current_time < mute_end:
-                remaining = int(mute_end - current_time)
-                return True, remaining
-            else:
-                del self.muted_users[user_id]
+        mute_end = self.store.get(self.MUTE_NAMESPACE, str(user_id))
+        current_time = time.time()
+        if mute_end is not None and current_time < mute_end:
+            return True, int(mute_end - current_time)
         
         return False, 0
     
     def mute_user(self, user_id: int, duration: int = MUTE_DURATION):
         """Mute user for specified duration"""
-        self.muted_users[user_id] = time.time() + duration
+        self.store.set(self.MUTE_NAMESPACE, str(user_id), time.time() + duration, ttl=duration)
         logger.warning(f"User {user_id} muted for {duration} seconds")
     
     def unmute_user(self, user_id: int):
         """Unmute user"""
-        if user_id in self.muted_users:
-            del self.muted_users[user_id]
+        self.store.delete(self.MUTE_NAMESPACE, str(user_id))
     
     def is_spam(self, user_id: int, text: str = "") -> Tuple[bool, str]:
         """Check if user is spamming"""
+        try:
+            return self._check_spam(user_id, text)
+        except Exception as e:
+            # The state store is unavailable: let the message through rather than drop it
+            logger.error(f"Anti-spam check failed for {user_id}: {e}")
+            return False, ""
+    
+    def _check_spam(self, user_id: int, text: str) -> Tuple[bool, str]:
         is_muted, remaining = self.is_muted(user_id)
         if is_muted:
             return True, f"Вы временно заблокированы. Осталось {remaining} сек."
         
-        if text and self.check_whitelist(text):
-            return False, ""
-        
         if text:
-            is_blacklisted, reason = self.check_blacklist(text)
-            if is_blacklisted:
+            whitelisted, word = self._classify(text)
+            if whitelisted:
+                return False, ""
+            if word:
+                reason = f"Черный список: '{word}'"
                 self._log_spam_to_db(user_id, text, reason)
                 self.mute_user(user_id)
                 return True, "Сообщение содержит запрещённый контент."
         
         now = time.time()
-        one_minute_ago = now - RATE_WINDOW
+        self._evict_idle(now)
         
-        self.user_messages[user_id] = [
-            timestamp for timestamp in self.user_messages[user_id]
-            if timestamp > one_minute_ago
-        ]
+        data = self.store.get(self.RATE_NAMESPACE, str(user_id))
+        window = RateWindow.load(self.max_messages, data) if data else RateWindow(self.max_messages)
         
-        if len(self.user_messages[user_id]) >= self.max_messages:
+        if window.is_full(now - RATE_WINDOW):
             self.mute_user(user_id)
             self._log_spam_to_db(user_id, text, "Превышен лимит сообщений")
             return True, "Слишком много сообщений. Подождите немного."
         
-        self.user_messages[user_id].append(now)
+        window.add(now)
+        # The window expires RATE_WINDOW after the user's last message
+        self.store.set(self.RATE_NAMESPACE, str(user_id), window.dump(), ttl=RATE_WINDOW)
         return False, ""
     
+    def _evict_idle(self, now: float):
+        """Purge rate windows with no messages in RATE_WINDOW and expired mutes"""
+        if now < self._next_eviction:
+            return
+        self._next_eviction = now + EVICT_INTERVAL
+        
+        removed = self.store.purge_expired()
+        if removed:
+            logger.debug(f"Anti-spam eviction: {removed} expired entries purged")
+    
     def _log_spam_to_db(self, user_id: int, text: str, reason: str):
         """Log spam attempt to database"""
         try:
@@ -120,19 +185,21 @@ class AntiSpamSystem:
     
     def get_wait_time(self, user_id: int) -> int:
         """Get time user needs to wait before next message"""
-        if not self.user_messages[user_id]:
+        data = self.store.get(self.RATE_NAMESPACE, str(user_id))
+        if not data:
             return 0
         
-        oldest = self.user_messages[user_id][0]
-        wait = int(60 - (time.time() - oldest)) + 1
+        now = time.time()
+        oldest = RateWindow.load(self.max_messages, data).oldest(now - RATE_WINDOW)
+        if oldest is None:
+            return 0
+        wait = int(RATE_WINDOW - (now - oldest)) + 1
         return max(0, wait)
     
     def reset_user(self, user_id: int):
         """Reset user's rate limit counter"""
-        if user_id in self.user_messages:
-            del self.user_messages[user_id]
-        if user_id in self.muted_users:
-            del self.muted_users[user_id]
+        self.store.delete(self.RATE_NAMESPACE, str(user_id))
+        self.store.delete(self.MUTE_NAMESPACE, str(user_id))
 
 
 anti_spam = AntiSpamSystem(max_messages_per_minute=RATE_LIMIT)
@@ -0,0 +1,284 @@
+"""
+Фоновая рассылка сообщений всем пользователям бота.
+
+Рассылка выполняется отдельной задачей и не блокирует обработчик админа:
+- получатели читаются из БД страницами (BROADCAST_PAGE_SIZE), а не целиком;
+- отправка идёт параллельно (BROADCAST_CONCURRENCY) через общий token bucket
+  (BROADCAST_RATE сообщений в секунду — ниже глобального лимита Telegram ~30/с);
+- на RetryAfter весь bucket ставится на паузу, сообщение отправляется повторно;
+- после каждой страницы прогресс сохраняется в таблицу broadcasts,
+  поэтому после перезапуска бота рассылка продолжается с того же места;
+- результат по каждому получателю пишется в broadcast_deliveries; тех, кто
+  заблокировал бота или удалил чат, следующие рассылки пропускают;
+- админ видит живое сообщение с прогрессом и кнопкой остановки.
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter, NetworkError, TelegramError, Forbidden, BadRequest
+
+from .database import (
+    get_broadcast,
+    get_broadcast_recipients,
+    get_broadcast_delivery_counts,
+    get_running_broadcasts,
+    save_broadcast_page,
+    update_broadcast,
+)
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))
+BROADCAST_PAGE_SIZE = int(os.getenv('BROADCAST_PAGE_SIZE', '200'))
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '3'))
+
+
+class TokenBucket:
+    """Ограничитель скорости: не больше rate запросов в секунду, всплески до capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Дождаться свободного слота"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Остановить выдачу слотов (Telegram ответил RetryAfter)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+# Общий лимит исходящих сообщений: рассылки, отложенные задачи (utils/scheduler.py)
+# и уведомления админов вместе не должны превышать глобальный лимит Telegram
+telegram_limiter = TokenBucket(BROADCAST_RATE)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def deliver(send, limiter: TokenBucket = None, retries: int = BROADCAST_MAX_RETRIES) -> tuple:
+    """
+    Выполнить отправку send() (фабрика корутины) с лимитом скорости и повторами.
+    Возвращает (статус, ошибка): sent, blocked, chat_not_found, retry_after или failed.
+    """
+    limiter = limiter or telegram_limiter
+    status, error = 'failed', None
+    for attempt in range(retries):
+        await limiter.acquire()
+        try:
+            await send()
+            return 'sent', None
+        except RetryAfter as e:
+            wait = retry_after_seconds(e)
+            logger.warning(f"Telegram flood control: pausing for {wait}s")
+            limiter.pause(wait)
+            status, error = 'retry_after', str(e)
+        except Forbidden as e:
+            # Бот заблокирован или аккаунт удалён — повтор не поможет
+            return 'blocked', str(e)
+        except BadRequest as e:
+            if 'chat not found' in str(e).lower():
+                return 'chat_not_found', str(e)
+            return 'failed', str(e)
+        except NetworkError as e:
+            logger.warning(f"Telegram network error (attempt {attempt + 1}): {e}")
+            await asyncio.sleep(1 + attempt)
+            status, error = 'failed', str(e)
+        except TelegramError as e:
+            return 'failed', str(e)
+        except Exception as e:
+            logger.error(f"Telegram send failed: {e}")
+            return 'failed', str(e)
+    return status, error
+
+
+def stop_button(broadcast_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("⏹ Остановить рассылку", callback_data=f"broadcast_stop_{broadcast_id}")]
+    ])
+
+
+def format_progress(broadcast_id: int, sent: int, failed: int, total: int,
+                    speed: float = 0.0, status: str = 'running') -> str:
+    """Текст сообщения с прогрессом рассылки"""
+    done = sent + failed
+    percent = int(done / total * 100) if total else 100
+    title = {
+        'running': f"📤 *Рассылка #{broadcast_id}*",
+        'completed': f"✅ *Рассылка #{broadcast_id} завершена*",
+        'cancelled': f"⏹ *Рассылка #{broadcast_id} остановлена*",
+    }.get(status, f"📤 *Рассылка #{broadcast_id}*")
+
+    text = (
+        f"{title}\n\n"
+        f"📊 {done} / {total} ({percent}%)\n"
+        f"📨 Отправлено: {sent}\n"
+        f"❌ Ошибок: {failed}"
+    )
+    if status == 'running' and speed > 0:
+        remaining = max(0, total - done) / speed
+        text += f"\n⚡ {speed:.1f} сообщ./с, осталось ~{int(remaining // 60)} мин {int(remaining % 60)} с"
+    return text
+
+
+FAILURE_LABELS = {
+    'blocked': '🚫 Заблокировали бота',
+    'chat_not_found': '👻 Чат не найден',
+    'retry_after': '⏳ Лимит Telegram',
+    'failed': '⚠️ Другие ошибки',
+}
+
+
+def format_failure_breakdown(by_status: dict) -> str:
+    """Строки с причинами недоставки (только ненулевые)"""
+    return "\n".join(f"   {label}: {by_status[key]}"
+                     for key, label in FAILURE_LABELS.items() if by_status.get(key))
+
+
+class BroadcastEngine:
+    """Запуск, возобновление и остановка фоновых рассылок"""
+
+    def __init__(self):
+        self.bucket = telegram_limiter
+        self._semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        self._tasks = {}
+        self._cancelled = set()
+
+    def start(self, application, broadcast_id: int) -> None:
+        """Запустить (или продолжить) рассылку в фоне"""
+        if broadcast_id in self._tasks and not self._tasks[broadcast_id].done():
+            return
+        task = application.create_task(self._run(application.bot, broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    def stop(self, broadcast_id: int) -> None:
+        """Остановить рассылку после текущей страницы"""
+        self._cancelled.add(broadcast_id)
+
+    def is_running(self, broadcast_id: int) -> bool:
+        return broadcast_id in self._tasks
+
+    async def resume_all(self, application) -> int:
+        """Продолжить рассылки, прерванные перезапуском бота"""
+        broadcasts = await asyncio.to_thread(get_running_broadcasts)
+        for b in broadcasts:
+            logger.info(f"Resuming broadcast #{b.id} from user pk {b.last_user_pk}")
+            self.start(application, b.id)
+        return len(broadcasts)
+
+    async def _send_one(self, bot, chat_id: int, text: str) -> tuple:
+        """Отправить одно сообщение рассылки; (статус, ошибка) как у deliver()"""
+        async with self._semaphore:
+            return await deliver(lambda: bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown"),
+                                 limiter=self.bucket)
+
+    async def _edit_progress(self, bot, broadcast, sent: int, failed: int,
+                             speed: float = 0.0, status: str = 'running') -> None:
+        if not broadcast.progress_chat_id or not broadcast.progress_message_id:
+            return
+        try:
+            await bot.edit_message_text(
+                chat_id=broadcast.progress_chat_id,
+                message_id=broadcast.progress_message_id,
+                text=format_progress(broadcast.id, sent, failed, broadcast.total, speed, status),
+                reply_markup=stop_button(broadcast.id) if status == 'running' else None,
+                parse_mode="Markdown"
+            )
+        except TelegramError as e:
+            logger.debug(f"Broadcast progress edit failed: {e}")
+
+    async def _run(self, bot, broadcast_id: int) -> None:
+        broadcast = await asyncio.to_thread(get_broadcast, broadcast_id)
+        if not broadcast or broadcast.status != 'running':
+            return
+
+        sent, failed = broadcast.sent or 0, broadcast.failed or 0
+        cursor = broadcast.last_user_pk or 0
+        started = time.monotonic()
+        last_edit = 0.0
+        status = 'completed'
+        # Скорость считаем только по текущему запуску (после перезапуска часть уже отправлена)
+        done_before = sent + failed
+
+        try:
+            while True:
+                if broadcast_id in self._cancelled:
+                    status = 'cancelled'
+                    break
+
+                page = await asyncio.to_thread(get_broadcast_recipients, cursor, BROADCAST_PAGE_SIZE)
+                if not page:
+                    break
+
+                results = await asyncio.gather(
+                    *(self._send_one(bot, int(user_id), broadcast.text) for _, user_id in page))
+                page_sent = sum(1 for status, _ in results if status == 'sent')
+                sent += page_sent
+                failed += len(results) - page_sent
+                cursor = page[-1][0]
+
+                deliveries = [(int(user_id), status, error)
+                              for (_, user_id), (status, error) in zip(page, results)]
+                await asyncio.to_thread(save_broadcast_page, broadcast_id, deliveries,
+                                        last_user_pk=cursor, sent=sent, failed=failed)
+
+                if time.monotonic() - last_edit >= BROADCAST_PROGRESS_INTERVAL:
+                    last_edit = time.monotonic()
+                    speed = (sent + failed - done_before) / (last_edit - started)
+                    await self._edit_progress(bot, broadcast, sent, failed, speed)
+        except asyncio.CancelledError:
+            # Бот останавливается — рассылка останется в статусе running и продолжится после запуска
+            logger.info(f"Broadcast #{broadcast_id} interrupted at user pk {cursor}")
+            raise
+        finally:
+            self._cancelled.discard(broadcast_id)
+
+        await asyncio.to_thread(update_broadcast, broadcast_id, status=status,
+                                finished_at=datetime.utcnow(), last_user_pk=cursor,
+                                sent=sent, failed=failed)
+        await self._edit_progress(bot, broadcast, sent, failed, status=status)
+        logger.info(f"Broadcast #{broadcast_id} {status}: sent={sent}, failed={failed}")
+
+        by_status = (await asyncio.to_thread(get_broadcast_delivery_counts, [broadcast_id])).get(broadcast_id, {})
+        try:
+            await bot.send_message(
+                chat_id=broadcast.admin_id,
+                text=f"{'✅' if status == 'completed' else '⏹'} *Рассылка #{broadcast_id} "
+                     f"{'завершена' if status == 'completed' else 'остановлена'}*\n\n"
+                     f"📨 Отправлено: {sent}\n❌ Ошибок: {failed}\n"
+                     f"{format_failure_breakdown(by_status)}",
+                parse_mode="Markdown"
+            )
+        except TelegramError as e:
+            logger.warning(f"Could not notify admin about broadcast #{broadcast_id}: {e}")
+
+
+broadcaster = BroadcastEngine()
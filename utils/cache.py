@@ -1,40 +1,137 @@
+import os
+import re
 import hashlib
 import time
-from typing import Dict, Optional
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+from .state_store import StateBackend, state_store
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = int(os.getenv('AI_CACHE_TTL', '3600'))
+CACHE_MAX_SIZE = int(os.getenv('AI_CACHE_MAX_SIZE', '1000'))
+USER_STATE_TTL = int(os.getenv('USER_STATE_TTL', '60'))
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_question(text: str) -> str:
+    """Normalize question text so trivial variations share a cache entry"""
+    text = text.lower().replace('ё', 'е')
+    text = _PUNCTUATION_RE.sub(' ', text)
+    return _SPACES_RE.sub(' ', text).strip()
+
 
 class ResponseCache:
-    def __init__(self, ttl: int = 3600):  # Cache for 1 hour
-        self.cache: Dict[str, tuple] = {}
+    """AI answers with TTL and a size limit, kept in the shared state store"""
+
+    NAMESPACE = 'ai_answer'
+
+    def __init__(self, ttl: int = CACHE_TTL, max_size: int = CACHE_MAX_SIZE, store: StateBackend = None):
+        self.store = store or state_store
         self.ttl = ttl
-    
-    def _hash_key(self, text: str) -> str:
-        """Create hash of text for cache key"""
-        return hashlib.md5(text.lower().encode()).hexdigest()
-    
-    def get(self, text: str) -> Optional[str]:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def _hash_key(self, text: str, *variant) -> str:
+        """Create hash of normalized text plus prompt variables for cache key"""
+        raw = "|".join([normalize_question(text), *(str(v) for v in variant)])
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    def get(self, text: str, *variant) -> Optional[str]:
         """Get cached response"""
-        key = self._hash_key(text)
-        
-        if key in self.cache:
-            response, timestamp = self.cache[key]
-            # Check if cache expired
-            if time.time() - timestamp < self.ttl:
-                return response
-            else:
-                del self.cache[key]
-        
+        try:
+            response = self.store.get(self.NAMESPACE, self._hash_key(text, *variant))
+        except Exception as e:
+            logger.error(f"Answer cache read failed: {e}")
+            response = None
+
+        if response is not None:
+            self.hits += 1
+            return response
+        self.misses += 1
         return None
-    
-    def set(self, text: str, response: str) -> None:
-        """Cache response"""
-        key = self._hash_key(text)
-        self.cache[key] = (response, time.time())
-    
+
+    def set(self, text: str, response: str, *variant) -> None:
+        """Cache response, evicting the oldest entries over max_size"""
+        try:
+            self.store.set(self.NAMESPACE, self._hash_key(text, *variant), response, ttl=self.ttl)
+            self.store.trim(self.NAMESPACE, self.max_size)
+        except Exception as e:
+            logger.error(f"Answer cache write failed: {e}")
+
+    def clear_old(self) -> None:
+        """Remove expired entries"""
+        self.store.purge_expired()
+
+    def stats(self) -> dict:
+        """Hit/miss counters of this process and the shared cache size"""
+        total = self.hits + self.misses
+        return {
+            'size': self.store.count(self.NAMESPACE),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total * 100, 1) if total else 0.0
+        }
+
+
+class UserStateCache:
+    """Per-user flags (blocked/admin/tone/questions_count/name) kept between messages.
+
+    Entries expire after ttl seconds so changes made by another process
+    (e.g. the web admin) are picked up without explicit invalidation.
+    last_active timestamps are collected here and written in batches.
+    """
+
+    def __init__(self, ttl: int = USER_STATE_TTL):
+        self.states: dict = {}
+        self.ttl = ttl
+        self.pending_active: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[dict]:
+        """Get cached state or None if missing/expired"""
+        entry = self.states.get(user_id)
+        if entry is not None and time.time() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def set(self, user_id: int, state: dict) -> None:
+        self.states[user_id] = (state, time.time())
+
+    def update(self, user_id: int, **fields) -> None:
+        """Patch a cached state in place (no-op if the user is not cached)"""
+        entry = self.states.get(user_id)
+        if entry is not None:
+            entry[0].update(fields)
+
+    def invalidate(self, user_id: int) -> None:
+        self.states.pop(user_id, None)
+
+    def touch(self, user_id: int) -> None:
+        """Remember that the user was active; written later by flush"""
+        with self._lock:
+            self.pending_active[user_id] = datetime.utcnow()
+
+    def pop_pending_active(self) -> dict:
+        """Take all pending last_active timestamps"""
+        with self._lock:
+            pending, self.pending_active = self.pending_active, {}
+        return pending
+
     def clear_old(self) -> None:
         """Remove expired entries"""
         now = time.time()
-        expired = [k for k, (_, t) in self.cache.items() if now - t > self.ttl]
+        expired = [k for k, (_, t) in list(self.states.items()) if now - t > self.ttl]
         for k in expired:
-            del self.cache[k]
+            self.states.pop(k, None)
+
 
 cache = ResponseCache()
+user_state_cache = UserStateCache()
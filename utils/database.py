@@ -1,8 +1,17 @@
 import os
+import copy
+import json
+import time
+import queue
+import atexit
 import logging
-from sqlalchemy import create_engine, Column, Integer, BigInteger, String, DateTime, Boolean, Text, Date, func
-from sqlalchemy.orm import declarative_base, sessionmaker
+import threading
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, DateTime, Boolean, Text, Date, func, update, insert, bindparam, case, select, event, distinct, UniqueConstraint, Index, and_, or_, extract
+from sqlalchemy.orm import declarative_base, sessionmaker, attributes
 from datetime import datetime, date, timezone, timedelta
+from typing import Optional
+from collections import OrderedDict
+from .cache import user_state_cache
 
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///workshop.db')
 
@@ -10,6 +19,18 @@ MOSCOW_TZ = timezone(timedelta(hours=3))
 
 engine = create_engine(DATABASE_URL, echo=False)
 
+# Analytics events are buffered and written in batches (see EventWriter)
+EVENT_BATCH_SIZE = int(os.getenv('EVENT_BATCH_SIZE', '100'))
+EVENT_FLUSH_INTERVAL_MS = int(os.getenv('EVENT_FLUSH_INTERVAL_MS', '1000'))
+EVENT_QUEUE_MAX = int(os.getenv('EVENT_QUEUE_MAX', '10000'))
+EVENT_OVERFLOW = os.getenv('EVENT_OVERFLOW', 'drop')  # 'drop' or 'spill'
+EVENT_SPILL_PATH = os.getenv('EVENT_SPILL_PATH', 'events_spill.jsonl')
+
+# Dashboard counters are cached briefly; local writes invalidate them immediately
+STATS_CACHE_TTL = int(os.getenv('STATS_CACHE_TTL', '30'))
+# Filtered order counts are keyed by admin query parameters, so the cache is an LRU of this size
+STATS_CACHE_MAX_ENTRIES = int(os.getenv('STATS_CACHE_MAX_ENTRIES', '64'))
+
 
 def get_user_info(user_id: int) -> dict:
     """Получение информации о пользователе"""
@@ -24,6 +45,16 @@ logger = logging.getLogger(__name__)
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Списки по статусу и keyset-пагинация (created_at, id)
+        Index('ix_orders_status_created_at', 'status', 'created_at'),
+        Index('ix_orders_created_at_id', 'created_at', 'id'),
+        # Заказы клиента
+        Index('ix_orders_user_id_created_at', 'user_id', 'created_at'),
+        # Фоновые проверки: запрос отзыва и «зависшие» принятые заказы
+        Index('ix_orders_status_feedback_completed', 'status', 'feedback_requested', 'completed_at'),
+        Index('ix_orders_status_accepted_at', 'status', 'accepted_at'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(BigInteger, nullable=False)
@@ -63,10 +94,15 @@ class User(Base):
     tone_preference = Column(String,
                              default='friendly')  # friendly, formal, playful
     questions_count = Column(Integer, default=0)
+    # Set when Telegram refuses delivery (bot blocked / chat gone); cleared when the user is active again
+    unreachable_at = Column(DateTime)
 
 
 class ChatHistory(Base):
     __tablename__ = "chat_history"
+    __table_args__ = (
+        Index('ix_chat_history_user_id_created_at', 'user_id', 'created_at'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(BigInteger, nullable=False)
@@ -133,78 +169,379 @@ class Event(Base):
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
 
+class DailyEventRollup(Base):
+    """One row per (day, event type, user) built from events by refresh_event_rollup()"""
+    __tablename__ = "daily_event_rollup"
+    __table_args__ = (
+        UniqueConstraint('day', 'event_type', 'user_id', name='uq_daily_event_rollup'),
+        Index('ix_daily_event_rollup_type_day', 'event_type', 'day'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    event_type = Column(String(50), nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    events = Column(Integer, default=0)
+
+
+class AnalyticsState(Base):
+    """Key/value watermarks for incremental analytics jobs"""
+    __tablename__ = "analytics_state"
+
+    key = Column(String(50), primary_key=True)
+    value = Column(BigInteger, default=0)
+
+
+class Broadcast(Base):
+    """Admin broadcast job; progress is saved after every page of recipients"""
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    admin_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    status = Column(String, default='running')  # running, completed, cancelled
+    last_user_pk = Column(Integer, default=0)  # users.id of the last processed recipient
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    progress_chat_id = Column(BigInteger)
+    progress_message_id = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+
+class BroadcastDelivery(Base):
+    """Per-recipient outcome of a broadcast run"""
+    __tablename__ = "broadcast_deliveries"
+    __table_args__ = (
+        UniqueConstraint('broadcast_id', 'user_id', name='uq_broadcast_deliveries_broadcast_user'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    broadcast_id = Column(Integer, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    status = Column(String, nullable=False)  # sent, blocked, chat_not_found, retry_after, failed
+    error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ScheduledJob(Base):
+    """Delayed per-order job (review request, client reminder, stuck order alert)"""
+    __tablename__ = "scheduled_jobs"
+    __table_args__ = (
+        UniqueConstraint('kind', 'order_id', name='uq_scheduled_jobs_kind_order'),
+        Index('ix_scheduled_jobs_status_due_at', 'status', 'due_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    order_id = Column(Integer, nullable=False)
+    due_at = Column(DateTime, nullable=False)  # UTC
+    status = Column(String(20), default='pending')  # pending, running, done, failed
+    attempts = Column(Integer, default=0)
+    locked_until = Column(DateTime)  # lease of a running job; expired leases are picked up again
+    last_error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class NotificationOutbox(Base):
+    """Telegram message queued by the web admin; delivered by webapp/notifications.py"""
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index('ix_notification_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    parse_mode = Column(String(20), default='HTML')
+    status = Column(String(20), default='pending')  # pending, sending, sent, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)  # for 'sending' — end of the lease
+    last_error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+
+class SchemaMigration(Base):
+    """Applied schema migrations (see utils/migrations.py)"""
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+
+class EventWriter:
+    """Background writer that inserts analytics events in batches.
+
+    track_event() only puts a row on an in-memory queue; a daemon thread
+    flushes it with one bulk INSERT every EVENT_BATCH_SIZE events or
+    EVENT_FLUSH_INTERVAL_MS milliseconds. When the queue is full, events
+    are dropped or appended to EVENT_SPILL_PATH (EVENT_OVERFLOW=spill)
+    and re-imported on the next flush. The queue is drained at exit.
+    """
+
+    def __init__(self,
+                 batch_size: int = EVENT_BATCH_SIZE,
+                 flush_interval_ms: int = EVENT_FLUSH_INTERVAL_MS,
+                 max_size: int = EVENT_QUEUE_MAX,
+                 overflow: str = EVENT_OVERFLOW,
+                 spill_path: str = EVENT_SPILL_PATH):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.written = 0
+        self.dropped = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+                    self._thread.start()
+
+    def put(self, user_id: int, event_type: str, event_data: str = None):
+        """Queue an event without touching the database"""
+        row = {'user_id': user_id, 'event_type': event_type,
+               'event_data': event_data, 'created_at': datetime.utcnow()}
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self._overflow([row])
+
+    def _overflow(self, rows: list):
+        if self.overflow == 'spill':
+            try:
+                with self._spill_lock, open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for row in rows:
+                        f.write(json.dumps({**row, 'created_at': row['created_at'].isoformat()},
+                                           ensure_ascii=False) + "\n")
+                return
+            except Exception as e:
+                logger.error(f"Failed to spill events to {self.spill_path}: {e}")
+        self.dropped += len(rows)
+        logger.warning(f"Event queue full, dropped {len(rows)} event(s) ({self.dropped} total)")
+
+    def _load_spill(self) -> list:
+        """Take events spilled to disk earlier, if any"""
+        if self.overflow != 'spill' or not os.path.exists(self.spill_path):
+            return []
+        rows = []
+        with self._spill_lock:
+            try:
+                with open(self.spill_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            row = json.loads(line)
+                            row['created_at'] = datetime.fromisoformat(row['created_at'])
+                            rows.append(row)
+                os.remove(self.spill_path)
+            except Exception as e:
+                logger.error(f"Failed to read spilled events: {e}")
+        return rows
+
+    def _write(self, rows: list):
+        if not rows:
+            return
+        session = get_session()
+        try:
+            session.execute(insert(Event.__table__), rows)
+            session.commit()
+            self.written += len(rows)
+            logger.debug(f"Events flushed: {len(rows)}")
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Failed to track {len(rows)} event(s): {e}")
+            self._overflow(rows)
+        finally:
+            session.close()
+
+    def _drain(self, limit: int = None) -> list:
+        rows = []
+        while limit is None or len(rows) < limit:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                if self._stop.is_set():
+                    break
+            self._write(self._load_spill() + batch)
+        self._write(self._drain())
+
+    def flush(self):
+        """Write everything queued right now (called at shutdown)"""
+        rows = self._drain()
+        while rows:
+            self._write(rows)
+            rows = self._drain(self.batch_size * 10)
+
+    def close(self, timeout: float = 5.0):
+        """Stop the worker and drain the queue"""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
+
+
+event_writer = EventWriter()
+atexit.register(event_writer.close)
+
+
 def track_event(user_id: int, event_type: str, event_data: str = None):
-    """Track user event for analytics"""
+    """Track user event for analytics (buffered, written in batches)"""
+    event_writer.put(user_id, event_type, event_data)
+
+
+def flush_events():
+    """Write all buffered analytics events"""
+    event_writer.flush()
+
+
+# Funnel steps: event types that count as the same step are grouped together
+FUNNEL_STEPS = {
+    'bot_started': ['bot_started'],
+    'order_started': ['order_started'],
+    'order_category_selected': ['order_category_selected'],
+    'order_description_added': ['order_description_added'],
+    'order_photo_added': ['order_photo_added', 'order_photo_skipped'],
+    'order_name_added': ['order_name_added'],
+    'order_phone_added': ['order_phone_added', 'order_phone_skipped'],
+    'order_completed': ['order_completed'],
+}
+
+ABANDONMENT_STEPS = [
+    ('order_started', 'order_category_selected', 'category'),
+    ('order_category_selected', 'order_description_added', 'description'),
+    ('order_description_added', 'order_photo_added', 'photo'),
+    ('order_photo_added', 'order_name_added', 'name'),
+    ('order_name_added', 'order_phone_added', 'phone'),
+    ('order_phone_added', 'order_completed', 'confirm'),
+]
+
+
+def _upsert_rollup_rows(session, rows: list):
+    """Insert rollup rows, adding to the event counter on conflict"""
+    table = DailyEventRollup.__table__
+    if engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'event_type', 'user_id'],
+        set_={'events': table.c.events + stmt.excluded.events})
+    session.execute(stmt, rows)
+
+
+def refresh_event_rollup() -> int:
+    """
+    Fold events added since the last run into daily_event_rollup.
+    Only rows with id above the stored watermark are read, so each call
+    costs O(new events). Returns the number of events processed.
+    """
     session = get_session()
     try:
-        event = Event(user_id=user_id, event_type=event_type, event_data=event_data)
-        session.add(event)
+        state = session.query(AnalyticsState).filter(
+            AnalyticsState.key == 'event_rollup').with_for_update().first()
+        if state is None:
+            state = AnalyticsState(key='event_rollup', value=0)
+            session.add(state)
+        last_id = state.value or 0
+
+        max_id = session.query(func.max(Event.id)).filter(Event.id > last_id).scalar()
+        if max_id is None:
+            session.commit()
+            return 0
+
+        day = func.date(Event.created_at)
+        grouped = session.query(day, Event.event_type, Event.user_id, func.count(Event.id)).filter(
+            Event.id > last_id, Event.id <= max_id).group_by(
+                day, Event.event_type, Event.user_id).all()
+
+        rows = [{'day': d if isinstance(d, date) else date.fromisoformat(str(d)),
+                 'event_type': event_type, 'user_id': user_id, 'events': count}
+                for d, event_type, user_id, count in grouped]
+        for i in range(0, len(rows), 1000):
+            _upsert_rollup_rows(session, rows[i:i + 1000])
+
+        state.value = max_id
         session.commit()
-        logger.debug(f"Event tracked: {event_type} for user {user_id}")
+        processed = sum(r['events'] for r in rows)
+        logger.debug(f"Event rollup refreshed: {processed} events up to id {max_id}")
+        return processed
     except Exception as e:
-        logger.error(f"Failed to track event: {e}")
         session.rollback()
+        logger.error(f"Failed to refresh event rollup: {e}")
+        return 0
     finally:
         session.close()
 
 
-def get_funnel_stats(days: int = 30) -> dict:
-    """Get conversion funnel statistics"""
+def _load_funnel_counts(days: int) -> dict:
+    """Distinct users per funnel step in one grouped pass over the rollup"""
+    refresh_event_rollup()
     session = get_session()
     try:
         from_date = datetime.utcnow() - timedelta(days=days)
-        
-        stats = {}
-        
-        simple_events = [
-            'bot_started',
-            'order_started',
-            'order_category_selected',
-            'order_description_added',
-            'order_name_added',
-            'order_completed'
-        ]
-        
-        for event_type in simple_events:
-            count = session.query(func.count(func.distinct(Event.user_id))).filter(
-                Event.event_type == event_type,
-                Event.created_at >= from_date
-            ).scalar() or 0
-            stats[event_type] = count
-        
-        photo_added = session.query(func.count(func.distinct(Event.user_id))).filter(
-            Event.event_type.in_(['order_photo_added', 'order_photo_skipped']),
-            Event.created_at >= from_date
-        ).scalar() or 0
-        stats['order_photo_added'] = photo_added
-        
-        phone_added = session.query(func.count(func.distinct(Event.user_id))).filter(
-            Event.event_type.in_(['order_phone_added', 'order_phone_skipped']),
-            Event.created_at >= from_date
-        ).scalar() or 0
-        stats['order_phone_added'] = phone_added
-        
-        new_users = session.query(func.count(User.id)).filter(
-            User.created_at >= from_date
-        ).scalar() or 0
-        stats['new_users'] = new_users
-        
-        returning_users = session.query(func.count(func.distinct(Event.user_id))).filter(
-            Event.event_type == 'bot_started',
-            Event.created_at >= from_date,
-            Event.user_id.in_(
-                session.query(User.user_id).filter(User.created_at < from_date)
-            )
-        ).scalar() or 0
-        stats['returning_users'] = returning_users
-        
-        return stats
+        step = case(*[(DailyEventRollup.event_type.in_(types), name)
+                      for name, types in FUNNEL_STEPS.items()])
+        all_types = [t for types in FUNNEL_STEPS.values() for t in types]
+
+        rows = session.query(
+            step,
+            func.count(distinct(DailyEventRollup.user_id)),
+            func.count(distinct(case((User.created_at < from_date, DailyEventRollup.user_id))))
+        ).outerjoin(User, User.user_id == DailyEventRollup.user_id).filter(
+            DailyEventRollup.event_type.in_(all_types),
+            DailyEventRollup.day >= from_date.date()
+        ).group_by(step).all()
+
+        counts = {name: 0 for name in FUNNEL_STEPS}
+        returning_users = 0
+        for name, users, old_users in rows:
+            counts[name] = users
+            if name == 'bot_started':
+                returning_users = old_users
+
+        counts['new_users'] = session.query(func.count(User.id)).filter(
+            User.created_at >= from_date).scalar() or 0
+        counts['returning_users'] = returning_users
+        return counts
     finally:
         session.close()
 
 
+def get_funnel_stats(days: int = 30) -> dict:
+    """Get conversion funnel statistics"""
+    return _cached_stats(f'funnel_{days}', lambda: _load_funnel_counts(days))
+
+
 def get_daily_stats(days: int = 30) -> list:
     """Get daily order and user statistics"""
+    refresh_event_rollup()
     session = get_session()
     try:
         from_date = datetime.utcnow() - timedelta(days=days)
@@ -216,13 +553,14 @@ def get_daily_stats(days: int = 30) -> list:
             Order.created_at >= from_date
         ).group_by(func.date(Order.created_at)).all()
         
+        # В rollup одна строка на (день, событие, пользователь) — это и есть distinct
         daily_users = session.query(
-            func.date(Event.created_at).label('date'),
-            func.count(func.distinct(Event.user_id)).label('users')
+            DailyEventRollup.day.label('date'),
+            func.count(DailyEventRollup.id).label('users')
         ).filter(
-            Event.event_type == 'bot_started',
-            Event.created_at >= from_date
-        ).group_by(func.date(Event.created_at)).all()
+            DailyEventRollup.event_type == 'bot_started',
+            DailyEventRollup.day >= from_date.date()
+        ).group_by(DailyEventRollup.day).all()
         
         orders_dict = {str(row.date): row.orders for row in daily_orders}
         users_dict = {str(row.date): row.users for row in daily_users}
@@ -244,48 +582,29 @@ def get_daily_stats(days: int = 30) -> list:
 
 def get_abandonment_stats(days: int = 30) -> dict:
     """Get order abandonment statistics by step"""
-    session = get_session()
-    try:
-        from_date = datetime.utcnow() - timedelta(days=days)
-        
-        def count_events(event_types):
-            if isinstance(event_types, str):
-                event_types = [event_types]
-            return session.query(func.count(func.distinct(Event.user_id))).filter(
-                Event.event_type.in_(event_types),
-                Event.created_at >= from_date
-            ).scalar() or 0
-        
-        steps = [
-            (['order_started'], ['order_category_selected'], 'category'),
-            (['order_category_selected'], ['order_description_added'], 'description'),
-            (['order_description_added'], ['order_photo_added', 'order_photo_skipped'], 'photo'),
-            (['order_photo_added', 'order_photo_skipped'], ['order_name_added'], 'name'),
-            (['order_name_added'], ['order_phone_added', 'order_phone_skipped'], 'phone'),
-            (['order_phone_added', 'order_phone_skipped'], ['order_completed'], 'confirm')
-        ]
+    counts = get_funnel_stats(days)
+    
+    abandonment = {}
+    for start_step, end_step, step_name in ABANDONMENT_STEPS:
+        started = counts[start_step]
+        completed = counts[end_step]
         
-        abandonment = {}
-        for start_events, end_events, step_name in steps:
-            started = count_events(start_events)
-            completed = count_events(end_events)
-            
-            abandoned = started - completed
-            abandonment[step_name] = {
-                'started': started,
-                'completed': completed,
-                'abandoned': max(0, abandoned),
-                'rate': round((abandoned / started * 100) if started > 0 else 0, 1)
-            }
-        
-        return abandonment
-    finally:
-        session.close()
+        abandoned = started - completed
+        abandonment[step_name] = {
+            'started': started,
+            'completed': completed,
+            'abandoned': max(0, abandoned),
+            'rate': round((abandoned / started * 100) if started > 0 else 0, 1)
+        }
+    
+    return abandonment
 
 
 def init_db():
-    """Initialize database"""
+    """Initialize database: create missing tables, then apply pending migrations"""
     Base.metadata.create_all(bind=engine)
+    from .migrations import run_migrations
+    run_migrations()
 
 
 def get_session():
@@ -410,6 +729,158 @@ def get_all_orders(limit: int = 50):
         session.close()
 
 
+def build_order_filters(user_id=None, date_from=None, date_to=None, period=None, month=None, year=None) -> list:
+    """
+    Turn /orders filter parameters into SQL conditions.
+    Invalid values are ignored, same as the old in-memory filter.
+    """
+    filters = []
+    now = datetime.now()
+
+    if user_id is not None:
+        try:
+            filters.append(Order.user_id == int(user_id))
+        except (ValueError, TypeError):
+            pass
+
+    if date_from and date_to:
+        try:
+            start = datetime.strptime(date_from, '%Y-%m-%d')
+            end = datetime.strptime(date_to, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+            filters.append(Order.created_at.between(start, end))
+        except ValueError:
+            pass
+    elif period:
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if period == 'today':
+            filters.append(Order.created_at >= today)
+        elif period == 'yesterday':
+            filters.append(and_(Order.created_at >= today - timedelta(days=1), Order.created_at < today))
+        elif period == 'week':
+            filters.append(Order.created_at >= now - timedelta(days=7))
+        elif period == 'month':
+            filters.append(Order.created_at >= now - timedelta(days=30))
+
+    # Месяц/год — диапазоном дат, чтобы работал индекс по created_at
+    try:
+        y = int(year) if year else None
+        m = int(month) if month and year else None
+        if y and m:
+            start = datetime(y, m, 1)
+            end = datetime(y + 1, 1, 1) if m == 12 else datetime(y, m + 1, 1)
+            filters.append(and_(Order.created_at >= start, Order.created_at < end))
+        elif y:
+            filters.append(and_(Order.created_at >= datetime(y, 1, 1), Order.created_at < datetime(y + 1, 1, 1)))
+    except ValueError:
+        pass
+
+    return filters
+
+
+def encode_order_cursor(order) -> str:
+    """Keyset cursor for the position right after this order"""
+    return f"{order.created_at.isoformat()}_{order.id}"
+
+
+def _decode_order_cursor(cursor: str):
+    try:
+        created_at, order_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (ValueError, AttributeError):
+        return None
+
+
+def get_orders_page(filters: list, status: str = None, limit: int = 50, before: str = None, offset: int = 0):
+    """
+    Newest-first page of orders using keyset pagination on (created_at, id).
+    Returns (orders, next_cursor); next_cursor is None on the last page.
+    offset is for callers that can only carry a page number (Telegram callback data).
+    """
+    session = get_session()
+    try:
+        query = session.query(Order).filter(*filters)
+        if status:
+            query = query.filter(Order.status == status)
+        position = _decode_order_cursor(before) if before else None
+        if position:
+            created_at, order_id = position
+            query = query.filter(or_(
+                Order.created_at < created_at,
+                and_(Order.created_at == created_at, Order.id < order_id)))
+        orders = query.order_by(Order.created_at.desc(), Order.id.desc()).offset(offset).limit(limit + 1).all()
+        next_cursor = encode_order_cursor(orders[limit - 1]) if len(orders) > limit else None
+        return orders[:limit], next_cursor
+    finally:
+        session.close()
+
+
+def iter_orders(filters: list, status: str = None, chunk_size: int = 500):
+    """
+    Stream orders newest-first without loading them all into memory.
+    Rows are fetched from the DB chunk_size at a time; the session stays
+    open until the generator is exhausted or closed.
+    """
+    session = get_session()
+    try:
+        query = session.query(Order).filter(*filters)
+        if status:
+            query = query.filter(Order.status == status)
+        query = query.order_by(Order.created_at.desc(), Order.id.desc())
+        for order in query.yield_per(chunk_size):
+            yield order
+            session.expunge(order)
+    finally:
+        session.close()
+
+
+def get_order_status_counts(filters: list, cache_key: str = None) -> dict:
+    """
+    Order counts per status (and 'all') for the given filters in one GROUP BY.
+    With cache_key the result is kept in the stats cache (dropped on any order change).
+    """
+    def load():
+        session = get_session()
+        try:
+            rows = session.query(Order.status, func.count(Order.id)).filter(*filters).group_by(Order.status).all()
+            counts = {status: count for status, count in rows}
+            counts['all'] = sum(count for _, count in rows)
+            return counts
+        finally:
+            session.close()
+
+    if cache_key is None:
+        return load()
+    return _cached_stats(f'order_counts:{cache_key}', load)
+
+
+def _load_order_years() -> list:
+    session = get_session()
+    try:
+        year = extract('year', Order.created_at)
+        rows = session.query(year).filter(Order.created_at != None).distinct().order_by(year.desc()).all()
+        return [int(y) for (y,) in rows if y is not None]
+    finally:
+        session.close()
+
+
+def get_order_years() -> list:
+    """Years that have orders, newest first"""
+    return _cached_stats('order_years', _load_order_years)
+
+
+def get_user_order_counts(user_ids: list) -> dict:
+    """Number of orders per user, only for the given users"""
+    if not user_ids:
+        return {}
+    session = get_session()
+    try:
+        rows = session.query(Order.user_id, func.count(Order.id)).filter(
+            Order.user_id.in_(set(user_ids))).group_by(Order.user_id).all()
+        return {str(uid): count for uid, count in rows}
+    finally:
+        session.close()
+
+
 def get_orders_by_status(status: str):
     """Get orders by status"""
     session = get_session()
@@ -468,6 +939,7 @@ def add_user(user_id: int,
                         phone=phone)
             session.add(user)
         session.commit()
+        user_state_cache.invalidate(user_id)
         return user.id
     except Exception:
         session.rollback()
@@ -502,6 +974,7 @@ def block_user(user_id: int, blocked: bool = True):
         if user:
             user.is_blocked = blocked
             session.commit()
+            user_state_cache.invalidate(user_id)
             return True
         return False
     finally:
@@ -510,12 +983,7 @@ def block_user(user_id: int, blocked: bool = True):
 
 def is_user_blocked(user_id: int) -> bool:
     """Check if user is blocked"""
-    session = get_session()
-    try:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        return user.is_blocked if user else False
-    finally:
-        session.close()
+    return _get_cached_user_state(user_id)['is_blocked']
 
 
 def set_admin(user_id: int, is_admin: bool = True):
@@ -526,6 +994,7 @@ def set_admin(user_id: int, is_admin: bool = True):
         if user:
             user.is_admin = is_admin
             session.commit()
+            user_state_cache.invalidate(user_id)
             return True
         return False
     finally:
@@ -543,23 +1012,198 @@ def is_admin(user_id: int) -> bool:
         except Exception as e:
             logger.error(f"Error parsing ADMIN_IDS: {e}")
 
+    return _get_cached_user_state(user_id)['is_admin']
+
+
+def get_admins():
+    """Get all admin users"""
     session = get_session()
     try:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        return user.is_admin if user else False
+        return session.query(User).filter(User.is_admin == True).all()
     finally:
         session.close()
 
 
-def get_admins():
-    """Get all admin users"""
+def _load_admin_user_ids() -> list:
     session = get_session()
     try:
-        return session.query(User).filter(User.is_admin == True).all()
+        return [int(uid) for (uid,) in session.query(User.user_id).filter(User.is_admin == True)]
+    finally:
+        session.close()
+
+
+def get_admin_user_ids() -> list:
+    """Telegram ids of DB admins; cached with the dashboard stats, admin changes invalidate it"""
+    return _cached_stats('admin_user_ids', _load_admin_user_ids)
+
+
+def count_broadcast_recipients() -> int:
+    """Number of users a broadcast goes to (not blocked, not unreachable)"""
+    session = get_session()
+    try:
+        return session.query(func.count(User.id)).filter(
+            User.is_blocked == False, User.unreachable_at.is_(None)).scalar() or 0
     finally:
         session.close()
 
 
+def get_broadcast_recipients(after_pk: int = 0, limit: int = 200) -> list:
+    """Next page of (users.id, telegram user_id) after the given users.id"""
+    session = get_session()
+    try:
+        return session.query(User.id, User.user_id).filter(
+            User.is_blocked == False, User.unreachable_at.is_(None),
+            User.id > after_pk).order_by(User.id).limit(limit).all()
+    finally:
+        session.close()
+
+
+def create_broadcast(admin_id: int, text: str, total: int) -> int:
+    """Create a broadcast job and return its id"""
+    session = get_session()
+    try:
+        broadcast = Broadcast(admin_id=admin_id, text=text, total=total)
+        session.add(broadcast)
+        session.commit()
+        return broadcast.id
+    finally:
+        session.close()
+
+
+def get_broadcast(broadcast_id: int):
+    """Get broadcast job by id"""
+    session = get_session()
+    try:
+        return session.query(Broadcast).filter(Broadcast.id == broadcast_id).first()
+    finally:
+        session.close()
+
+
+def get_running_broadcasts() -> list:
+    """Broadcasts that were interrupted (e.g. by a restart) and should be resumed"""
+    session = get_session()
+    try:
+        return session.query(Broadcast).filter(Broadcast.status == 'running').order_by(Broadcast.id).all()
+    finally:
+        session.close()
+
+
+def update_broadcast(broadcast_id: int, **fields) -> bool:
+    """Save broadcast progress / status fields"""
+    session = get_session()
+    try:
+        updated = session.query(Broadcast).filter(Broadcast.id == broadcast_id).update(
+            fields, synchronize_session=False)
+        session.commit()
+        return bool(updated)
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error updating broadcast {broadcast_id}: {e}")
+        return False
+    finally:
+        session.close()
+
+
+BROADCAST_UNREACHABLE_STATUSES = ('blocked', 'chat_not_found')
+
+
+def save_broadcast_page(broadcast_id: int, deliveries: list, **fields) -> bool:
+    """
+    Record a page of delivery outcomes and the broadcast progress in one transaction.
+    deliveries is a list of (telegram user_id, status, error). Users whose
+    status is in BROADCAST_UNREACHABLE_STATUSES are marked unreachable so
+    later broadcasts skip them. A resumed page overwrites earlier outcomes.
+    """
+    session = get_session()
+    try:
+        if deliveries:
+            table = BroadcastDelivery.__table__
+            if engine.dialect.name == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            now = datetime.utcnow()
+            stmt = dialect_insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['broadcast_id', 'user_id'],
+                set_={'status': stmt.excluded.status, 'error': stmt.excluded.error,
+                      'created_at': stmt.excluded.created_at})
+            session.execute(stmt, [{'broadcast_id': broadcast_id, 'user_id': user_id, 'status': status,
+                                    'error': (error or '')[:200] or None, 'created_at': now}
+                                   for user_id, status, error in deliveries])
+
+            unreachable = [user_id for user_id, status, _ in deliveries
+                           if status in BROADCAST_UNREACHABLE_STATUSES]
+            if unreachable:
+                session.query(User).filter(User.user_id.in_(unreachable)).update(
+                    {User.unreachable_at: now}, synchronize_session=False)
+
+        if fields:
+            session.query(Broadcast).filter(Broadcast.id == broadcast_id).update(
+                fields, synchronize_session=False)
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error saving broadcast {broadcast_id} page: {e}")
+        return False
+    finally:
+        session.close()
+
+
+def get_broadcast_delivery_counts(broadcast_ids: list) -> dict:
+    """{broadcast_id: {status: count}} from the delivery ledger, one GROUP BY"""
+    if not broadcast_ids:
+        return {}
+    session = get_session()
+    try:
+        counts = {}
+        for broadcast_id, status, count in session.query(
+                BroadcastDelivery.broadcast_id, BroadcastDelivery.status, func.count(BroadcastDelivery.id)).filter(
+                    BroadcastDelivery.broadcast_id.in_(broadcast_ids)).group_by(
+                        BroadcastDelivery.broadcast_id, BroadcastDelivery.status):
+            counts.setdefault(broadcast_id, {})[status] = count
+        return counts
+    finally:
+        session.close()
+
+
+def get_broadcast_report(limit: int = 10) -> list:
+    """
+    Recent broadcast runs with per-status delivery counts.
+    Returns dicts with delivery_rate (% of processed recipients reached)
+    and throughput (messages per second from start to finish).
+    """
+    session = get_session()
+    try:
+        broadcasts = session.query(Broadcast).order_by(Broadcast.id.desc()).limit(limit).all()
+    finally:
+        session.close()
+    if not broadcasts:
+        return []
+
+    counts = get_broadcast_delivery_counts([b.id for b in broadcasts])
+    report = []
+    for b in broadcasts:
+        by_status = counts.get(b.id, {})
+        processed = sum(by_status.values())
+        end = b.finished_at or datetime.utcnow()
+        duration = (end - b.created_at).total_seconds() if b.created_at else 0
+        report.append({
+            'id': b.id,
+            'status': b.status,
+            'created_at': b.created_at,
+            'finished_at': b.finished_at,
+            'total': b.total or 0,
+            'processed': processed,
+            'by_status': by_status,
+            'delivery_rate': round(by_status.get('sent', 0) / processed * 100, 1) if processed else 0.0,
+            'duration': duration,
+            'throughput': round(processed / duration, 1) if duration > 0 else 0.0,
+        })
+    return report
+
+
 def log_spam(user_id: int, message: str, reason: str):
     """Log spam message"""
     session = get_session()
@@ -581,30 +1225,79 @@ def get_spam_logs(limit: int = 50):
         session.close()
 
 
-def get_statistics():
-    """Get bot statistics"""
+_stats_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_stats_cache_lock = threading.Lock()
+
+
+def _cached_stats(name: str, loader):
+    """Return a cached aggregate, recomputing it after STATS_CACHE_TTL seconds.
+    At most STATS_CACHE_MAX_ENTRIES aggregates are kept, least recently used go first."""
+    with _stats_cache_lock:
+        entry = _stats_cache.get(name)
+        if entry is not None and time.time() - entry[1] < STATS_CACHE_TTL:
+            _stats_cache.move_to_end(name)
+            return copy.deepcopy(entry[0])
+    value = loader()
+    with _stats_cache_lock:
+        _stats_cache[name] = (value, time.time())
+        _stats_cache.move_to_end(name)
+        while len(_stats_cache) > STATS_CACHE_MAX_ENTRIES:
+            _stats_cache.popitem(last=False)
+    return copy.deepcopy(value)
+
+
+def invalidate_stats_cache():
+    """Drop cached dashboard aggregates"""
+    with _stats_cache_lock:
+        _stats_cache.clear()
+
+
+_STATS_MODELS = (Order, Review, SpamLog, User)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _invalidate_stats_on_flush(session, flush_context):
+    """Invalidate cached stats when orders, reviews, spam logs or users change"""
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, _STATS_MODELS):
+            invalidate_stats_cache()
+            return
+    for obj in session.dirty:
+        if isinstance(obj, (Order, Review, SpamLog)):
+            invalidate_stats_cache()
+            return
+        if isinstance(obj, User) and (attributes.get_history(obj, 'is_blocked').has_changes()
+                                      or attributes.get_history(obj, 'is_admin').has_changes()):
+            invalidate_stats_cache()
+            return
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _invalidate_stats_on_bulk(orm_execute_state):
+    """Same for bulk query.update()/delete() on orders and reviews"""
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in (Order, Review, SpamLog):
+            invalidate_stats_cache()
+
+
+def _load_statistics() -> dict:
     session = get_session()
     try:
-        total_users = session.query(User).count()
-        total_orders = session.query(Order).count()
-        new_orders = session.query(Order).filter(Order.status == 'new').count()
-        accepted_orders = session.query(Order).filter(Order.status == 'accepted').count()
-        in_progress = session.query(Order).filter(
-            Order.status == 'in_progress').count()
-        completed = session.query(Order).filter(
-            Order.status == 'completed').count()
-        issued = session.query(Order).filter(Order.status == 'issued').count()
-        blocked_users = session.query(User).filter(
-            User.is_blocked == True).count()
-        spam_count = session.query(SpamLog).count()
+        by_status = dict(session.query(Order.status, func.count(Order.id)).group_by(Order.status).all())
+        total_users, blocked_users, spam_count = session.execute(select(
+            select(func.count(User.id)).scalar_subquery(),
+            select(func.count(User.id)).where(User.is_blocked == True).scalar_subquery(),
+            select(func.count(SpamLog.id)).scalar_subquery()
+        )).one()
         return {
             "total_users": total_users,
-            "total_orders": total_orders,
-            "new_orders": new_orders,
-            "accepted_orders": accepted_orders,
-            "in_progress": in_progress,
-            "completed": completed,
-            "issued": issued,
+            "total_orders": sum(by_status.values()),
+            "new_orders": by_status.get('new', 0),
+            "accepted_orders": by_status.get('accepted', 0),
+            "in_progress": by_status.get('in_progress', 0),
+            "completed": by_status.get('completed', 0),
+            "issued": by_status.get('issued', 0),
             "blocked_users": blocked_users,
             "spam_count": spam_count
         }
@@ -612,6 +1305,11 @@ def get_statistics():
         session.close()
 
 
+def get_statistics():
+    """Get bot statistics"""
+    return _cached_stats('statistics', _load_statistics)
+
+
 def get_moscow_date():
     """Get current date in Moscow timezone"""
     return datetime.now(MOSCOW_TZ).date()
@@ -657,11 +1355,18 @@ def save_chat_history(user_id: int,
                               complexity=complexity)
         session.add(history)
 
-        user = session.query(User).filter(User.user_id == user_id).first()
-        if user:
-            user.questions_count = (user.questions_count or 0) + 1
+        session.query(User).filter(User.user_id == user_id).update(
+            {User.questions_count: func.coalesce(User.questions_count, 0) + 1},
+            synchronize_session=False)
 
         session.commit()
+
+        state = user_state_cache.get(user_id)
+        if state is not None:
+            recent_topics = ([topic] if topic else []) + state['recent_topics']
+            user_state_cache.update(user_id,
+                                    questions_count=state['questions_count'] + 1,
+                                    recent_topics=recent_topics[:5])
     except Exception as e:
         session.rollback()
         logger.error(f"Error saving chat history: {e}")
@@ -682,31 +1387,125 @@ def get_user_chat_history(user_id: int, limit: int = 5):
 
 def get_user_context(user_id: int) -> dict:
     """Get user context for adaptive prompts"""
-    session = get_session()
-    try:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        history = session.query(ChatHistory).filter(
-            ChatHistory.user_id == user_id).order_by(
-                ChatHistory.created_at.desc()).limit(5).all()
+    state = _get_cached_user_state(user_id)
+    return {
+        'is_new': not state['exists'],
+        'tone': state['tone'],
+        'questions_count': state['questions_count'],
+        'recent_topics': list(state['recent_topics']),
+        'name': state['first_name']
+    }
+
+
+def _load_user_state(session, user_id: int) -> dict:
+    """Read everything handle_message needs about a user in one session"""
+    user = session.query(User).filter(User.user_id == user_id).first()
+    if not user:
+        return {
+            'exists': False,
+            'is_blocked': False,
+            'is_admin': False,
+            'tone': 'friendly',
+            'questions_count': 0,
+            'recent_topics': [],
+            'username': None,
+            'first_name': None,
+            'last_name': None
+        }
 
-        if not user:
-            return {
-                'is_new': True,
-                'tone': 'friendly',
-                'questions_count': 0,
-                'recent_topics': [],
-                'name': None
-            }
+    history = session.query(ChatHistory.topic).filter(
+        ChatHistory.user_id == user_id).order_by(
+            ChatHistory.created_at.desc()).limit(5).all()
+
+    return {
+        'exists': True,
+        'is_blocked': bool(user.is_blocked),
+        'is_admin': bool(user.is_admin),
+        'tone': user.tone_preference or 'friendly',
+        'questions_count': user.questions_count or 0,
+        'recent_topics': [h.topic for h in history if h.topic],
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name
+    }
+
+
+def _get_cached_user_state(user_id: int) -> dict:
+    """Cached user state without creating the user"""
+    state = user_state_cache.get(user_id)
+    if state is None:
+        session = get_session()
+        try:
+            state = _load_user_state(session, user_id)
+        finally:
+            session.close()
+        user_state_cache.set(user_id, state)
+    return state
+
+
+def get_user_state(user_id: int,
+                   username: Optional[str] = None,
+                   first_name: Optional[str] = None,
+                   last_name: Optional[str] = None) -> dict:
+    """
+    Cached user state for the message handler (replaces add_user + is_user_blocked).
+    Creates the user on first contact and refreshes the profile when the
+    Telegram name changes; otherwise served from memory. last_active is
+    only remembered here and written later by flush_last_active().
+    """
+    state = user_state_cache.get(user_id)
+    profile_changed = state is not None and any(
+        new and new != state[key]
+        for key, new in (('username', username), ('first_name', first_name), ('last_name', last_name)))
+
+    if state is None or not state['exists'] or profile_changed:
+        session = get_session()
+        try:
+            user = session.query(User).filter(User.user_id == user_id).first()
+            if user:
+                user.username = username or user.username
+                user.first_name = first_name or user.first_name
+                user.last_name = last_name or user.last_name
+            else:
+                session.add(User(user_id=user_id,
+                                 username=username,
+                                 first_name=first_name,
+                                 last_name=last_name))
+            session.commit()
+            state = _load_user_state(session, user_id)
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error loading user state for {user_id}: {e}")
+            state = _load_user_state(session, user_id)
+        finally:
+            session.close()
+        user_state_cache.set(user_id, state)
 
-        recent_topics = [h.topic for h in history if h.topic]
+    user_state_cache.touch(user_id)
+    return state
 
-        return {
-            'is_new': False,
-            'tone': user.tone_preference or 'friendly',
-            'questions_count': user.questions_count or 0,
-            'recent_topics': recent_topics,
-            'name': user.first_name
-        }
+
+def flush_last_active() -> int:
+    """Write coalesced last_active timestamps in one batched UPDATE.
+    A user who writes to the bot can be reached again, so unreachable_at is cleared too."""
+    pending = user_state_cache.pop_pending_active()
+    user_state_cache.clear_old()
+    if not pending:
+        return 0
+
+    session = get_session()
+    try:
+        stmt = update(User.__table__).where(
+            User.__table__.c.user_id == bindparam('b_user_id')).values(
+                last_active=bindparam('b_last_active'), unreachable_at=None)
+        session.execute(stmt, [{'b_user_id': uid, 'b_last_active': ts}
+                               for uid, ts in pending.items()])
+        session.commit()
+        return len(pending)
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error flushing last_active: {e}")
+        return 0
     finally:
         session.close()
 
@@ -719,6 +1518,7 @@ def update_user_tone(user_id: int, tone: str):
         if user:
             user.tone_preference = tone
             session.commit()
+            user_state_cache.invalidate(user_id)
             return True
         return False
     finally:
@@ -765,6 +1565,243 @@ def mark_feedback_requested(order_id: int):
         session.close()
 
 
+# Delays of per-order jobs, counted from the status change
+REVIEW_REQUEST_DELAY = timedelta(days=int(os.getenv('REVIEW_REQUEST_DELAY_DAYS', '3')))
+CLIENT_REMINDER_DELAY = timedelta(days=int(os.getenv('CLIENT_REMINDER_DELAY_DAYS', '3')))
+STUCK_ORDER_DELAY = timedelta(days=int(os.getenv('STUCK_ORDER_DELAY_DAYS', '5')))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+
+
+def _upsert_jobs(connection, rows: list):
+    """Insert or re-arm (kind, order_id) jobs; one row per kind and order"""
+    table = ScheduledJob.__table__
+    if engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['kind', 'order_id'],
+        set_={'due_at': stmt.excluded.due_at, 'status': 'pending', 'attempts': 0,
+              'locked_until': None, 'last_error': None})
+    connection.execute(stmt, [{'kind': kind, 'order_id': order_id, 'due_at': due_at,
+                               'status': 'pending', 'attempts': 0, 'created_at': datetime.utcnow()}
+                              for kind, order_id, due_at in rows])
+
+
+def _order_jobs_for_change(order, is_new: bool) -> list:
+    """Jobs an order needs after it was created or its status/reminder flag changed"""
+    now = datetime.utcnow()
+    status = order.status
+    if is_new:
+        return [('client_reminder', order.id, now + CLIENT_REMINDER_DELAY)] if status == 'new' else []
+
+    jobs = []
+    if attributes.get_history(order, 'status').has_changes():
+        if status == 'new':
+            jobs.append(('client_reminder', order.id, now + CLIENT_REMINDER_DELAY))
+        elif status == 'accepted':
+            jobs.append(('stuck_alert', order.id, now + STUCK_ORDER_DELAY))
+        elif status == 'completed':
+            jobs.append(('review_request', order.id, now + REVIEW_REQUEST_DELAY))
+    elif status == 'new' and attributes.get_history(order, 'client_reminded').deleted == [True] \
+            and not order.client_reminded:
+        # Клиент обещал принести позже — напомним ещё раз через тот же срок
+        jobs.append(('client_reminder', order.id, now + CLIENT_REMINDER_DELAY))
+    return jobs
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _schedule_order_jobs_on_flush(session, flush_context):
+    """Orders enqueue their own delayed jobs in the same transaction as the change"""
+    rows = []
+    for obj in session.new:
+        if isinstance(obj, Order):
+            rows.extend(_order_jobs_for_change(obj, is_new=True))
+    for obj in session.dirty:
+        if isinstance(obj, Order):
+            rows.extend(_order_jobs_for_change(obj, is_new=False))
+    if rows:
+        _upsert_jobs(session.connection(), rows)
+
+
+def claim_due_jobs(limit: int = 50) -> list:
+    """
+    Take up to limit due jobs and lease them for JOB_LEASE_SECONDS.
+    Jobs whose lease expired (the process died mid-send) are taken again.
+    Returns detached ScheduledJob rows.
+    """
+    session = get_session()
+    try:
+        now = datetime.utcnow()
+        claimable = or_(ScheduledJob.status == 'pending',
+                        and_(ScheduledJob.status == 'running', ScheduledJob.locked_until < now))
+        ids = [row[0] for row in session.query(ScheduledJob.id).filter(
+            ScheduledJob.due_at <= now, claimable).order_by(ScheduledJob.due_at).limit(limit)]
+        if not ids:
+            return []
+
+        lease = now + timedelta(seconds=JOB_LEASE_SECONDS)
+        session.query(ScheduledJob).filter(ScheduledJob.id.in_(ids), claimable).update(
+            {ScheduledJob.status: 'running', ScheduledJob.locked_until: lease,
+             ScheduledJob.attempts: ScheduledJob.attempts + 1}, synchronize_session=False)
+        session.commit()
+        # Only rows carrying our lease are ours (another worker may have claimed the rest)
+        return session.query(ScheduledJob).filter(
+            ScheduledJob.id.in_(ids), ScheduledJob.status == 'running',
+            ScheduledJob.locked_until == lease).all()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error claiming scheduled jobs: {e}")
+        return []
+    finally:
+        session.close()
+
+
+def finish_job(job_id: int, next_due: Optional[datetime] = None, error: Optional[str] = None,
+               failed: bool = False):
+    """Mark a claimed job done, re-arm it for next_due, or record a failure"""
+    session = get_session()
+    try:
+        if next_due is not None:
+            fields = {ScheduledJob.status: 'pending', ScheduledJob.due_at: next_due,
+                      ScheduledJob.locked_until: None}
+        else:
+            fields = {ScheduledJob.status: 'failed' if failed else 'done', ScheduledJob.locked_until: None}
+        if error:
+            fields[ScheduledJob.last_error] = error[:500]
+        session.query(ScheduledJob).filter(ScheduledJob.id == job_id).update(
+            fields, synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error finishing scheduled job {job_id}: {e}")
+    finally:
+        session.close()
+
+
+def get_next_job_due() -> Optional[datetime]:
+    """Earliest due time among pending jobs (uses ix_scheduled_jobs_status_due_at)"""
+    session = get_session()
+    try:
+        return session.query(func.min(ScheduledJob.due_at)).filter(
+            ScheduledJob.status == 'pending').scalar()
+    finally:
+        session.close()
+
+
+def get_orders_by_ids(order_ids: list) -> list:
+    """Orders with the given ids"""
+    if not order_ids:
+        return []
+    session = get_session()
+    try:
+        return session.query(Order).filter(Order.id.in_(order_ids)).all()
+    finally:
+        session.close()
+
+
+def mark_client_reminded(order_id: int):
+    """Remember that the client got the "bring your item" reminder"""
+    session = get_session()
+    try:
+        session.query(Order).filter(Order.id == order_id).update(
+            {Order.client_reminded: True, Order.last_reminder_date: datetime.utcnow()},
+            synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+
+
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '60'))
+
+
+def enqueue_notification(chat_id: int, text: str, parse_mode: str = 'HTML') -> Optional[int]:
+    """Add a Telegram message to the outbox; returns its id"""
+    session = get_session()
+    try:
+        item = NotificationOutbox(chat_id=chat_id, text=text, parse_mode=parse_mode)
+        session.add(item)
+        session.commit()
+        return item.id
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error queueing notification for {chat_id}: {e}")
+        return None
+    finally:
+        session.close()
+
+
+def get_notification(notification_id: int):
+    """Outbox row by id"""
+    session = get_session()
+    try:
+        return session.query(NotificationOutbox).filter(NotificationOutbox.id == notification_id).first()
+    finally:
+        session.close()
+
+
+def claim_notifications(limit: int = 20) -> list:
+    """
+    Lease up to limit deliverable outbox rows for OUTBOX_LEASE_SECONDS.
+    Rows left in 'sending' by a dead worker become deliverable when the lease ends.
+    """
+    session = get_session()
+    try:
+        now = datetime.utcnow()
+        deliverable = and_(NotificationOutbox.status.in_(('pending', 'sending')),
+                           NotificationOutbox.next_attempt_at <= now)
+        ids = [row[0] for row in session.query(NotificationOutbox.id).filter(deliverable).order_by(
+            NotificationOutbox.next_attempt_at).limit(limit)]
+        if not ids:
+            return []
+
+        lease = now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        session.query(NotificationOutbox).filter(NotificationOutbox.id.in_(ids), deliverable).update(
+            {NotificationOutbox.status: 'sending', NotificationOutbox.next_attempt_at: lease,
+             NotificationOutbox.attempts: NotificationOutbox.attempts + 1}, synchronize_session=False)
+        session.commit()
+        return session.query(NotificationOutbox).filter(
+            NotificationOutbox.id.in_(ids), NotificationOutbox.status == 'sending',
+            NotificationOutbox.next_attempt_at == lease).all()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error claiming notifications: {e}")
+        return []
+    finally:
+        session.close()
+
+
+def finish_notification(notification_id: int, status: str,
+                        retry_at: Optional[datetime] = None, error: Optional[str] = None):
+    """Record the delivery result: sent, failed, or pending again at retry_at"""
+    session = get_session()
+    try:
+        fields = {NotificationOutbox.status: status, NotificationOutbox.last_error: error[:500] if error else None}
+        if status == 'sent':
+            fields[NotificationOutbox.sent_at] = datetime.utcnow()
+        if retry_at is not None:
+            fields[NotificationOutbox.next_attempt_at] = retry_at
+        session.query(NotificationOutbox).filter(NotificationOutbox.id == notification_id).update(
+            fields, synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error finishing notification {notification_id}: {e}")
+    finally:
+        session.close()
+
+
+def get_next_notification_due() -> Optional[datetime]:
+    """Earliest next_attempt_at among undelivered outbox rows"""
+    session = get_session()
+    try:
+        return session.query(func.min(NotificationOutbox.next_attempt_at)).filter(
+            NotificationOutbox.status.in_(('pending', 'sending'))).scalar()
+    finally:
+        session.close()
+
+
 def create_review(order_id: int,
                   user_id: int,
                   rating: int,
@@ -821,26 +1858,27 @@ def get_average_rating() -> float:
         session.close()
 
 
-def get_review_stats() -> dict:
-    """Get review statistics"""
+def _load_review_stats() -> dict:
     session = get_session()
     try:
-        total = session.query(Review).count()
-        approved = session.query(Review).filter(
-            Review.is_approved == True).count()
-        pending = session.query(Review).filter(
-            Review.is_approved == False,
-            Review.rejected_reason == None).count()
-        rejected = session.query(Review).filter(
-            Review.rejected_reason != None).count()
-        avg_rating = session.query(func.avg(
-            Review.rating)).filter(Review.is_approved == True).scalar()
-
-        rating_distribution = {}
-        for i in range(1, 6):
-            count = session.query(Review).filter(
-                Review.rating == i, Review.is_approved == True).count()
-            rating_distribution[i] = count
+        is_rejected = case((Review.rejected_reason != None, 1), else_=0)
+        rows = session.query(Review.rating, Review.is_approved, is_rejected,
+                             func.count(Review.id)).group_by(
+                                 Review.rating, Review.is_approved, is_rejected).all()
+
+        total = approved = pending = rejected = rating_sum = 0
+        rating_distribution = {i: 0 for i in range(1, 6)}
+        for rating, is_approved, has_reason, count in rows:
+            total += count
+            if has_reason:
+                rejected += count
+            if is_approved is True:
+                approved += count
+                rating_sum += rating * count
+                if rating in rating_distribution:
+                    rating_distribution[rating] += count
+            elif is_approved is False and not has_reason:
+                pending += count
 
         return {
             'total': total,
@@ -848,13 +1886,18 @@ def get_review_stats() -> dict:
             'pending': pending,
             'rejected': rejected,
             'average_rating':
-            round(float(avg_rating), 1) if avg_rating else 0.0,
+            round(rating_sum / approved, 1) if approved else 0.0,
             'distribution': rating_distribution
         }
     finally:
         session.close()
 
 
+def get_review_stats() -> dict:
+    """Get review statistics"""
+    return _cached_stats('review_stats', _load_review_stats)
+
+
 def moderate_review(review_id: int, approve: bool, reason: str = None) -> bool:
     """Approve or reject a review"""
     session = get_session()
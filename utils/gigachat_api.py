@@ -1,20 +1,78 @@
 import os
+import asyncio
 import logging
 from gigachat import GigaChat
 from gigachat.models import Chat, Messages, MessagesRole
-from .cache import cache
+from .cache import cache, normalize_question
+from .keyword_matcher import keywords
 from .knowledge_loader import knowledge
-from .adaptive_prompts import generate_adaptive_prompt, get_context_summary, detect_topic, analyze_question_complexity
+from .adaptive_prompts import build_system_prompt, get_context_summary
 from .database import get_user_context, save_chat_history
 
 logger = logging.getLogger(__name__)
 
 MAX_TOKENS = 100
+GIGACHAT_TIMEOUT = float(os.getenv('GIGACHAT_TIMEOUT', '30'))
+GIGACHAT_MAX_CONCURRENCY = int(os.getenv('GIGACHAT_MAX_CONCURRENCY', '8'))
+
+# Вопросы, с которыми лучше сразу к мастеру
+NEEDS_HUMAN_QUESTION = keywords.register('needs_human', {'complex': [
+    'сложн', 'особ', 'нестандарт', 'индивидуальн',
+    'срочно', 'сегодня', 'консультац', 'записаться',
+    'жалоб', 'претенз', 'брак', 'переделать'
+]})
+# Фразы, по которым видно, что модель не уверена в ответе
+UNCERTAIN_ANSWER = keywords.register('uncertain_answer', {'uncertain': [
+    'не могу', 'затрудняюсь', 'сложно сказать',
+    'нужно посмотреть', 'зависит от', 'уточнить'
+]})
+
+DEFAULT_USER_CONTEXT = {
+    'is_new': True, 'tone': 'friendly', 'questions_count': 0,
+    'recent_topics': [], 'name': None
+}
+
+
+async def load_user_context(user_id: int = None) -> dict:
+    """Контекст пользователя для адаптивного промпта (без user_id — контекст по умолчанию)"""
+    if not user_id:
+        return dict(DEFAULT_USER_CONTEXT)
+    return await asyncio.to_thread(get_user_context, user_id)
+
+
+def answer_cache_variant(context_info: dict) -> tuple:
+    """
+    Переменные промпта, от которых зависит ответ: вместе с вопросом они образуют ключ кэша ответов.
+    Отпечаток базы знаний в ключе: после правки цен или FAQ старые ответы не отдаются
+    """
+    return (context_info['tone'], context_info['time_of_day'], context_info['complexity'],
+            knowledge.get_fingerprint())
+
+
+def _answer_text(response) -> str:
+    """Текст ответа модели или None"""
+    if response and hasattr(response, 'choices') and response.choices:
+        return response.choices[0].message.content
+    return None
+
+
+def _mentions(answer: str, user_name: str) -> bool:
+    """Обращается ли ответ к пользователю по имени"""
+    return bool(answer and user_name and user_name.lower() in answer.lower())
+
+
+def check_needs_human(question: str, answer: str) -> bool:
+    """Определяет, нужна ли помощь человека"""
+    return NEEDS_HUMAN_QUESTION.matches(question) or UNCERTAIN_ANSWER.matches(answer)
 
 
 class GigaChatAPI:
     def __init__(self):
         self.client = None
+        self._semaphore = asyncio.Semaphore(GIGACHAT_MAX_CONCURRENCY)
+        # Запросы к модели, которые сейчас выполняются: {ключ вопроса: (задача, имя автора вопроса)}
+        self._inflight: dict[tuple, tuple[asyncio.Task, str]] = {}
+        self.coalesced = 0
         self._init_client()
     
     def _init_client(self):
@@ -27,7 +85,8 @@ class GigaChatAPI:
             
             self.client = GigaChat(
                 credentials=credentials,
-                verify_ssl_certs=False
+                verify_ssl_certs=False,
+                timeout=GIGACHAT_TIMEOUT
             )
             logger.info("GigaChat client initialized")
         except Exception as e:
@@ -47,11 +106,58 @@ class GigaChatAPI:
             logger.error(f"Fallback search error: {e}")
         return None, False
     
-    async def get_response(self, message: str, user_id: int = None) -> tuple[str, bool]:
+    async def _chat(self, payload: Chat):
+        """
+        Асинхронный запрос к GigaChat.
+        Не больше GIGACHAT_MAX_CONCURRENCY запросов одновременно,
+        ожидание в очереди входит в общий таймаут GIGACHAT_TIMEOUT.
+        """
+        async def _limited_call():
+            async with self._semaphore:
+                return await self.client.achat(payload)
+        
+        return await asyncio.wait_for(_limited_call(), timeout=GIGACHAT_TIMEOUT)
+    
+    async def _chat_shared(self, key: tuple, payload: Chat, user_name: str = None):
+        """
+        Один запрос к GigaChat на одинаковые одновременные вопросы разных пользователей.
+        Пока запрос с тем же ключом выполняется, новые вопросы ждут его
+        результат (или ошибку) вместо своего вызова модели. После
+        завершения ключ освобождается, дальше работает кэш ответов.
+        Ответ, обращённый по имени к автору первого вопроса, другим не отдаётся:
+        для них делается свой запрос (как и в кэш такие ответы не попадают).
+        """
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self._chat(payload))
+            self._inflight[key] = (task, user_name or '')
+            task.add_done_callback(lambda done: self._release(key, done))
+            # Отмена одного ожидающего не отменяет запрос для остальных
+            return await asyncio.shield(task)
+        
+        task, owner_name = entry
+        self.coalesced += 1
+        logger.info(f"Joined in-flight GigaChat request for: {key[0][:30]} ({self.coalesced} coalesced)")
+        response = await asyncio.shield(task)
+        if owner_name and owner_name != user_name and _mentions(_answer_text(response), owner_name):
+            logger.info(f"Shared answer addresses another user, asking separately: {key[0][:30]}")
+            return await self._chat(payload)
+        return response
+    
+    def _release(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key, (None,))[0] is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # ошибку уже получили ожидающие; не даём asyncio ругаться на неё
+    
+    async def get_response(self, message: str, user_id: int = None,
+                           user_context: dict = None) -> tuple[str, bool]:
         """
         Get response from GigaChat with adaptive prompts and context.
         Returns (response_text, needs_human_help) tuple.
         needs_human_help=True when AI couldn't give a good answer.
+        The answer cache is checked before this call (see answer_pipeline);
+        successful model answers are stored in it here.
         """
         needs_human = False
         
@@ -62,18 +168,17 @@ class GigaChatAPI:
             return "Извините, сервис временно недоступен. Позвоните нам: +7 (968) 396-91-52", True
         
         try:
-            user_context = get_user_context(user_id) if user_id else {
-                'is_new': True, 'tone': 'friendly', 'questions_count': 0, 
-                'recent_topics': [], 'name': None
-            }
-            
-            adaptive_prompt = generate_adaptive_prompt(user_context, message)
-            knowledge_text = knowledge.get_all_knowledge()[:2500]
-            full_system_prompt = adaptive_prompt + knowledge_text
+            if user_context is None:
+                user_context = await load_user_context(user_id)
             
             context_info = get_context_summary(user_context, message)
             logger.info(f"Adaptive context: {context_info}")
             
+            full_system_prompt = build_system_prompt(
+                user_context, message,
+                knowledge.get_context(message), knowledge.version
+            )
+            
             payload = Chat(
                 messages=[
                     Messages(
@@ -89,18 +194,24 @@ class GigaChatAPI:
                 temperature=0.7
             )
             
-            response = self.client.chat(payload)
+            # Ключ тот же, что у кэша ответов: без имени и других личных полей,
+            # чтобы одинаковые вопросы разных пользователей шли одним запросом
+            inflight_key = (normalize_question(message), *answer_cache_variant(context_info), knowledge.version)
+            user_name = user_context.get('name')
+            response = await self._chat_shared(inflight_key, payload, user_name)
             logger.info(f"GigaChat response received for: {message[:30]}")
             
-            if response and hasattr(response, 'choices') and response.choices:
-                answer = response.choices[0].message.content
+            answer = _answer_text(response)
+            if answer is not None:
+                # Персональные ответы (с именем клиента) другим пользователям не отдаём
+                if not _mentions(answer, user_name):
+                    cache.set(message, answer, *answer_cache_variant(context_info))
                 
                 if user_id:
-                    topic = detect_topic(message)
-                    complexity = analyze_question_complexity(message)
-                    save_chat_history(user_id, message, answer, topic, complexity)
+                    await asyncio.to_thread(save_chat_history, user_id, message, answer,
+                                            context_info['topic'], context_info['complexity'])
                 
-                needs_human = self._check_needs_human(message, answer)
+                needs_human = check_needs_human(message, answer)
                 return answer, needs_human
             
             fallback, found = self._get_fallback_response(message)
@@ -108,6 +219,14 @@ class GigaChatAPI:
                 return fallback, False
             
             return "Не удалось получить ответ. Попробуйте переформулировать вопрос или позвоните: +7 (968) 396-91-52", True
+        except asyncio.TimeoutError:
+            logger.warning(f"GigaChat timeout ({GIGACHAT_TIMEOUT}s) for: {message[:30]}")
+            
+            fallback, found = self._get_fallback_response(message)
+            if found:
+                return fallback, False
+            
+            return "Иголочка задумалась дольше обычного 🧵 Попробуйте ещё раз или позвоните нам: +7 (968) 396-91-52", True
         except Exception as e:
             logger.error(f"GigaChat error: {e}")
             
@@ -116,38 +235,7 @@ class GigaChatAPI:
                 return fallback, False
             
             return "Ой, что-то пошло не так 🧵 Попробуйте позже или позвоните нам: +7 (968) 396-91-52", True
-    
-    def _check_needs_human(self, question: str, answer: str) -> bool:
-        """Определяет, нужна ли помощь человека"""
-        complex_keywords = [
-            'сложн', 'особ', 'нестандарт', 'индивидуальн',
-            'срочно', 'сегодня', 'консультац', 'записаться',
-            'жалоб', 'претенз', 'брак', 'переделать'
-        ]
-        
-        question_lower = question.lower()
-        for keyword in complex_keywords:
-            if keyword in question_lower:
-                return True
-        
-        uncertain_phrases = [
-            'не могу', 'затрудняюсь', 'сложно сказать',
-            'нужно посмотреть', 'зависит от', 'уточнить'
-        ]
-        answer_lower = answer.lower()
-        for phrase in uncertain_phrases:
-            if phrase in answer_lower:
-                return True
-        
-        return False
 
 
-gigachat = GigaChatAPI()
-
 
-async def get_ai_response(text: str, user_id: int = None) -> tuple[str, bool]:
-    """
-    Get AI response from GigaChat with adaptive context.
-    Returns (response_text, needs_human_help) tuple.
-    """
-    return await gigachat.get_response(text, user_id)
+gigachat = GigaChatAPI()
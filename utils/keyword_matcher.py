@@ -0,0 +1,181 @@
+"""
+Общий движок поиска ключевых слов.
+
+Классификаторы бота (антиспам, тема и сложность вопроса, нужен ли мастер,
+фоллбэк базы знаний) раньше перебирали свои списки через
+`word in text.lower()`, и одно сообщение просматривалось десятки раз.
+Теперь все наборы слов регистрируются в одном KeywordMatcher:
+
+- слова собираются в одно регулярное выражение в виде префиксного дерева
+  (как автомат Ахо–Корасик: на каждой позиции текста проверяется один путь
+  по дереву, а не каждое слово по отдельности);
+- один проход по тексту находит все слова всех наборов, результат кэшируется
+  по тексту, так что остальные классификаторы того же сообщения его не сканируют;
+- каждый набор (KeywordSet) отвечает только за свои категории.
+
+Семантика та же, что у `in`: слово ищется как подстрока текста в нижнем
+регистре, пересекающиеся и вложенные слова тоже находятся.
+"""
+import os
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+KEYWORD_SCAN_CACHE_SIZE = int(os.getenv('KEYWORD_SCAN_CACHE_SIZE', '512'))
+
+_EMPTY: FrozenSet[str] = frozenset()
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Регулярное выражение-дерево: общие префиксы слов проверяются один раз"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node: dict) -> str:
+        is_end = '' in node
+        branches = [re.escape(char) + build(child) for char, child in node.items() if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Жадный квантификатор: на каждой позиции находится самое длинное слово
+        if is_end:
+            return ('(?:' + body + ')?') if len(branches) == 1 else body + '?'
+        return body
+
+    return build(trie)
+
+
+class KeywordSet:
+    """Набор ключевых слов одного классификатора, разбитых на категории"""
+
+    def __init__(self, matcher: 'KeywordMatcher', name: str, groups: Dict[str, List[str]]):
+        self.matcher = matcher
+        self.name = name
+        self.groups = groups
+        # Порядок объявления сохраняется: first_category/first_keyword отдают то же,
+        # что давал перебор списков по порядку
+        self._category_order = {category: i for i, category in enumerate(groups)}
+        self._word_order = {}
+        for words in groups.values():
+            for word in words:
+                self._word_order.setdefault(word, len(self._word_order))
+        self._words = frozenset(self._word_order)
+
+    def find(self, text: str) -> FrozenSet[str]:
+        """Слова этого набора, встречающиеся в тексте"""
+        return self.matcher.scan(text)[0] & self._words
+
+    def categories(self, text: str) -> FrozenSet[str]:
+        """Категории этого набора, слова которых встречаются в тексте"""
+        return self.matcher.scan(text)[1].get(self.name, _EMPTY)
+
+    def first_category(self, text: str, default: Optional[str] = None) -> Optional[str]:
+        """Первая по порядку объявления категория с совпадением"""
+        found = self.categories(text)
+        if not found:
+            return default
+        return min(found, key=self._category_order.__getitem__)
+
+    def first_keyword(self, text: str) -> Optional[str]:
+        """Первое по порядку объявления найденное слово"""
+        found = self.find(text)
+        if not found:
+            return None
+        return min(found, key=self._word_order.__getitem__)
+
+    def matches(self, text: str) -> bool:
+        """Есть ли в тексте хотя бы одно слово этого набора"""
+        return self.name in self.matcher.scan(text)[1]
+
+
+class KeywordMatcher:
+    """Все наборы ключевых слов, скомпилированные в один автомат"""
+
+    def __init__(self, cache_size: int = KEYWORD_SCAN_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._sets: Dict[str, KeywordSet] = {}
+        self._compiled = None
+
+    def register(self, name: str, groups: Dict[str, Iterable[str]]) -> KeywordSet:
+        """Добавить набор слов {категория: [слова]}; автомат пересоберётся при следующем поиске"""
+        keyword_set = KeywordSet(self, name, {category: [w.lower() for w in words]
+                                              for category, words in groups.items()})
+        self._sets[name] = keyword_set
+        self._compiled = None
+        return keyword_set
+
+    def _compile(self):
+        owners: Dict[str, set] = {}
+        for keyword_set in self._sets.values():
+            for category, words in keyword_set.groups.items():
+                for word in words:
+                    owners.setdefault(word, set()).add((keyword_set.name, category))
+        words = list(owners)
+
+        # Совпадение слова означает и совпадение всех слов, которые в него входят
+        hits = {word: frozenset(w for w in words if w in word) for word in words}
+        hit_categories = {word: frozenset(owner for w in inner for owner in owners[w])
+                          for word, inner in hits.items()}
+
+        # Слова, которые могут начаться внутри найденного слова и выйти за его конец
+        # (напр. «шитье» внутри «ушить»): поиск без пересечений их пропустит.
+        # Для каждого такого сдвига запоминаем, какой символ должен идти после
+        # найденного слова, чтобы совпадение было возможно
+        crossing: Dict[str, Tuple[Tuple[int, FrozenSet[str]], ...]] = {}
+        for word in words:
+            offsets = []
+            for i in range(1, len(word)):
+                tail = word[i:]
+                next_chars = frozenset(w[len(tail)] for w in words
+                                       if len(w) > len(tail) and w.startswith(tail))
+                if next_chars:
+                    offsets.append((i, next_chars))
+            if offsets:
+                crossing[word] = tuple(offsets)
+
+        pattern = _trie_pattern(sorted(words))
+        regex = re.compile(pattern) if pattern else None
+
+        def scan(text: str) -> Tuple[FrozenSet[str], Dict[str, FrozenSet[str]]]:
+            if regex is None:
+                return _EMPTY, {}
+            text = text.lower()
+            found = set()
+            for match in regex.finditer(text):
+                word = match.group()
+                found.add(word)
+                if word in crossing:
+                    next_char = text[match.end():match.end() + 1]
+                    for offset, next_chars in crossing[word]:
+                        if next_char in next_chars:
+                            inner = regex.match(text, match.start() + offset)
+                            if inner:
+                                found.add(inner.group())
+            if not found:
+                return _EMPTY, {}
+            by_set: Dict[str, set] = {}
+            for name, category in frozenset().union(*[hit_categories[word] for word in found]):
+                by_set.setdefault(name, set()).add(category)
+            return (frozenset().union(*[hits[word] for word in found]),
+                    {name: frozenset(categories) for name, categories in by_set.items()})
+
+        return lru_cache(maxsize=self.cache_size)(scan) if self.cache_size else scan
+
+    def scan(self, text: str) -> Tuple[FrozenSet[str], Dict[str, FrozenSet[str]]]:
+        """
+        Один проход по тексту: (все найденные слова, {набор: найденные категории}).
+        Результат кэшируется, повторные вызовы для того же текста бесплатны.
+        """
+        if not text:
+            return _EMPTY, {}
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compiled = self._compile()
+        return compiled(text)
+
+
+keywords = KeywordMatcher()
@@ -1,23 +1,28 @@
 import os
-from typing import Optional
+from typing import Dict
+
+from .knowledge_loader import knowledge
+
 
 class KnowledgeBase:
-    def __init__(self):
-        self.data_dir = 'data/knowledge_base'
-        self.knowledge = {}
-        self._load_knowledge()
-    
-    def _load_knowledge(self):
-        """Load knowledge base files"""
-        if os.path.exists(self.data_dir):
-            for filename in os.listdir(self.data_dir):
-                if filename.endswith('.txt'):
-                    filepath = os.path.join(self.data_dir, filename)
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            category = filename.replace('.txt', '')
-                            self.knowledge[category] = f.read()
-                    except Exception:
-                        pass
+    """.txt files of the knowledge base by name (without extension).
+
+    A view over the shared knowledge loader: files are read lazily and edits
+    on disk are picked up without a restart.
+    """
+
+    def __init__(self, loader=knowledge):
+        self.loader = loader
+
+    @property
+    def data_dir(self) -> str:
+        return self.loader.directory
+
+    @property
+    def knowledge(self) -> Dict[str, str]:
+        return {os.path.splitext(filename)[0]: content
+                for filename, content in self.loader.get_files().items()
+                if filename.endswith('.txt')}
+
 
 kb = KnowledgeBase()
@@ -0,0 +1,211 @@
+"""
+Локальный поиск по базе знаний (data/knowledge_base/).
+
+Файлы базы разбиваются на фрагменты (passage):
+- вопрос-ответ из FAQ (`**Вопрос**` в .md, блоки `ВОПРОС:/ОТВЕТ:` через `---`);
+- абзацы остальных файлов; длинные блоки без пустых строк (прайс-лист)
+  делятся по строкам-заголовкам.
+
+По фрагментам строится инвертированный индекс. Слова приводятся к основе:
+нижний регистр, ё→е, отрезается окончание, основа обрезается до STEM_LENGTH
+символов («ремонт», «ремонта», «ремонтируете» → «ремонт»). Ранжирование —
+BM25, поиск возвращает top-k фрагментов за доли миллисекунды.
+При правке файла в индексе заменяются только его фрагменты (replace_source).
+"""
+import os
+import re
+import math
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+KNOWLEDGE_BASE_DIR = os.getenv(
+    'KNOWLEDGE_BASE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'knowledge_base')
+)
+PASSAGE_MAX_CHARS = 600
+STEM_LENGTH = 6
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r'[a-zа-я0-9]+')
+# Окончания, от длинных к коротким; после отрезания должно остаться не меньше 3 букв
+_ENDINGS = sorted("""
+    иями ями ами ого его ому ему ыми ими ией ой ей ий ый ая яя ое ее ую юю ом ем ам ям ах ях ов ев
+    ете ите ешь ишь ет ит ут ют ат ят ть ти ся сь
+    ия ие ию ью а я о е ы и у ю ь
+""".split(), key=len, reverse=True)
+STOP_WORDS = frozenset("""
+    а в во и к ко на над о об от по под при с со у за из до для без же ли бы то не ни но или
+    я мы вы ты он она они оно мне меня вас вам нас нам ваш ваша ваше ваши мой моя мое мои
+    это этот эта эти тот та те так там тут как что где когда чем кто ли ль ж бы есть был
+    можно нужно надо хочу хотел хотела подскажите пожалуйста здравствуйте добрый день
+    сколько стоит стоимость цена какой какая какие ваш
+""".split())
+
+
+def stem(word: str) -> str:
+    """Основа слова для индекса"""
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            word = word[:-len(ending)]
+            break
+    return word[:STEM_LENGTH]
+
+
+def tokenize(text: str) -> List[str]:
+    """Основы значимых слов текста"""
+    text = text.lower().replace('ё', 'е')
+    return [stem(token) for token in _TOKEN_RE.findall(text) if token not in STOP_WORDS]
+
+
+class Passage(NamedTuple):
+    source: str   # имя файла
+    title: str    # вопрос FAQ или первая строка фрагмента
+    text: str     # текст для ответа пользователю
+    extra: str = ''  # индексируется, но не показывается (KEYWORDS:)
+
+
+def _is_heading(line: str) -> bool:
+    return len(line) < 80 and not re.search(r'\d', line)
+
+
+def _split_long(block: str) -> List[str]:
+    """Разбить длинный блок по строкам-заголовкам, не длиннее PASSAGE_MAX_CHARS"""
+    if len(block) <= PASSAGE_MAX_CHARS:
+        return [block]
+    chunks, current = [], []
+    for line in block.split('\n'):
+        size = sum(len(l) + 1 for l in current)
+        if current and (size + len(line) > PASSAGE_MAX_CHARS or (_is_heading(line.strip()) and size > 0
+                                                                   and not _is_heading(current[-1].strip()))):
+            chunks.append('\n'.join(current))
+            current = []
+        current.append(line)
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def _plain_passages(source: str, content: str) -> List[Passage]:
+    passages = []
+    for block in re.split(r'\n\s*\n', content):
+        for chunk in _split_long(block.strip()):
+            chunk = '\n'.join(line.rstrip() for line in chunk.strip().split('\n'))
+            if len(chunk) > 20:
+                passages.append(Passage(source, chunk.split('\n', 1)[0], chunk))
+    return passages
+
+
+def _qa_block_passages(source: str, content: str) -> List[Passage]:
+    """Блоки «ВОПРОС: / ОТВЕТ: / KEYWORDS:», разделённые строкой ---"""
+    passages = []
+    for block in re.split(r'\n-{3,}\s*\n', content):
+        question = re.search(r'^ВОПРОС:\s*(.+)$', block, re.MULTILINE)
+        answer = re.search(r'^ОТВЕТ:\s*(.*?)(?=^KEYWORDS:|\Z)', block, re.MULTILINE | re.DOTALL)
+        keywords = re.search(r'^KEYWORDS:\s*(.+)$', block, re.MULTILINE)
+        if question and answer:
+            passages.append(Passage(source, question.group(1).strip(), answer.group(1).strip(),
+                                    keywords.group(1) if keywords else ''))
+        else:
+            passages.extend(_plain_passages(source, block))
+    return passages
+
+
+def _markdown_faq_passages(source: str, content: str) -> List[Passage]:
+    """FAQ в markdown: строка **Вопрос**, за ней ответ; ## — раздел"""
+    passages = []
+    section, question, answer = '', None, []
+    for line in content.split('\n') + ['## ']:
+        stripped = line.strip()
+        is_question = stripped.startswith('**') and stripped.endswith('**') and len(stripped) > 4
+        if is_question or stripped.startswith('#'):
+            if question and answer:
+                passages.append(Passage(source, question, '\n'.join(answer).strip(), section))
+            question, answer = (stripped.strip('*').strip(), []) if is_question else (None, [])
+            if stripped.startswith('#'):
+                section = stripped.lstrip('#').strip()
+        elif question and stripped:
+            answer.append(stripped)
+    return passages
+
+
+def parse_passages(filename: str, content: str) -> List[Passage]:
+    """Фрагменты одного файла в зависимости от его формата"""
+    if filename.endswith('.md'):
+        return _markdown_faq_passages(filename, content)
+    if re.search(r'^ВОПРОС:', content, re.MULTILINE):
+        return _qa_block_passages(filename, content)
+    return _plain_passages(filename, content)
+
+
+class KnowledgeIndex:
+    """
+    Инвертированный индекс с ранжированием BM25.
+    Фрагменты добавляются и удаляются пофайлово (replace_source), поэтому
+    при правке одного файла индекс не перестраивается целиком.
+    """
+
+    def __init__(self, passages: Iterable[Passage] = ()):
+        self._passages: Dict[int, Passage] = {}
+        self._terms: Dict[int, Counter] = {}
+        self._lengths: Dict[int, int] = {}
+        self._by_source: Dict[str, List[int]] = defaultdict(list)
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._total_length = 0
+        self._next_id = 0
+        self.add(passages)
+
+    @property
+    def passages(self) -> List[Passage]:
+        return list(self._passages.values())
+
+    @property
+    def avg_length(self) -> float:
+        return self._total_length / len(self._passages) if self._passages else 0.0
+
+    def add(self, passages: Iterable[Passage]) -> None:
+        for passage in passages:
+            doc_id = self._next_id
+            self._next_id += 1
+            # Вопрос FAQ учитываем дважды: он точнее всего описывает фрагмент
+            terms = Counter(tokenize(f"{passage.title} {passage.title} {passage.text} {passage.extra}"))
+            self._passages[doc_id] = passage
+            self._terms[doc_id] = terms
+            self._lengths[doc_id] = sum(terms.values())
+            self._by_source[passage.source].append(doc_id)
+            self._total_length += self._lengths[doc_id]
+            for term, tf in terms.items():
+                self.postings[term][doc_id] = tf
+
+    def remove_source(self, source: str) -> None:
+        """Убрать все фрагменты файла"""
+        for doc_id in self._by_source.pop(source, []):
+            self._passages.pop(doc_id)
+            terms = self._terms.pop(doc_id)
+            self._total_length -= self._lengths.pop(doc_id)
+            for term in terms:
+                docs = self.postings[term]
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+
+    def replace_source(self, source: str, passages: Iterable[Passage]) -> None:
+        """Заменить фрагменты одного файла"""
+        self.remove_source(source)
+        self.add(passages)
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[float, Passage]]:
+        """Лучшие k фрагментов для запроса: [(оценка, фрагмент)], по убыванию оценки"""
+        count = len(self._passages)
+        avg_length = self.avg_length
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(score, self._passages[doc_id]) for doc_id, score in best]
@@ -1,32 +1,177 @@
 import os
 import json
+import hashlib
 import re
+import time
+import logging
+import threading
+
+from .keyword_matcher import keywords
+from .knowledge_index import KnowledgeIndex, KNOWLEDGE_BASE_DIR, parse_passages, tokenize
+
+logger = logging.getLogger(__name__)
+
+PRICES_FILE = "Цены на услуги.txt"
+FAQ_FILE = "Ответы на вопросы.md"
+# Как часто (в секундах) проверять, не изменились ли файлы базы знаний; 0 — при каждом обращении
+KB_RELOAD_INTERVAL = float(os.getenv('KB_RELOAD_INTERVAL', '5'))
+
+# Минимальная оценка BM25, при которой найденный фрагмент отдаётся как ответ
+KB_MIN_SCORE = float(os.getenv('KB_MIN_SCORE', '5.0'))
+# Уверенный ответ из FAQ без GigaChat: оценка BM25 не ниже KB_ANSWER_MIN_SCORE
+# и не меньше этой доли слов вопроса совпадает со словами вопроса из FAQ
+KB_ANSWER_MIN_SCORE = float(os.getenv('KB_ANSWER_MIN_SCORE', '7.0'))
+KB_ANSWER_MIN_COVERAGE = float(os.getenv('KB_ANSWER_MIN_COVERAGE', '0.6'))
+# Бюджет базы знаний в системном промпте GigaChat (в токенах, ~3 символа на токен)
+KB_CONTEXT_TOKENS = int(os.getenv('KB_CONTEXT_TOKENS', '500'))
+KB_CONTEXT_CANDIDATES = 12
+# Фрагменты с оценкой ниже этой доли от лучшего в контекст не попадают
+KB_CONTEXT_MIN_RATIO = 0.25
+# Если вопрос ни с чем не совпал, модель получает прайс-лист
+KB_DEFAULT_CONTEXT_SOURCE = PRICES_FILE
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов русского текста"""
+    return len(text) // 3 + 1
+
+
+# Темы фоллбэк-ответов; при совпадении нескольких выбирается первая по порядку
+FALLBACK_KEYWORDS = keywords.register('fallback', {
+    'prices': ['цен', 'прайс', 'стоим', 'сколько'],
+    'contacts': ['адрес', 'где', 'находит', 'метро', 'телефон', 'whatsapp'],
+    'schedule': ['график', 'работает', 'время', 'выходн'],
+    'timing': ['срок', 'долго', 'быстро'],
+    'urgent': ['срочн'],
+    'payment': ['оплат', 'картой', 'наличн'],
+    'warranty': ['гарант'],
+    'services': ['услуг', 'ремонт', 'подгонк', 'укорот', 'штопк'],
+})
+
 
 class KnowledgeLoader:
-    """Загрузчик знаний из файлов"""
+    """
+    Загрузчик знаний из файлов каталога базы знаний (KNOWLEDGE_BASE_DIR).
     
-    def __init__(self):
+    Файлы читаются при первом обращении. Дальше не чаще раза в
+    KB_RELOAD_INTERVAL секунд сверяются mtime и размер файлов: изменённый
+    файл перечитывается, и пересобираются только зависящие от него данные
+    (прайс, FAQ, его фрагменты в индексе). Бота перезапускать не нужно.
+    """
+    
+    def __init__(self, directory: str = KNOWLEDGE_BASE_DIR, reload_interval: float = KB_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
         self.prices = {}
         self.prices_by_category = {}
         self.faq = {}
-        self.load_all()
+        self.files = {}
+        self.index = KnowledgeIndex()
+        # Версия базы знаний: растёт при каждом изменении, по ней сбрасываются кэши промптов
+        self.version = 0
+        # Отпечаток файлов базы (имена, mtime, размеры): в отличие от version
+        # не сбрасывается при перезапуске, поэтому годится для ключей общего кэша ответов
+        self._fingerprint = ''
+        self._all_knowledge = None
+        self._stats = {}
+        self._loaded = False
+        self._next_check = 0.0
+        self._lock = threading.RLock()
     
     def load_all(self):
-        """Загрузить все данные"""
-        self.load_prices()
-        self.load_faq()
+        """Перечитать все файлы заново"""
+        with self._lock:
+            self.prices, self.prices_by_category, self.faq, self.files = {}, {}, {}, {}
+            self.index = KnowledgeIndex()
+            self._stats = {}
+            self.refresh(force=True)
+    
+    def refresh(self, force: bool = False) -> bool:
+        """Подхватить изменения файлов; True, если что-то изменилось"""
+        now = time.monotonic()
+        if self._loaded and not force and now < self._next_check:
+            return False
+        with self._lock:
+            if self._loaded and not force and now < self._next_check:
+                return False
+            self._next_check = now + self.reload_interval
+            self._loaded = True
+            
+            stats = self._scan()
+            changed = [name for name, stat in stats.items() if self._stats.get(name) != stat]
+            removed = [name for name in self._stats if name not in stats]
+            for name in changed:
+                self._load_file(name)
+            for name in removed:
+                self._unload_file(name)
+            self._stats = stats
+            
+            if changed or removed:
+                self._all_knowledge = None
+                self.version += 1
+                self._fingerprint = hashlib.md5(repr(sorted(stats.items())).encode()).hexdigest()[:12]
+                logger.info(f"Knowledge base v{self.version}: reloaded {changed or '-'}, removed {removed or '-'}")
+                return True
+            return False
+    
+    def _scan(self) -> dict:
+        """{имя файла: (mtime, размер)} для .txt и .md каталога"""
+        stats = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(('.txt', '.md')):
+                        stat = entry.stat()
+                        stats[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            logger.warning(f"Knowledge base directory not found: {self.directory}")
+        return stats
+    
+    def _load_file(self, name: str):
+        try:
+            with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                content = f.read().replace('\r\n', '\n')
+        except OSError as e:
+            logger.error(f"Failed to read knowledge file {name}: {e}")
+            return
+        self.files[name] = content
+        self.index.replace_source(name, parse_passages(name, content))
+        if name == PRICES_FILE:
+            self._set_prices(content)
+        elif name == FAQ_FILE:
+            self._set_faq(content)
+    
+    def _unload_file(self, name: str):
+        self.files.pop(name, None)
+        self.index.remove_source(name)
+        if name == PRICES_FILE:
+            self.prices, self.prices_by_category = {}, {}
+        elif name == FAQ_FILE:
+            self.faq = {}
+    
+    def get_fingerprint(self) -> str:
+        """Отпечаток текущего содержимого базы; меняется при любой правке файлов"""
+        self.refresh()
+        return self._fingerprint
+    
+    def get_files(self) -> dict:
+        """Содержимое всех файлов базы: {имя файла: текст}"""
+        self.refresh()
+        return dict(self.files)
     
     def load_prices(self):
         """Загрузить цены из файла"""
-        prices_file = "workshop-bot/data/knowledge_base/Цены на услуги.txt"
+        prices_file = os.path.join(self.directory, PRICES_FILE)
         if os.path.exists(prices_file):
             with open(prices_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-                self.prices = {
-                    "raw": content,
-                    "formatted": self._format_prices(content)
-                }
-                self.prices_by_category = self._parse_prices_by_category(content)
+                self._set_prices(f.read())
+    
+    def _set_prices(self, content):
+        self.prices = {
+            "raw": content,
+            "formatted": self._format_prices(content)
+        }
+        self.prices_by_category = self._parse_prices_by_category(content)
     
     def _parse_prices_by_category(self, content):
         """Разбить цены на категории"""
@@ -111,30 +256,35 @@ class KnowledgeLoader:
     
     def load_faq(self):
         """Загрузить FAQ из файла"""
-        faq_file = "workshop-bot/data/knowledge_base/Ответы на вопросы.md"
+        faq_file = os.path.join(self.directory, FAQ_FILE)
         if os.path.exists(faq_file):
             with open(faq_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-                self.faq = {
-                    "raw": content,
-                    "parsed": self._parse_faq(content)
-                }
+                self._set_faq(f.read())
+    
+    def _set_faq(self, content):
+        self.faq = {
+            "raw": content,
+            "parsed": self._parse_faq(content)
+        }
     
     def get_prices(self):
         """Получить форматированные цены"""
+        self.refresh()
         return self.prices.get('formatted', 'Цены не загружены')
     
     def get_price_raw(self):
         """Получить сырые цены"""
+        self.refresh()
         return self.prices.get('raw', '')
     
     def get_prices_by_category(self):
         """Получить цены разделённые по категориям"""
+        self.refresh()
         return self.prices_by_category
     
     def get_category_prices(self, category_key):
         """Получить цены для конкретной категории"""
-        categories = self.prices_by_category
+        categories = self.get_prices_by_category()
         
         category_map = {
             "tricot": "Ремонт трикотажа",
@@ -163,96 +313,98 @@ class KnowledgeLoader:
     
     def get_faq_answers(self):
         """Получить все ответы FAQ"""
+        self.refresh()
         return self.faq.get('parsed', {})
     
     def get_answer(self, question_key):
         """Получить ответ по вопросу"""
-        faq = self.faq.get('parsed', {})
+        faq = self.get_faq_answers()
         for q, answer in faq.items():
             if question_key.lower() in q.lower():
                 return answer
         return None
     
     def get_all_knowledge(self):
-        """Получить всё знание для GigaChat"""
-        prices = self.get_price_raw()
-        faq_text = "\n\n".join([f"В: {q}\nО: {a}" for q, a in self.faq.get('parsed', {}).items()])
-        return f"ПРАЙС-ЛИСТ:\n{prices}\n\nFAQ:\n{faq_text}"
+        """Получить всё знание для GigaChat (собирается один раз на версию базы)"""
+        self.refresh()
+        if self._all_knowledge is None:
+            prices = self.prices.get('raw', '')
+            faq_text = "\n\n".join([f"В: {q}\nО: {a}" for q, a in self.faq.get('parsed', {}).items()])
+            self._all_knowledge = f"ПРАЙС-ЛИСТ:\n{prices}\n\nFAQ:\n{faq_text}"
+        return self._all_knowledge
 
-    def search_knowledge(self, query: str) -> str:
+    def get_context(self, question: str, budget_tokens: int = KB_CONTEXT_TOKENS) -> str:
         """
-        Поиск ответа в базе знаний по ключевым словам.
-        Используется как фоллбэк при недоступности GigaChat.
+        Фрагменты базы знаний, относящиеся к вопросу, для системного промпта.
+        Фрагменты берутся по убыванию оценки BM25, пока помещаются в бюджет
+        токенов; одинаковые вопросы из разных файлов попадают один раз.
         """
-        query_lower = query.lower()
-        results = []
+        self.refresh()
+        hits = self.index.search(question, k=KB_CONTEXT_CANDIDATES)
+        if hits:
+            cutoff = hits[0][0] * KB_CONTEXT_MIN_RATIO
+            passages = [passage for score, passage in hits if score >= cutoff]
+        else:
+            passages = [p for p in self.index.passages if p.source == KB_DEFAULT_CONTEXT_SOURCE]
         
-        # Ключевые слова для поиска
-        keywords = {
-            'цен': ('prices', 'Информация о ценах'),
-            'прайс': ('prices', 'Прайс-лист'),
-            'стоим': ('prices', 'Стоимость услуг'),
-            'сколько': ('prices', 'Цены на услуги'),
-            'адрес': ('contacts', 'Контакты'),
-            'где': ('contacts', 'Как нас найти'),
-            'находит': ('contacts', 'Адрес мастерской'),
-            'метро': ('contacts', 'Как добраться'),
-            'телефон': ('contacts', 'Контакты'),
-            'whatsapp': ('contacts', 'Контакты'),
-            'график': ('schedule', 'График работы'),
-            'работает': ('schedule', 'Режим работы'),
-            'время': ('schedule', 'Часы работы'),
-            'выходн': ('schedule', 'График работы'),
-            'срок': ('timing', 'Сроки выполнения'),
-            'долго': ('timing', 'Время выполнения'),
-            'быстро': ('timing', 'Сроки'),
-            'срочн': ('urgent', 'Срочные услуги'),
-            'оплат': ('payment', 'Способы оплаты'),
-            'картой': ('payment', 'Оплата'),
-            'наличн': ('payment', 'Оплата'),
-            'гарант': ('warranty', 'Гарантия'),
-            'услуг': ('services', 'Наши услуги'),
-            'ремонт': ('services', 'Услуги ремонта'),
-            'подгонк': ('services', 'Подгонка одежды'),
-            'укорот': ('services', 'Подгонка одежды'),
-            'штопк': ('services', 'Художественная штопка'),
+        parts, seen, used = [], set(), 0
+        for passage in passages:
+            title_key = passage.title.lower().strip(' ?!.')
+            if title_key in seen:
+                continue
+            text = passage.text if passage.text.startswith(passage.title) else f"В: {passage.title}\nО: {passage.text}"
+            cost = estimate_tokens(text)
+            if used + cost > budget_tokens:
+                continue
+            parts.append(text)
+            seen.add(title_key)
+            used += cost
+        return "\n\n".join(parts)
+    
+    def find_answer(self, question: str) -> str:
+        """
+        Ответ из FAQ, если вопрос пользователя уверенно совпадает с вопросом базы:
+        высокая оценка BM25 и большинство слов вопроса есть в вопросе FAQ.
+        Фрагменты прайса и описаний готовым ответом не считаются.
+        """
+        self.refresh()
+        hits = self.index.search(question, k=1)
+        if not hits or hits[0][0] < KB_ANSWER_MIN_SCORE:
+            return None
+        passage = hits[0][1]
+        if passage.text.startswith(passage.title):
+            return None
+        terms = set(tokenize(question))
+        coverage = len(terms & set(tokenize(passage.title))) / len(terms)
+        return passage.text if coverage >= KB_ANSWER_MIN_COVERAGE else None
+    
+    def get_quick_answer(self, topic: str) -> str:
+        """Готовый ответ по теме FALLBACK_KEYWORDS (цены, контакты, график...)"""
+        answers = {
+            'prices': self._get_prices_fallback,
+            'contacts': self._get_contacts_fallback,
+            'schedule': self._get_schedule_fallback,
+            'timing': self._get_timing_fallback,
+            'urgent': self._get_timing_fallback,
+            'payment': self._get_payment_fallback,
+            'warranty': self._get_warranty_fallback,
+            'services': self._get_services_fallback,
         }
-        
-        matched_category = None
-        for keyword, (category, description) in keywords.items():
-            if keyword in query_lower:
-                matched_category = category
-                break
-        
-        if matched_category == 'prices':
-            return self._get_prices_fallback()
-        elif matched_category == 'contacts':
-            return self._get_contacts_fallback()
-        elif matched_category == 'schedule':
-            return self._get_schedule_fallback()
-        elif matched_category in ('timing', 'urgent'):
-            return self._get_timing_fallback()
-        elif matched_category == 'payment':
-            return self._get_payment_fallback()
-        elif matched_category == 'warranty':
-            return self._get_warranty_fallback()
-        elif matched_category == 'services':
-            return self._get_services_fallback()
-        
-        # Поиск в FAQ
-        faq_answer = self._search_faq(query_lower)
-        if faq_answer:
-            return faq_answer
-        
-        return None
+        answer = answers.get(topic)
+        return answer() if answer else None
     
-    def _search_faq(self, query: str) -> str:
-        """Поиск в FAQ по ключевым словам"""
-        faq = self.faq.get('parsed', {})
-        for question, answer in faq.items():
-            if any(word in question.lower() for word in query.split() if len(word) > 3):
-                return answer
-        return None
+    def search_knowledge(self, query: str) -> str:
+        """
+        Поиск ответа в базе знаний: сначала BM25 по всем файлам базы,
+        затем готовые ответы по ключевым словам.
+        Используется как фоллбэк при недоступности GigaChat.
+        """
+        self.refresh()
+        hits = self.index.search(query, k=1)
+        if hits and hits[0][0] >= KB_MIN_SCORE:
+            return hits[0][1].text
+        
+        return self.get_quick_answer(FALLBACK_KEYWORDS.first_category(query))
     
     def _get_prices_fallback(self) -> str:
         """Краткая информация о ценах"""
@@ -0,0 +1,115 @@
+"""
+Versioned schema migrations.
+
+Base.metadata.create_all() only creates missing tables, it never changes
+existing ones. Everything that has to reach databases created by an older
+version of the bot (new indexes, columns, data fixes) is added here as a
+numbered step. Applied versions are recorded in the schema_migrations
+table, so each step runs once per database.
+
+To add a migration, append (version, name, function) to MIGRATIONS with
+the next version number. The function receives an open Connection inside
+a transaction and must be safe to re-run (use checkfirst / IF NOT EXISTS).
+"""
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+
+from .database import (engine, Order, ChatHistory, User, SchemaMigration, _upsert_jobs,
+                       REVIEW_REQUEST_DELAY, CLIENT_REMINDER_DELAY, STUCK_ORDER_DELAY, MOSCOW_TZ)
+
+logger = logging.getLogger(__name__)
+
+
+def _create_model_indexes(*models):
+    """Create indexes declared in the models' __table_args__ that the table is missing"""
+    def migrate(connection):
+        for model in models:
+            for index in model.__table__.indexes:
+                index.create(bind=connection, checkfirst=True)
+    return migrate
+
+
+def _add_model_columns(model, *names):
+    """Add columns declared on the model that the existing table does not have yet"""
+    def migrate(connection):
+        existing = {c['name'] for c in inspect(connection).get_columns(model.__tablename__)}
+        for name in names:
+            if name in existing:
+                continue
+            column = model.__table__.c[name]
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f'ALTER TABLE {model.__tablename__} ADD COLUMN {name} {column_type}')
+    return migrate
+
+
+def _moscow_to_utc(value):
+    """Naive UTC for a timestamp written in Moscow time (completed_at, updated_at on status change)"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=MOSCOW_TZ)
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _backfill_order_jobs(connection):
+    """Schedule jobs for open orders that were created before scheduled_jobs existed.
+    due_at is naive UTC like the scheduler's clock; created_at and accepted_at are
+    already UTC, completed_at and status-change updated_at are Moscow time."""
+    orders = Order.__table__
+    now = datetime.utcnow()
+    rows = []
+    for o in connection.execute(orders.select().where(orders.c.status.in_(('new', 'accepted', 'completed')))):
+        if o.status == 'new' and not o.client_reminded:
+            rows.append(('client_reminder', o.id, (o.created_at or now) + CLIENT_REMINDER_DELAY))
+        elif o.status == 'accepted':
+            rows.append(('stuck_alert', o.id, (o.accepted_at or _moscow_to_utc(o.updated_at) or now) + STUCK_ORDER_DELAY))
+        elif o.status == 'completed' and not o.feedback_requested:
+            rows.append(('review_request', o.id, (_moscow_to_utc(o.completed_at) or now) + REVIEW_REQUEST_DELAY))
+    if rows:
+        _upsert_jobs(connection, rows)
+
+
+MIGRATIONS = [
+    (1, "composite indexes for orders and chat_history", _create_model_indexes(Order, ChatHistory)),
+    (2, "users.unreachable_at for broadcast delivery pruning", _add_model_columns(User, 'unreachable_at')),
+    (3, "scheduled_jobs for existing open orders", _backfill_order_jobs),
+]
+
+
+def get_applied_versions(connection) -> set:
+    """Versions already recorded in schema_migrations"""
+    return {row[0] for row in connection.execute(SchemaMigration.__table__.select().with_only_columns(
+        SchemaMigration.__table__.c.version))}
+
+
+def run_migrations() -> list:
+    """Apply pending migrations in order; returns the versions applied now"""
+    if not inspect(engine).has_table(SchemaMigration.__tablename__):
+        SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+
+    applied_now = []
+    with engine.connect() as connection:
+        applied = get_applied_versions(connection)
+
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            with engine.begin() as connection:
+                migrate(connection)
+                connection.execute(SchemaMigration.__table__.insert().values(
+                    version=version, name=name, applied_at=datetime.utcnow()))
+            applied_now.append(version)
+            logger.info(f"Migration {version} applied: {name}")
+        except IntegrityError:
+            # Another process (bot/web) applied it at the same time
+            logger.info(f"Migration {version} already applied by another process")
+        except Exception as e:
+            logger.error(f"Migration {version} ({name}) failed: {e}")
+            raise
+
+    return applied_now
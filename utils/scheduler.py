@@ -0,0 +1,138 @@
+"""
+Планировщик отложенных задач по заказам.
+
+Задачи лежат в таблице scheduled_jobs (одна строка на вид задачи и заказ)
+и ставятся самими заказами при смене статуса (см. _schedule_order_jobs_on_flush
+в database.py). Фоновый цикл забирает только задачи, срок которых наступил,
+выполняет их параллельно в пределах общего лимита Telegram и спит до
+ближайшего срока (но не дольше SCHEDULER_POLL_INTERVAL).
+
+Задача сначала «арендуется» (status=running, locked_until), поэтому после
+перезапуска бота выполненные задачи не повторяются, а прерванные
+подхватываются снова, когда истечёт аренда.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from telegram.error import RetryAfter, NetworkError, TelegramError
+
+from .broadcast import telegram_limiter, retry_after_seconds
+from .database import claim_due_jobs, finish_job, get_next_job_due
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_POLL_INTERVAL = int(os.getenv('SCHEDULER_POLL_INTERVAL', '60'))
+SCHEDULER_BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', '50'))
+SCHEDULER_CONCURRENCY = int(os.getenv('SCHEDULER_CONCURRENCY', '5'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+
+
+class JobScheduler:
+    """Выполнение задач из scheduled_jobs по сроку"""
+
+    def __init__(self):
+        self._handlers = {}
+        self._semaphore = asyncio.Semaphore(SCHEDULER_CONCURRENCY)
+
+    def register(self, kind: str, handler, batch: bool = False) -> None:
+        """
+        Зарегистрировать обработчик вида задач.
+        handler(application, job) возвращает None (готово) или datetime следующего запуска.
+        С batch=True обработчик получает список задач и возвращает {job.id: None | datetime}.
+        """
+        self._handlers[kind] = (handler, batch)
+
+    def start(self, application) -> None:
+        application.create_task(self._loop(application))
+
+    async def _loop(self, application) -> None:
+        while True:
+            processed = 0
+            try:
+                processed = await self.run_due(application)
+            except Exception as e:
+                logger.error(f"Scheduler error: {e}")
+
+            if processed >= SCHEDULER_BATCH_SIZE:
+                continue  # Есть ещё просроченные задачи
+
+            delay = SCHEDULER_POLL_INTERVAL
+            try:
+                next_due = await asyncio.to_thread(get_next_job_due)
+                if next_due:
+                    delay = min(delay, max(1.0, (next_due - datetime.utcnow()).total_seconds()))
+            except Exception as e:
+                logger.error(f"Scheduler error: {e}")
+            await asyncio.sleep(delay)
+
+    async def run_due(self, application) -> int:
+        """Выполнить все задачи, срок которых наступил; возвращает их количество"""
+        jobs = await asyncio.to_thread(claim_due_jobs, SCHEDULER_BATCH_SIZE)
+        if not jobs:
+            return 0
+
+        by_kind = {}
+        for job in jobs:
+            by_kind.setdefault(job.kind, []).append(job)
+
+        calls = []
+        for kind, kind_jobs in by_kind.items():
+            if kind not in self._handlers:
+                logger.error(f"No handler for scheduled job kind '{kind}'")
+                for job in kind_jobs:
+                    await asyncio.to_thread(finish_job, job.id, error=f"unknown kind {kind}", failed=True)
+                continue
+            handler, batch = self._handlers[kind]
+            if batch:
+                calls.append(self._run(application, handler, kind_jobs, batch=True))
+            else:
+                calls.extend(self._run(application, handler, [job]) for job in kind_jobs)
+
+        await asyncio.gather(*calls)
+        return len(jobs)
+
+    async def _run(self, application, handler, jobs: list, batch: bool = False) -> None:
+        async with self._semaphore:
+            try:
+                if batch:
+                    results = await handler(application, jobs) or {}
+                else:
+                    results = {jobs[0].id: await handler(application, jobs[0])}
+            except RetryAfter as e:
+                wait = retry_after_seconds(e)
+                telegram_limiter.pause(wait)
+                for job in jobs:
+                    await self._retry(job, str(e), datetime.utcnow() + timedelta(seconds=wait))
+                return
+            except NetworkError as e:
+                for job in jobs:
+                    await self._retry(job, str(e))
+                return
+            except TelegramError as e:
+                # Бот заблокирован, чат не найден и т.п. — повтор не поможет
+                logger.warning(f"Scheduled job {[j.id for j in jobs]} failed: {e}")
+                for job in jobs:
+                    await asyncio.to_thread(finish_job, job.id, error=str(e), failed=True)
+                return
+            except Exception as e:
+                logger.error(f"Scheduled job {[j.id for j in jobs]} error: {e}")
+                for job in jobs:
+                    await self._retry(job, str(e))
+                return
+
+        for job in jobs:
+            await asyncio.to_thread(finish_job, job.id, results.get(job.id))
+
+    async def _retry(self, job, error: str, retry_at: datetime = None) -> None:
+        """Повторить позже с экспоненциальной задержкой или отметить как failed"""
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            logger.error(f"Scheduled job {job.id} ({job.kind}) gave up after {job.attempts} attempts: {error}")
+            await asyncio.to_thread(finish_job, job.id, error=error, failed=True)
+            return
+        retry_at = retry_at or datetime.utcnow() + timedelta(seconds=60 * 2 ** (job.attempts - 1))
+        await asyncio.to_thread(finish_job, job.id, retry_at, error=error)
+
+
+scheduler = JobScheduler()
@@ -0,0 +1,201 @@
+"""
+Key-value state shared by the bot and web processes.
+
+Anti-spam mutes and rate windows, cached AI answers and similar
+short-lived state used to live in per-process dicts. That state was lost
+on every restart and invisible to the other process. It now goes through a
+StateBackend chosen by STATE_BACKEND:
+
+- memory: in-process dicts (the old behaviour, e.g. for development)
+- sqlite: a local SQLite file (STATE_DB_PATH) in WAL mode. It survives
+  restarts and is shared by all processes on the host, without an external
+  service.
+
+Values are JSON-serializable. Every entry lives in a namespace and may have
+a TTL; expired entries are never returned and are removed by purge_expired().
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite')
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'bot_state.db')
+
+
+class StateBackend(ABC):
+    """Interface of a namespaced key-value store with per-entry TTL"""
+
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self, namespace: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self, namespace: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def trim(self, namespace: str, max_items: int) -> None:
+        """Drop the oldest entries of a namespace beyond max_items"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def purge_expired(self) -> int:
+        """Remove expired entries of all namespaces; returns how many"""
+        raise NotImplementedError
+
+
+class MemoryStateBackend(StateBackend):
+    """Per-process dicts; entries are kept in least-recently-used order"""
+
+    def __init__(self):
+        self._data: Dict[str, "OrderedDict[str, tuple]"] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        entries = self._data.get(namespace)
+        if not entries:
+            return None
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            entries.pop(key, None)
+            return None
+        entries.move_to_end(key)
+        return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        entries = self._data.setdefault(namespace, OrderedDict())
+        entries[key] = (value, time.time() + ttl if ttl is not None else None)
+        entries.move_to_end(key)
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._data.get(namespace, {}).pop(key, None)
+
+    def clear(self, namespace: str) -> None:
+        self._data.pop(namespace, None)
+
+    def count(self, namespace: str) -> int:
+        return len(self._data.get(namespace, ()))
+
+    def trim(self, namespace: str, max_items: int) -> None:
+        entries = self._data.get(namespace)
+        with self._lock:
+            while entries and len(entries) > max_items:
+                entries.popitem(last=False)
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for entries in self._data.values():
+                expired = [k for k, (_, expires_at) in list(entries.items())
+                           if expires_at is not None and expires_at <= now]
+                for k in expired:
+                    entries.pop(k, None)
+                removed += len(expired)
+        return removed
+
+
+class SQLiteStateBackend(StateBackend):
+    """State in a local SQLite file, shared by every process that opens it"""
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._conn()  # create the table (and fail early if the file is not writable)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; a forked process (gunicorn worker) opens its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL, updated_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_state_expires ON state (expires_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO state (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, "
+            "expires_at = excluded.expires_at, updated_at = excluded.updated_at",
+            (namespace, key, json.dumps(value, ensure_ascii=False), now + ttl if ttl is not None else None, now)
+        )
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._conn().execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def clear(self, namespace: str) -> None:
+        self._conn().execute("DELETE FROM state WHERE namespace = ?", (namespace,))
+
+    def count(self, namespace: str) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, time.time())
+        ).fetchone()[0]
+
+    def trim(self, namespace: str, max_items: int) -> None:
+        # Oldest by last write: reads do not refresh entries here (unlike the memory backend)
+        self._conn().execute(
+            "DELETE FROM state WHERE namespace = ? AND key NOT IN ("
+            " SELECT key FROM state WHERE namespace = ? ORDER BY updated_at DESC LIMIT ?)",
+            (namespace, namespace, max_items)
+        )
+
+    def purge_expired(self) -> int:
+        return self._conn().execute(
+            "DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        ).rowcount
+
+
+def create_state_backend(kind: str = STATE_BACKEND) -> StateBackend:
+    """Backend by name; falls back to memory if the SQLite file cannot be opened"""
+    if kind == 'sqlite':
+        try:
+            return SQLiteStateBackend(STATE_DB_PATH)
+        except sqlite3.Error as e:
+            logger.error(f"State DB {STATE_DB_PATH} unavailable ({e}); keeping state in memory")
+    elif kind != 'memory':
+        logger.warning(f"Unknown STATE_BACKEND={kind}; keeping state in memory")
+    return MemoryStateBackend()
+
+
+state_store = create_state_backend()
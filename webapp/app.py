@@ -22,7 +22,7 @@ Configure environment variables (recommended):
 Note: templates and utils.database module should exist (same API as in your original code).
 """
 
-from flask import Flask, render_template, jsonify, request, redirect, url_for, session, Response, make_response, current_app
+from flask import Flask, render_template, jsonify, request, redirect, url_for, session, Response, current_app
 from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
 import sys
@@ -30,10 +30,10 @@ import os
 import secrets
 import html
 import logging
-import requests
 from dotenv import load_dotenv
-import io
 import csv
+import json
+import zlib
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_wtf import CSRFProtect
@@ -73,12 +73,16 @@ try:
         get_statistics, update_order_status, get_orders_by_status,
         get_all_reviews, get_review_stats, moderate_review, get_average_rating,
         get_order, delete_order, delete_orders_bulk, set_admin, get_user,
-        get_funnel_stats, get_daily_stats, get_abandonment_stats
+        get_funnel_stats, get_daily_stats, get_abandonment_stats,
+        build_order_filters, get_orders_page, get_order_status_counts,
+        get_order_years, get_user_order_counts, iter_orders, get_notification
     )
 except Exception as e:
     logger.critical(f"Failed to import database module: {e}")
     raise
 
+from webapp.notifications import notification_worker
+
 # ----------------------------
 # Configuration from env
 # ----------------------------
@@ -180,6 +184,10 @@ csrf = CSRFProtect(app)
 logger.info(f"ADMIN_USERNAME loaded: '{ADMIN_USERNAME}'")
 logger.info("Application initialized.")
 
+# The outbox sender is not started at import: with gunicorn --preload the import
+# runs in the master, and the thread would send alongside every worker's own.
+# Workers start it in post_fork (gunicorn.conf.py), the dev server in run_webapp().
+
 @app.before_request
 def log_request_info():
     app.logger.info(f"Входящий запрос: {request.method} {request.url}")
@@ -217,28 +225,12 @@ SERVICE_NAMES = {
 # ----------------------------
 # Helpers
 # ----------------------------
-def send_telegram_notification(user_id: int, message: str) -> bool:
-    """Send Telegram notification; returns True on success"""
+def send_telegram_notification(user_id: int, message: str):
+    """Queue a Telegram notification in the outbox; returns the outbox id (delivered in the background)"""
     if not BOT_TOKEN:
         logger.debug("BOT_TOKEN not configured; skipping Telegram notification")
-        return False
-    try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        data = {
-            "chat_id": user_id,
-            "text": message,
-            "parse_mode": "HTML"
-        }
-        response = requests.post(url, json=data, timeout=10)
-        if response.status_code == 200:
-            logger.info(f"Notification sent to user {user_id}")
-            return True
-        else:
-            logger.warning(f"Telegram API returned {response.status_code}: {response.text}")
-            return False
-    except Exception as e:
-        logger.error(f"Error sending Telegram notification: {e}")
-        return False
+        return None
+    return notification_worker.enqueue(user_id, message, parse_mode="HTML")
 
 
 def get_service_name(service_type):
@@ -281,58 +273,9 @@ def requires_auth(f):
     return decorated
 
 # ----------------------------
-# Centralized order filtering
+# Order list / export settings (filtering is done in SQL, see utils.database.build_order_filters)
 # ----------------------------
-
-def filter_orders(orders, *, user_id=None, date_from=None, date_to=None, period=None, month=None, year=None):
-    """Filter orders list based on provided parameters. Assumes orders have .created_at (datetime) and .user_id, .status."""
-    result = list(orders)
-    now = datetime.now()
-
-    if user_id is not None:
-        try:
-            uid = int(user_id)
-            result = [o for o in result if getattr(o, 'user_id', None) == uid]
-        except (ValueError, TypeError):
-            pass
-
-    if date_from and date_to:
-        try:
-            start = datetime.strptime(date_from, '%Y-%m-%d')
-            end = datetime.strptime(date_to, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-            result = [o for o in result if getattr(o, 'created_at', None) and start <= o.created_at <= end]
-        except ValueError:
-            pass
-    elif period:
-        if period == 'today':
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            result = [o for o in result if getattr(o, 'created_at', None) and o.created_at >= start_date]
-        elif period == 'yesterday':
-            start_date = (now - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-            end_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            result = [o for o in result if getattr(o, 'created_at', None) and start_date <= o.created_at < end_date]
-        elif period == 'week':
-            start_date = now - timedelta(days=7)
-            result = [o for o in result if getattr(o, 'created_at', None) and o.created_at >= start_date]
-        elif period == 'month':
-            start_date = now - timedelta(days=30)
-            result = [o for o in result if getattr(o, 'created_at', None) and o.created_at >= start_date]
-
-    if month and year:
-        try:
-            m = int(month)
-            y = int(year)
-            result = [o for o in result if getattr(o, 'created_at', None) and o.created_at.month == m and o.created_at.year == y]
-        except ValueError:
-            pass
-    elif year:
-        try:
-            y = int(year)
-            result = [o for o in result if getattr(o, 'created_at', None) and o.created_at.year == y]
-        except ValueError:
-            pass
-
-    return result
+ORDERS_PAGE_SIZE = int(os.getenv('ORDERS_PAGE_SIZE', '50'))
 
 # ----------------------------
 # Routes
@@ -448,47 +391,32 @@ def orders():
     month_filter = request.args.get('month', None)
     year_filter = request.args.get('year', None)
 
-    all_orders = get_all_orders(limit=1000)
+    before = request.args.get('before', None)
 
-    filtered = filter_orders(all_orders,
-                             user_id=user_id_filter,
-                             date_from=date_from,
-                             date_to=date_to,
-                             period=period,
-                             month=month_filter,
-                             year=year_filter)
-
-    counts = {
-        'all': len(filtered),
-        'new': len([o for o in filtered if getattr(o, 'status', 'none') == 'new']),
-        'accepted': len([o for o in filtered if getattr(o, 'status', 'none') == 'accepted']),
-        'in_progress': len([o for o in filtered if getattr(o, 'status', 'none') == 'in_progress']),
-        'completed': len([o for o in filtered if getattr(o, 'status', 'none') == 'completed']),
-        'issued': len([o for o in filtered if getattr(o, 'status', 'none') == 'issued']),
-        'cancelled': len([o for o in filtered if getattr(o, 'status', 'none') == 'cancelled']),
-    }
-
-    if status:
-        orders_list = [o for o in filtered if getattr(o, 'status', 'none') == status]
-    else:
-        orders_list = filtered
+    filters = build_order_filters(user_id=user_id_filter,
+                                  date_from=date_from,
+                                  date_to=date_to,
+                                  period=period,
+                                  month=month_filter,
+                                  year=year_filter)
 
-    orders_list = sorted(orders_list, key=lambda x: getattr(x, 'created_at', datetime.min) or datetime.min, reverse=True)
+    # Ключ кэша — только параметры фильтра (без статуса и курсора)
+    filter_key = '|'.join(str(v) for v in (user_id_filter, date_from, date_to, period, month_filter, year_filter))
+    status_counts = get_order_status_counts(filters, cache_key=filter_key)
+    counts = {key: status_counts.get(key, 0)
+              for key in ('all', 'new', 'accepted', 'in_progress', 'completed', 'issued', 'cancelled')}
 
-    years_available = sorted({o.created_at.year for o in get_all_orders(limit=1000) if getattr(o, 'created_at', None)}, reverse=True)
-    if not years_available:
-        years_available = [datetime.now().year]
+    orders_list, next_cursor = get_orders_page(filters, status=status, limit=ORDERS_PAGE_SIZE, before=before)
+
+    years_available = get_order_years() or [datetime.now().year]
 
     # Получаем количество заказов для каждого пользователя для пометки "Постоянный клиент"
-    user_order_counts = {}
-    from utils.database import get_session, Order
-    session = get_session()
-    try:
-        from sqlalchemy import func
-        counts_data = session.query(Order.user_id, func.count(Order.id)).group_by(Order.user_id).all()
-        user_order_counts = {str(uid): count for uid, count in counts_data}
-    finally:
-        session.close()
+    user_order_counts = get_user_order_counts([o.user_id for o in orders_list])
+
+    # Ссылки пагинации сохраняют текущие фильтры
+    page_args = {k: v for k, v in request.args.items() if k != 'before' and v}
+    next_url = url_for('orders', **page_args, before=next_cursor) if next_cursor else None
+    first_url = url_for('orders', **page_args) if before else None
 
     return render_template('orders.html',
                           orders=orders_list,
@@ -501,7 +429,10 @@ def orders():
                           month_filter=month_filter,
                           year_filter=year_filter,
                           years_available=years_available,
-                          user_order_counts=user_order_counts)
+                          user_order_counts=user_order_counts,
+                          total_count=status_counts.get(status, 0) if status else counts['all'],
+                          next_url=next_url,
+                          first_url=first_url)
 
 
 @app.route('/users')
@@ -634,16 +565,37 @@ def api_update_order_status(order_id):
     success = update_order_status(order_id, new_status)
 
     if success:
+        notification_id = None
         if new_status in STATUS_MESSAGES and user_id:
             message = STATUS_MESSAGES[new_status].format(order_id=order_id)
-            notification_sent = send_telegram_notification(user_id, message)
-            logger.info(f"Status update notification for order {order_id}: sent={notification_sent}")
+            notification_id = send_telegram_notification(user_id, message)
+            logger.info(f"Status update notification for order {order_id}: queued as {notification_id}")
 
-        return jsonify({'success': True, 'order_id': order_id, 'status': new_status})
+        return jsonify({'success': True, 'order_id': order_id, 'status': new_status,
+                        'notification_id': notification_id})
     else:
         return jsonify({'error': 'Failed to update status'}), 500
 
 
+@app.route('/api/notifications/<int:notification_id>')
+@requires_auth
+@csrf.exempt
+def api_notification_status(notification_id):
+    item = get_notification(notification_id)
+    if not item:
+        return jsonify({'error': 'Notification not found'}), 404
+    if item.status in ('pending', 'sending'):
+        notification_worker.ensure_started()
+    return jsonify({
+        'id': item.id,
+        'status': item.status,
+        'attempts': item.attempts or 0,
+        'error': item.last_error,
+        'created_at': item.created_at.isoformat() if item.created_at else None,
+        'sent_at': item.sent_at.isoformat() if item.sent_at else None
+    })
+
+
 @app.route('/api/order/<int:order_id>/confirmation', methods=['POST'])
 @requires_auth
 @csrf.exempt
@@ -690,58 +642,111 @@ def api_toggle_admin(user_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+EXPORT_STATUS_LABELS = {
+    'new': 'Новый',
+    'in_progress': 'В работе',
+    'completed': 'Готов',
+    'issued': 'Выдан',
+    'cancelled': 'Отменён'
+}
+EXPORT_CHUNK_ROWS = 500
+
+
+class _LineBuffer:
+    """File-like object for csv.writer that just hands back each written line"""
+    def write(self, value):
+        return value
+
+
+def _export_csv_chunks(orders):
+    """Yield the CSV export in chunks of EXPORT_CHUNK_ROWS rows"""
+    writer = csv.writer(_LineBuffer(), delimiter=';')
+    # BOM for Excel (Windows) compatibility
+    chunk = ['\ufeff', writer.writerow(['ID', 'Услуга', 'Клиент', 'Телефон', 'Статус', 'Дата создания'])]
+    for order in orders:
+        chunk.append(writer.writerow([
+            order.id,
+            SERVICE_NAMES.get(order.service_type, order.service_type or ''),
+            order.client_name or '',
+            order.client_phone or '',
+            EXPORT_STATUS_LABELS.get(order.status, order.status),
+            order.created_at.strftime('%d.%m.%Y %H:%M') if order.created_at else ''
+        ]))
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _export_ndjson_chunks(orders):
+    """Yield orders as newline-delimited JSON (one object per line)"""
+    chunk = []
+    for order in orders:
+        chunk.append(json.dumps({
+            'id': order.id,
+            'user_id': order.user_id,
+            'service_type': order.service_type,
+            'service_name': SERVICE_NAMES.get(order.service_type, order.service_type),
+            'client_name': order.client_name,
+            'client_phone': order.client_phone,
+            'status': order.status,
+            'created_at': order.created_at.isoformat() if order.created_at else None,
+            'ready_date': order.ready_date,
+        }, ensure_ascii=False) + '\n')
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _gzip_chunks(chunks):
+    """Compress a stream of text chunks on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
 @app.route('/api/orders/export-csv')
 @requires_auth
 @csrf.exempt
 def api_export_csv():
+    """Stream orders as CSV (default) or NDJSON (?format=ndjson), optionally gzipped (?gzip=1)"""
     status = request.args.get('status', None)
-    period = request.args.get('period', None)
-    date_from = request.args.get('date_from', None)
-    date_to = request.args.get('date_to', None)
-    month_filter = request.args.get('month', None)
-    year_filter = request.args.get('year', None)
-
-    all_orders = get_all_orders(limit=1000)
-
-    filtered = filter_orders(all_orders,
-                             date_from=date_from,
-                             date_to=date_to,
-                             period=period,
-                             month=month_filter,
-                             year=year_filter)
-
-    if status:
-        filtered = [o for o in filtered if getattr(o, 'status', None) == status]
-
-    STATUS_LABELS = {
-        'new': 'Новый',
-        'in_progress': 'В работе',
-        'completed': 'Готов',
-        'issued': 'Выдан',
-        'cancelled': 'Отменён'
-    }
-
-    output = io.StringIO()
-    # BOM for Excel (Windows) compatibility
-    output.write('\ufeff')
-    writer = csv.writer(output, delimiter=';')
-    writer.writerow(['ID', 'Услуга', 'Клиент', 'Телефон', 'Статус', 'Дата создания'])
-
-    for order in filtered:
-        writer.writerow([
-            getattr(order, 'id', ''),
-            SERVICE_NAMES.get(getattr(order, 'service_type', None), getattr(order, 'service_type', '') or ''),
-            getattr(order, 'client_name', '') or '',
-            getattr(order, 'client_phone', '') or '',
-            STATUS_LABELS.get(getattr(order, 'status', None), getattr(order, 'status', '')),
-            order.created_at.strftime('%d.%m.%Y %H:%M') if getattr(order, 'created_at', None) else ''
-        ])
-
-    output.seek(0)
-    filename = f"orders_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+    export_format = request.args.get('format', 'csv')
+    use_gzip = request.args.get('gzip') in ('1', 'true', 'yes')
+
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Unsupported format'}), 400
+
+    filters = build_order_filters(user_id=request.args.get('user_id', None),
+                                  date_from=request.args.get('date_from', None),
+                                  date_to=request.args.get('date_to', None),
+                                  period=request.args.get('period', None),
+                                  month=request.args.get('month', None),
+                                  year=request.args.get('year', None))
+
+    orders = iter_orders(filters, status=status, chunk_size=EXPORT_CHUNK_ROWS)
+    if export_format == 'ndjson':
+        body = _export_ndjson_chunks(orders)
+        mimetype, ext = 'application/x-ndjson', 'ndjson'
+    else:
+        body = _export_csv_chunks(orders)
+        mimetype, ext = 'text/csv', 'csv'
+
+    filename = f"orders_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
+    if use_gzip:
+        body = _gzip_chunks(body)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    response = Response(body, mimetype=mimetype)
+    if not use_gzip:
+        response.headers['Content-Type'] = f'{mimetype}; charset=utf-8'
     response.headers['Content-Disposition'] = f'attachment; filename={filename}'
     return response
 
@@ -820,6 +825,10 @@ def server_error(e):
 def run_webapp():
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('FLASK_ENV') == 'development'
+    # With the debug reloader only the child process serves requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Deliver notifications left in the outbox by a previous run
+        notification_worker.ensure_started()
     app.run(host='0.0.0.0', port=port, debug=debug)
 
 
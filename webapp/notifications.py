@@ -0,0 +1,169 @@
+"""
+Telegram notification outbox worker for the web admin.
+
+Request handlers only insert a row into notification_outbox
+(enqueue_notification) and return its id. A daemon thread per process
+leases due rows, sends them through one pooled requests.Session
+(keep-alive connections to api.telegram.org) at no more than
+OUTBOX_RATE messages per second, and records the result:
+
+- 200: sent
+- 429: retried after Telegram's retry_after
+- 5xx / network errors: retried with exponential backoff, up to OUTBOX_MAX_ATTEMPTS
+- other 4xx (blocked bot, chat not found): failed
+
+Rows are leased in the database, so several web workers can run the
+loop at once and rows left behind by a crashed process are picked up
+again when the lease ends.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.database import (enqueue_notification, claim_notifications, finish_notification,
+                            get_next_notification_due)
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_RATE = float(os.getenv('OUTBOX_RATE', '20'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '20'))
+OUTBOX_HTTP_TIMEOUT = float(os.getenv('OUTBOX_HTTP_TIMEOUT', '10'))
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+
+
+class NotificationWorker:
+    """Delivers notification_outbox rows from a background thread"""
+
+    def __init__(self, token: str = None, rate: float = OUTBOX_RATE):
+        self.token = token
+        self.min_interval = 1.0 / rate if rate > 0 else 0.0
+        self._last_send = 0.0
+        self._session = None
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def _http(self) -> requests.Session:
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    def ensure_started(self):
+        """Start the thread in this process (also after a fork, e.g. gunicorn --preload)"""
+        if not self.token:
+            return
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._session = None  # connections must not be shared with the parent process
+                    self._thread = threading.Thread(target=self._run, name="notification-outbox", daemon=True)
+                    self._thread.start()
+
+    def enqueue(self, chat_id: int, text: str, parse_mode: str = 'HTML'):
+        """Queue a message and wake the worker; returns the outbox id"""
+        notification_id = enqueue_notification(chat_id, text, parse_mode)
+        if notification_id and self.token:
+            self.ensure_started()
+            self._wake.set()
+        elif notification_id:
+            logger.debug("BOT_TOKEN not configured; notification stays in the outbox")
+        return notification_id
+
+    def _run(self):
+        while True:
+            try:
+                processed = self.deliver_due()
+            except Exception as e:
+                logger.error(f"Notification outbox error: {e}")
+                processed = 0
+            if processed >= OUTBOX_BATCH_SIZE:
+                continue
+
+            timeout = OUTBOX_POLL_INTERVAL
+            try:
+                next_due = get_next_notification_due()
+                if next_due:
+                    timeout = min(timeout, max(0.05, (next_due - datetime.utcnow()).total_seconds()))
+            except Exception as e:
+                logger.error(f"Notification outbox error: {e}")
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def deliver_due(self) -> int:
+        """Send all due outbox rows; returns how many were processed"""
+        items = claim_notifications(OUTBOX_BATCH_SIZE)
+        for item in items:
+            self._deliver(item)
+        return len(items)
+
+    def _throttle(self):
+        wait = self._last_send + self.min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_send = time.monotonic()
+
+    def _deliver(self, item):
+        self._throttle()
+        try:
+            response = self._http().post(
+                f"{TELEGRAM_API_URL}/bot{self.token}/sendMessage",
+                json={"chat_id": item.chat_id, "text": item.text, "parse_mode": item.parse_mode},
+                timeout=OUTBOX_HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            self._retry(item, self._network_error(e))
+            return
+
+        if response.status_code == 200:
+            finish_notification(item.id, 'sent')
+            logger.info(f"Notification {item.id} sent to user {item.chat_id}")
+            return
+
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        error = f"{response.status_code}: {payload.get('description') or response.text[:200]}"
+
+        if response.status_code == 429:
+            retry_after = (payload.get('parameters') or {}).get('retry_after', 1)
+            # Telegram asks every sender to slow down, not just this message
+            self._last_send = time.monotonic() + retry_after
+            self._retry(item, error, datetime.utcnow() + timedelta(seconds=retry_after))
+        elif response.status_code >= 500:
+            self._retry(item, error)
+        else:
+            logger.warning(f"Notification {item.id} to {item.chat_id} rejected: {error}")
+            finish_notification(item.id, 'failed', error=error)
+
+    def _network_error(self, e: Exception) -> str:
+        """Short error text without the bot token (request exceptions include the URL)"""
+        message = str(e)
+        if self.token:
+            for form in (self.token, quote(self.token, safe='')):
+                message = message.replace(form, '***')
+        return f"network: {type(e).__name__}: {message[:200]}"
+
+    def _retry(self, item, error: str, retry_at: datetime = None):
+        if item.attempts >= OUTBOX_MAX_ATTEMPTS:
+            logger.error(f"Notification {item.id} gave up after {item.attempts} attempts: {error}")
+            finish_notification(item.id, 'failed', error=error)
+            return
+        retry_at = retry_at or datetime.utcnow() + timedelta(seconds=2 ** item.attempts)
+        finish_notification(item.id, 'pending', retry_at=retry_at, error=error)
+
+
+notification_worker = NotificationWorker(os.getenv('BOT_TOKEN'))